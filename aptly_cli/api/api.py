@@ -6,10 +6,168 @@ Instances of this class will be able to talk
 to the Aptly REST API remotely .
 """
 
+import codecs
 import json
 import requests
 import os
-from ConfigParser import ConfigParser
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from aptly_cli.api.workers import run_bounded
+from aptly_cli.api.cache import SnapshotCache
+from aptly_cli.api.metrics import route_template
+from aptly_cli.api.scheduler import RequestScheduler, scheduled, READ, MUTATE
+from aptly_cli.config.config import get_config, reload_config
+from aptly_cli.util.package_ref import parse_refs, keys_of
+
+# Limits of a single multipart request, when uploading many files
+UPLOAD_MAX_FILES = 20
+UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+
+# Retries of a deletion failing due to a busy aptly database
+DELETE_RETRIES = 3
+DELETE_BACKOFF = 0.5
+
+# Parts of aptly error messages, which signal a temporarily locked database
+_LOCK_ERRORS = ('lock', 'temporarily unavailable', 'timeout')
+
+# Bytes read from the socket at once, when decoding streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Characters, which may follow a complete element of a JSON array
+_ARRAY_DELIMITERS = u',] \t\r\n'
+
+
+def _response_error(resp):
+    """ _response_error
+    Returns the error message of a decoded aptly response, None if it contains no error.
+    """
+    if isinstance(resp, list) and resp and isinstance(resp[0], dict):
+        resp = resp[0]
+    if isinstance(resp, dict) and 'error' in resp:
+        return resp['error']
+    return None
+
+
+def _iter_json_array(resp, chunk_size=STREAM_CHUNK_SIZE):
+    """ _iter_json_array
+    Decodes a JSON array incrementally from a streamed response and yields
+    one element at a time, so only a single element is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = resp.iter_content(chunk_size)
+    buf = u''
+    pos = 0
+    exhausted = False
+    in_array = False
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+
+        if pos < len(buf):
+            if not in_array:
+                if buf[pos] != u'[':
+                    rest = buf[pos:] + ''.join(utf8.decode(c) for c in chunks) + utf8.decode('', True)
+                    raise ValueError('Expected a JSON array, got: ' + rest[:200])
+                in_array = True
+                pos += 1
+                continue
+            if buf[pos] == u']':
+                return
+            if buf[pos] == u',':
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+                end = None
+            # An element not followed by a delimiter might be cut off (e.g. numbers)
+            if end is not None and (exhausted or (end < len(buf) and buf[end] in _ARRAY_DELIMITERS)):
+                yield item
+                pos = end
+                continue
+        elif exhausted:
+            raise ValueError('Unexpected end of JSON array')
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buf = buf[pos:] + utf8.decode('', True)
+        else:
+            buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+
+
+class _InstrumentedSession(requests.Session):
+
+    """ _InstrumentedSession
+    Session calling the request hooks after every request, see AptlyApiRequests.add_request_hook.
+    Streamed responses are recorded when closed, once their body has been read.
+    """
+
+    def __init__(self):
+        super(_InstrumentedSession, self).__init__()
+        self.request_hooks = []
+        self._local = threading.local()
+
+    @property
+    def attempt(self):
+        """ attempt
+        Attempt number of the requests sent by the current thread, set while retrying.
+        """
+        return getattr(self._local, 'attempt', 1)
+
+    @attempt.setter
+    def attempt(self, value):
+        self._local.attempt = value
+
+    def _record(self, record, start):
+        record['Seconds'] = time.time() - start
+        for hook in self.request_hooks:
+            hook(record)
+
+    def send(self, request, **kwargs):
+        if not self.request_hooks:
+            return super(_InstrumentedSession, self).send(request, **kwargs)
+
+        body = request.body
+        record = {
+            'Method': request.method,
+            'Route': route_template(request.url),
+            'Url': request.url,
+            'Status': None,
+            'RequestBytes': len(body) if isinstance(body, basestring) else 0,
+            'ResponseBytes': 0,
+            'Seconds': 0.0,
+            'Attempt': self.attempt
+        }
+        start = time.time()
+        try:
+            r = super(_InstrumentedSession, self).send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(record, start)
+            raise
+
+        record['Status'] = r.status_code
+        if not kwargs.get('stream'):
+            record['ResponseBytes'] = len(r.content or '')
+            self._record(record, start)
+            return r
+
+        close = r.close
+
+        def close_recorded():
+            # recorded once, closing again goes to the response itself
+            r.close = close
+            record['ResponseBytes'] = r.raw.tell() if hasattr(r.raw, 'tell') else 0
+            self._record(record, start)
+            close()
+        r.close = close_recorded
+        return r
 
 
 class AptlyApiRequests(object):
@@ -19,25 +177,32 @@ class AptlyApiRequests(object):
     to the Aptly REST API remotely.
     """
 
-    def __init__(self):
+    def __init__(self, config=None):
         """
-        Pass url and port to the constructor
-        to initialize instance.
+        Pass a Config to the constructor, otherwise the
+        config of this process (see aptly_cli.config) is used.
         """
         self.configfile = None
-        cfg_file = self.get_config_from_file()
+        self.config = config if config is not None else get_config()
 
-        if cfg_file is not None:
-            basic_url = cfg_file['basic_url']
-            port = cfg_file['port']
-        else:
-            basic_url = 'http://localhost'
-            port = ':9003'
+        if not self.config.found:
             print "No Config file found, take default values"
 
         self.headers = {'content-type': 'application/json'}
-
-        url = basic_url + port
+        self.session = self._create_session(
+            self.config.pool_connections,
+            self.config.pool_maxsize,
+            self.config.pool_block,
+            self.config.keep_alive)
+        self.scheduler = RequestScheduler(self.config.max_reads, self.config.max_mutations)
+        self._init_routes()
+        self._init_cache()
+
+    def _init_routes(self):
+        """ _init_routes
+        Builds the api routes from the configured url.
+        """
+        url = self.config.url
 
         # self values
         self.cfg = {
@@ -49,13 +214,91 @@ class AptlyApiRequests(object):
             'route_pub': url + '/api/publish/',
             'route_graph': url + '/api/graph/',
             'route_vers': url + '/api/version/',
+        }
 
-            # Number of packages to have left
-            # 'save_last_pkg': 10,
+    def _init_cache(self):
+        """ _init_cache
+        Sets up the on-disk cache of snapshot data, unless disabled by a size of 0.
+        """
+        self.cache = None
+        if self.config.cache_max_mb > 0:
+            self.cache = SnapshotCache(self.config.cache_dir,
+                                       self.config.cache_max_mb * 1024 * 1024,
+                                       self.config.url)
 
-            # Number of snapshots to have left
-            # 'save_last_snap': 3
-        }
+    @staticmethod
+    def _cache_params(kind, created, param=None):
+        """ _cache_params
+        Returns the cache key of a snapshot request. The creation time of the snapshot
+        tells apart snapshots deleted and re-created under the same name.
+        """
+        key = {'kind': kind, 'created': created}
+        for name, value in (param or {}).items():
+            key[name] = unicode(value)
+        return key
+
+    def _snapshot_created(self, snapshot_name):
+        """ _snapshot_created
+        Returns the creation time of a snapshot as reported by aptly, None if it can't be shown.
+        """
+        info = self.snapshot_show(snapshot_name)
+        return info.get(u'CreatedAt') if isinstance(info, dict) else None
+
+    def reload_config(self):
+        """ reload_config
+        Parses the config file again and rebuilds the routes.
+        Connection pool and scheduler settings keep their values until the next instance.
+        """
+        self.config = reload_config()
+        self._init_routes()
+        self._init_cache()
+        return self.config
+
+    @staticmethod
+    def _create_session(pool_connections, pool_maxsize, pool_block, keep_alive):
+        """ _create_session
+        Returns a requests session backed by a connection pool, which is shared by all api calls.
+        pool_connections is the number of hosts to keep pools for, pool_maxsize the number of
+        connections kept per host. With pool_block set, callers wait for a free connection instead
+        of opening additional ones. The pool is thread-safe, so one instance can serve worker threads.
+        """
+        session = _InstrumentedSession()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        """ close
+        Closes all pooled connections.
+        """
+        self.session.close()
+
+    def add_request_hook(self, hook):
+        """ add_request_hook
+        Calls hook after every HTTP request with a dict describing it, e.g. to collect
+        metrics (see aptly_cli.api.metrics). Hooks run in the thread sending the request.
+
+        Method - [string]  HTTP method
+        Route - [string]  route template, e.g. /api/snapshots/:name
+        Url - [string]  requested url
+        Status - [int]  HTTP status, null if no response was received
+        RequestBytes - [int]  size of the request body
+        ResponseBytes - [int]  size of the response body as received
+        Seconds - [float]  latency, until the body has been read
+        Attempt - [int]  1, or the number of the attempt if the request is retried
+        """
+        self.session.request_hooks.append(hook)
+
+    def remove_request_hook(self, hook):
+        """ remove_request_hook
+        Stops calling a hook added by add_request_hook.
+        """
+        self.session.request_hooks.remove(hook)
 
     @staticmethod
     def _out(arg_list):
@@ -69,32 +312,17 @@ class AptlyApiRequests(object):
     def get_config_from_file():
         """
         Returns a dictonary of config values read out from file
+        The file is parsed only once per process, see aptly_cli.config.
         """
-        home = os.path.expanduser("~")
-        name = home + '/aptly-cli.conf'
-
-        config_file = ConfigParser()
-        if not config_file.read(name):
-            cfg_file = None
-        else:
-            cfg_file = {
-                # general
-                'basic_url': config_file.get('general', 'basic_url'),
-                'port': config_file.get('general', 'port'),
-                'prefixes_mirrors': config_file.get('general', 'prefixes_mirrors'),
-                'save_last_snap': config_file.get('general', 'save_last_snap'),
-                'save_last_pkg': config_file.get('general', 'save_last_pkg'),
-                'repos_to_clean': config_file.get('general', 'repos_to_clean'),
-                'package_prefixes': config_file.get('general', 'package_prefixes'),
-                # 3rd party
-                'repos': config_file.get('3rd_party', 'repos'),
-                'staging_snap_pre_post': config_file.get('3rd_party', 'staging_snap_pre_post')
-            }
-        return cfg_file
+        config = get_config()
+        if not config.found:
+            return None
+        return config.as_dict()
 
     ###################
     # LOCAL REPOS API #
     ###################
+    @scheduled(MUTATE)
     def repo_create(self, repo_name, data=None):
         """
         POST /api/repos
@@ -124,14 +352,15 @@ class AptlyApiRequests(object):
                 'DefaultComponent': data.default_component
             }
 
-        r = requests.post(self.cfg['route_repo'][:-1],
-                          data=json.dumps(post_data),
-                          headers=self.headers)
+        r = self.session.post(self.cfg['route_repo'][:-1],
+                              data=json.dumps(post_data),
+                              headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(READ)
     def repo_show(self, repo_name):
         """
         SHOW
@@ -151,11 +380,12 @@ class AptlyApiRequests(object):
         Example:
         $ curl http://localhost:8080/api/repos/aptly-repo
         """
-        r = requests.get(self.cfg['route_repo'] + repo_name, headers=self.headers)
+        r = self.session.get(self.cfg['route_repo'] + repo_name, headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(READ)
     def repo_show_packages(self, repo_name, pkg_to_search=None, with_deps=0, detail='compact'):
         """
         SHOW PACKAGES/SEARCH
@@ -184,12 +414,71 @@ class AptlyApiRequests(object):
             }
         url = str(self.cfg['route_repo']) + str(repo_name) + '/packages'
 
-        r = requests.get(url, params=param, headers=self.headers)
+        r = self.session.get(url, params=param, headers=self.headers)
 #       raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    def repo_iter_packages(self, repo_name, pkg_to_search=None, with_deps=0, detail='compact'):
+        """
+        SHOW PACKAGES/SEARCH (STREAMED)
+        GET /api/repos/:name/packages
+        Same as repo_show_packages, but returns a generator, which decodes the response while it
+        is received and yields one package at a time. Use it for huge repos.
+        """
+        url = str(self.cfg['route_repo']) + str(repo_name) + '/packages'
+        return self._iter_packages(url, pkg_to_search, with_deps, detail)
+
+    def repo_iter_package_refs(self, repo_name, pkg_to_search=None, with_deps=0):
+        """
+        SHOW PACKAGES/SEARCH (PACKAGE REFS)
+        GET /api/repos/:name/packages
+        Same as repo_iter_packages in compact format, but yields every package key parsed as PackageRef.
+        """
+        return parse_refs(self.repo_iter_packages(repo_name, pkg_to_search, with_deps))
+
+    @scheduled(READ)
+    def _iter_packages(self, url, pkg_to_search, with_deps, detail, snapshot_name=None):
+        """ _iter_packages
+        Streams a package list from url and yields one package at a time.
+        Package lists of snapshots are served from and written to the cache.
+        """
+        param = {
+            'withDeps': with_deps,
+            'format': detail
+        }
+        if pkg_to_search is not None:
+            param['q'] = pkg_to_search
+
+        writer = None
+        created = None
+        if snapshot_name is not None and self.cache is not None:
+            created = self._snapshot_created(snapshot_name)
+        if created is not None:
+            cache_params = self._cache_params('packages', created, param)
+            cached = self.cache.iter(snapshot_name, cache_params)
+            if cached is not None:
+                for pack in cached:
+                    yield pack
+                return
+            writer = self.cache.writer(snapshot_name, cache_params)
+
+        r = self.session.get(url, params=param, headers=self.headers, stream=True)
+        try:
+            for pack in _iter_json_array(r):
+                if writer is not None:
+                    writer.write(pack)
+                yield pack
+            if writer is not None and r.status_code == 200:
+                writer.commit()
+                writer = None
+        finally:
+            r.close()
+            if writer is not None:
+                writer.abort()
+
+    @scheduled(MUTATE)
     def repo_edit(self, repo_name, data=None):
         """
         EDIT
@@ -221,14 +510,15 @@ class AptlyApiRequests(object):
                 'DefaultComponent': data.default_component
             }
 
-        r = requests.put(self.cfg['route_repo'] + repo_name,
-                         data=json.dumps(data),
-                         headers=self.headers)
+        r = self.session.put(self.cfg['route_repo'] + repo_name,
+                             data=json.dumps(data),
+                             headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(READ)
     def repo_list(self):
         """
         LIST
@@ -238,12 +528,13 @@ class AptlyApiRequests(object):
         Example:
         $ curl http://localhost:8080/api/repos
         """
-        r = requests.get(self.cfg['route_repo'], headers=self.headers)
+        r = self.session.get(self.cfg['route_repo'], headers=self.headers)
 #        r.raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    @scheduled(MUTATE)
     def repo_delete(self, repo_name):
         """
         DELETE
@@ -260,13 +551,14 @@ class AptlyApiRequests(object):
         404 repository with such name doesn’t exist
         409 repository can’t be dropped ( self, reason in the message)
         """
-        r = requests.delete(self.cfg['route_repo'] + repo_name,
-                            headers=self.headers)
+        r = self.session.delete(self.cfg['route_repo'] + repo_name,
+                                headers=self.headers)
 #        r.raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    @scheduled(MUTATE)
     def repo_add_package_from_upload(self, repo_name, dir_name, file_name=None, params=None):
         """
         ADD PACKAGES FROM UPLOADED FILE/DIRECTORY
@@ -314,14 +606,15 @@ class AptlyApiRequests(object):
                 'forceReplace': 0
             }
 
-        r = requests.post(url,
-                          params=query_param,
-                          headers=self.headers)
+        r = self.session.post(url,
+                              params=query_param,
+                              headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(MUTATE)
     def repo_add_packages_by_key(self, repo_name, package_key_list):
         """
         ADD PACKAGES BY KEY
@@ -333,7 +626,7 @@ class AptlyApiRequests(object):
         constraint that conflicting packages can’t be part of the same local repository.
 
         JSON body params:
-        PackageRefs [][string]  list of package references ( package keys)
+        PackageRefs [][string]  list of package references ( package keys or PackageRefs)
 
         HTTP Errors:
         Code  Description
@@ -353,13 +646,14 @@ class AptlyApiRequests(object):
 
         url = self.cfg['route_repo'] + repo_name + '/packages'
         param = {
-            'PackageRefs': package_key_list
+            'PackageRefs': keys_of(package_key_list)
         }
-        r = requests.post(url, data=json.dumps(param), headers=self.headers)
+        r = self.session.post(url, data=json.dumps(param), headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(MUTATE)
     def repo_delete_packages_by_key(self, repo_name, package_key_list):
         """
         DELETE PACKAGES BY KEY
@@ -369,7 +663,7 @@ class AptlyApiRequests(object):
         retrieved with GET /repos/:name/packages.
 
         JSON body params:
-        PackageRefs [][string]  list of package references ( package keys)
+        PackageRefs [][string]  list of package references ( package keys or PackageRefs)
 
         HTTP Errors:
         404 repository with such name doesn’t exist
@@ -382,17 +676,101 @@ class AptlyApiRequests(object):
         """
         url = self.cfg['route_repo'] + repo_name + '/packages'
         data = {
-            'PackageRefs': package_key_list
+            'PackageRefs': keys_of(package_key_list)
         }
-        r = requests.delete(url, data=json.dumps(data), headers=self.headers)
+        r = self.session.delete(url, data=json.dumps(data), headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    def repo_add_packages_by_key_chunked(self, repo_name, package_key_list, chunk_size=None, start_chunk=0,
+                                         progress=None):
+        """
+        ADD PACKAGES BY KEY (CHUNKED)
+        POST /api/repos/:name/packages
+        Same as repo_add_packages_by_key, but sends the package keys in chunks, see _packages_by_key_chunked.
+        """
+        return self._packages_by_key_chunked('post', repo_name, package_key_list, chunk_size, start_chunk, progress)
+
+    def repo_delete_packages_by_key_chunked(self, repo_name, package_key_list, chunk_size=None, start_chunk=0,
+                                            progress=None):
+        """
+        DELETE PACKAGES BY KEY (CHUNKED)
+        DELETE /api/repos/:name/packages
+        Same as repo_delete_packages_by_key, but sends the package keys in chunks, see _packages_by_key_chunked.
+        """
+        return self._packages_by_key_chunked('delete', repo_name, package_key_list, chunk_size, start_chunk,
+                                             progress)
+
+    def _packages_by_key_chunked(self, method, repo_name, package_key_list, chunk_size, start_chunk, progress):
+        """ _packages_by_key_chunked
+        Sends the package keys in chunks of chunk_size keys (default: chunk_size from config), one after the
+        other, so each request holds the aptly database lock only briefly. Sending stops at the first failed
+        chunk. Pass its index as start_chunk to resume from there. progress is called after every confirmed
+        chunk with the chunk index, the number of chunks and the number of keys done.
+
+        Response:
+        Chunks - [int]  number of chunks
+        Completed - [int]  number of confirmed chunks, including the ones skipped by start_chunk
+        Failed - object  the failed chunk (Chunk, Status, Error), null if all chunks were confirmed
+        ResumeFrom - [int]  start_chunk to resume with, null if all chunks were confirmed
+        Response - object  response of the last confirmed chunk
+        """
+        if chunk_size is None:
+            chunk_size = self.config.chunk_size
+        chunk_size = max(int(chunk_size), 1)
+        chunks = [package_key_list[i:i + chunk_size] for i in range(0, len(package_key_list), chunk_size)]
+        url = self.cfg['route_repo'] + repo_name + '/packages'
+
+        result = {
+            'Chunks': len(chunks),
+            'Completed': int(start_chunk),
+            'Failed': None,
+            'ResumeFrom': None,
+            'Response': None
+        }
+        for i in range(int(start_chunk), len(chunks)):
+            data = {
+                'PackageRefs': keys_of(chunks[i])
+            }
+            status = None
+            try:
+                r = self._send_chunk(method, url, data)
+                status = r.status_code
+                resp_data = json.loads(r.content)
+                error = _response_error(resp_data)
+                if error is None and status >= 400:
+                    error = 'HTTP %d' % status
+            except (ValueError, requests.exceptions.RequestException) as e:
+                error = str(e)
+
+            if error is not None:
+                result['Failed'] = {
+                    'Chunk': i,
+                    'Status': status,
+                    'Error': error
+                }
+                result['ResumeFrom'] = i
+                return result
+
+            result['Completed'] = i + 1
+            result['Response'] = resp_data
+            if progress is not None:
+                progress(i, len(chunks), min((i + 1) * chunk_size, len(package_key_list)))
+        return result
+
+    @scheduled(MUTATE)
+    def _send_chunk(self, method, url, data):
+        """ _send_chunk
+        Sends one chunk of package keys. Scheduled on its own, so other mutations can run between chunks.
+        """
+        return getattr(self.session, method)(url, data=json.dumps(data), headers=self.headers)
+
     ###################
     # FILE UPLOAD API #
     ###################
 
+    @scheduled(READ)
     def file_list_directories(self):
         """
         LIST DIRECTORIES
@@ -403,12 +781,13 @@ class AptlyApiRequests(object):
         Example:
         $ curl http://localhost:8080/api/files
         """
-        r = requests.get(self.cfg['route_file'], headers=self.headers)
+        r = self.session.get(self.cfg['route_file'], headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    @scheduled(READ)
     def file_upload(self, dir_name, file_path):
         """
         UPLOAD FILE
@@ -422,18 +801,96 @@ class AptlyApiRequests(object):
         $ curl -X POST -F file=@aptly_0.9~dev+217+ge5d646c_i386.deb http://localhost:8080/api/files/aptly-0.9
         """
 
-        f = {
-            'file': open(file_path, 'rb')
-        }
-
-        r = requests.post(self.cfg['route_file'] + dir_name,
-                          files=f)
+        with open(file_path, 'rb') as f:
+            r = self.session.post(self.cfg['route_file'] + dir_name,
+                                  files={'file': f})
 
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    def file_upload_many(self, dir_name, file_paths, max_files=UPLOAD_MAX_FILES, max_bytes=UPLOAD_MAX_BYTES,
+                         workers=None):
+        """
+        UPLOAD MANY FILES
+        POST /api/files/:dir
+        Uploads all files to upload directory :dir. Files are grouped into multipart requests of at most
+        max_files files and max_bytes bytes (a bigger file is sent on its own). Groups are uploaded
+        concurrently by at most workers threads (default: workers from config).
+
+        Files are stored by their base name, so of several files with the same base name only the first
+        is uploaded, the others fail.
+
+        Response: one entry per file, in order of file_paths:
+        File - [string]  the local file path
+        Uploaded - [string]  :dir/:file as reported by aptly, null if upload failed
+        Error - [string]  reason, why the upload failed, null on success
+        """
+        if workers is None:
+            workers = self.config.workers
+        results = [None] * len(file_paths)
+        names = {}
+        groups = []
+        group = []
+        group_bytes = 0
+        for i, path in enumerate(file_paths):
+            if not os.path.isfile(path):
+                results[i] = {'File': path, 'Uploaded': None, 'Error': 'No such file: ' + path}
+                continue
+            name = os.path.basename(path)
+            if name in names:
+                results[i] = {'File': path, 'Uploaded': None,
+                              'Error': 'Duplicate file name %s, already uploaded from %s' % (name, names[name])}
+                continue
+            names[name] = path
+            size = os.path.getsize(path)
+            if group and (len(group) >= max_files or group_bytes + size > max_bytes):
+                groups.append(group)
+                group = []
+                group_bytes = 0
+            group.append(i)
+            group_bytes += size
+        if group:
+            groups.append(group)
+
+        upload = lambda g: self._upload_group(dir_name, [file_paths[i] for i in g])
+        for g, group_result in zip(groups, run_bounded(upload, groups, workers)):
+            for i, res in zip(g, group_result):
+                results[i] = res
+        return results
+
+    @scheduled(READ)
+    def _upload_group(self, dir_name, file_paths):
+        """ _upload_group
+        Uploads a group of files within one multipart request and returns one result per file.
+        """
+        handles = []
+        try:
+            try:
+                for path in file_paths:
+                    handles.append(open(path, 'rb'))
+                files = [('file', (os.path.basename(h.name), h)) for h in handles]
+                r = self.session.post(self.cfg['route_file'] + dir_name, files=files)
+                uploaded = json.loads(r.content)
+                error = None if r.status_code == 200 else 'HTTP %d: %s' % (r.status_code, r.content)
+            finally:
+                for h in handles:
+                    h.close()
+        except (IOError, ValueError, requests.exceptions.RequestException) as e:
+            uploaded = []
+            error = str(e)
+
+        results = []
+        for path in file_paths:
+            target = dir_name + '/' + os.path.basename(path)
+            if error is None and target in uploaded:
+                results.append({'File': path, 'Uploaded': target, 'Error': None})
+            else:
+                results.append({'File': path, 'Uploaded': None, 'Error': error or 'not reported as uploaded'})
+        return results
+
+    @scheduled(READ)
     def file_list(self, dir_name=None):
         """
         LIST FILES IN DIRECTORY
@@ -450,13 +907,14 @@ class AptlyApiRequests(object):
         if dir_name is None:
             dir_name = ''
 
-        r = requests.get(self.cfg['route_file'] +
-                         dir_name, headers=self.headers)
+        r = self.session.get(self.cfg['route_file'] +
+                             dir_name, headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    @scheduled(READ)
     def file_delete_directory(self, dir_name):
         """
         DELETE DIRECTORY
@@ -466,13 +924,14 @@ class AptlyApiRequests(object):
         Example:
         $ curl -X DELETE http://localhost:8080/api/files/aptly-0.9
         """
-        r = requests.delete(
+        r = self.session.delete(
             self.cfg['route_file'] + dir_name, headers=self.headers)
 #        r.raise_for_status()
         resp_data = json.loads(r.content)
         # print json.dumps(resp_data)
         return resp_data
 
+    @scheduled(READ)
     def file_delete(self, dir_name, file_name):
         """
         DELETE FILE IN DIRECTORY
@@ -482,7 +941,7 @@ class AptlyApiRequests(object):
         Example:
         $ curl -X DELETE http://localhost:8080/api/files/aptly-0.9/aptly_0.9~dev+217+ge5d646c_i386.deb
         """
-        r = requests.delete(
+        r = self.session.delete(
             self.cfg['route_file'] + dir_name + '/' + file_name, headers=self.headers)
 #        r.raise_for_status()
         resp_data = json.loads(r.content)
@@ -493,6 +952,7 @@ class AptlyApiRequests(object):
     # SNAPSHOT API #
     ################
 
+    @scheduled(READ)
     def snapshot_list(self, sort='time'):
         """
         LIST
@@ -508,13 +968,14 @@ class AptlyApiRequests(object):
         params = {
             'sort': sort
         }
-        r = requests.get(self.cfg['route_snap'],
-                         headers=self.headers, params=params)
+        r = self.session.get(self.cfg['route_snap'],
+                             headers=self.headers, params=params)
 #        r.raise_for_status()
         resp_data = json.loads(r.content)
         # self._out(resp_data)
         return resp_data
 
+    @scheduled(MUTATE)
     def snapshot_create_from_local_repo(self, snapshot_name, repo_name, description=None):
         """
         CREATE SNAPSHOT FROM LOCAL REPO
@@ -543,12 +1004,13 @@ class AptlyApiRequests(object):
             'Description': description
         }
 
-        r = requests.post(url, data=json.dumps(data), headers=self.headers)
+        r = self.session.post(url, data=json.dumps(data), headers=self.headers)
         # r.raise_for_status()
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(MUTATE)
     def snapshot_create_from_package_refs(self, snapshot_name, source_snapshot_list, package_refs_list, descr=None):
         """
         CREATE SNAPSHOT FROM PACKAGE REFS
@@ -560,7 +1022,7 @@ class AptlyApiRequests(object):
         Name - [string], required  snapshot name
         Description - [string]  free-format description how snapshot has been created
         SourceSnapshots - [][string]  list of source snapshot names (only for tracking purposes)
-        PackageRefs - [][string]  list of package keys which would be contents of the repository
+        PackageRefs - [][string]  list of package keys (or PackageRefs) which would be contents of the repository
         Sending request without SourceSnapshots and PackageRefs would create empty snapshot.
 
         HTTP Errors:
@@ -581,14 +1043,15 @@ class AptlyApiRequests(object):
             'Name': snapshot_name,
             'Description': descr,
             'SourceSnapshots': source_snapshot_list,
-            'PackageRefs': package_refs_list
+            'PackageRefs': keys_of(package_refs_list)
         }
 
-        r = requests.post(url, data=json.dumps(data), headers=self.headers)
+        r = self.session.post(url, data=json.dumps(data), headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(MUTATE)
     def snapshot_update(self, old_snapshot_name, new_snapshot_name, description=None):
         """
         UPDATE
@@ -616,11 +1079,14 @@ class AptlyApiRequests(object):
             'Description': description
         }
 
-        r = requests.put(url, data=json.dumps(data), headers=self.headers)
+        r = self.session.put(url, data=json.dumps(data), headers=self.headers)
+        if self.cache is not None:
+            self.cache.invalidate(old_snapshot_name)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(READ)
     def snapshot_show(self, snapshot_name):
         """
         SHOW
@@ -635,11 +1101,12 @@ class AptlyApiRequests(object):
         $ curl http://localhost:8080/api/snapshots/snap1
         """
         url = self.cfg['route_snap'] + snapshot_name
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
         return resp_data
 
+    @scheduled(MUTATE)
     def snapshot_delete(self, snapshot_name, force='0'):
         """
         DELETE
@@ -658,20 +1125,83 @@ class AptlyApiRequests(object):
         $ curl -X DELETE http://localhost:8080/api/snapshots/snap-wheezy
         $ curl -X DELETE 'http://localhost:8080/api/snapshots/snap-wheezy?force=1'
         """
-        url = self.cfg['route_snap'] + snapshot_name
-        if force == '1':
-            print 'Forcing removal of snapshot'
+        r = self._snapshot_delete_request(snapshot_name, force)
+        resp_data = json.loads(r.content)
+        # print resp_data
+        return resp_data
 
+    @scheduled(MUTATE)
+    def _snapshot_delete_request(self, snapshot_name, force):
+        """ _snapshot_delete_request
+        Sends the deletion of a snapshot and returns the response.
+        """
+        url = self.cfg['route_snap'] + snapshot_name
         param = {
             'force': force
         }
+        r = self.session.delete(url, params=param, headers=self.headers)
+        if self.cache is not None:
+            self.cache.invalidate(snapshot_name)
+        return r
 
-        r = requests.delete(url, params=param, headers=self.headers)
-        print r.url
-        resp_data = json.loads(r.content)
-        # print resp_data
-        return resp_data
+    def snapshot_delete_many(self, snapshot_names, force='0', workers=None, retries=DELETE_RETRIES):
+        """
+        DELETE MANY
+        DELETE /api/snapshots/:name
+        Deletes all given snapshots, running at most workers deletions at once (default: workers from config).
+        A deletion failing because the aptly database is busy (locked, connection error, server error) is
+        retried up to retries times with growing pauses.
+
+        Response: one entry per snapshot, in order of snapshot_names:
+        Name - [string]  snapshot name
+        Deleted - bool  whether the snapshot has been deleted
+        Status - [int]  HTTP status of the last attempt, null if the server was not reachable
+        Error - [string]  reason, why the deletion failed, null on success
+        Attempts - [int]  number of requests sent
+        """
+        if workers is None:
+            workers = self.config.workers
+        return run_bounded(lambda name: self._delete_snapshot_retrying(name, force, retries),
+                           snapshot_names, workers)
+
+    def _delete_snapshot_retrying(self, snapshot_name, force, retries):
+        """ _delete_snapshot_retrying
+        Deletes one snapshot, retrying while the database is busy. Returns the result entry.
+        """
+        attempts = 0
+        while True:
+            attempts += 1
+            status = None
+            retry = False
+            try:
+                self.session.attempt = attempts
+                r = self._snapshot_delete_request(snapshot_name, force)
+                status = r.status_code
+                try:
+                    error = _response_error(json.loads(r.content))
+                except ValueError:
+                    error = r.content or None
+                if error is None and status >= 400:
+                    error = 'HTTP %d' % status
+                retry = error is not None and (status >= 500 or
+                                               any(x in error.lower() for x in _LOCK_ERRORS))
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                retry = True
+            finally:
+                self.session.attempt = 1
+
+            if not retry or attempts > retries:
+                return {
+                    'Name': snapshot_name,
+                    'Deleted': error is None,
+                    'Status': status,
+                    'Error': error,
+                    'Attempts': attempts
+                }
+            time.sleep(DELETE_BACKOFF * 2 ** (attempts - 1))
 
+    @scheduled(READ)
     def snapshot_show_packages(self, snapshot_name, package_to_search=None, with_deps=0, detail='compact'):
         """
         SHOW PACKAGES/SEARCH
@@ -702,11 +1232,41 @@ class AptlyApiRequests(object):
                 'format': detail
             }
 
-        r = requests.get(url, params=param, headers=self.headers)
+        created = None
+        if self.cache is not None:
+            created = self._snapshot_created(snapshot_name)
+        if created is not None:
+            cache_params = self._cache_params('packages', created, param)
+            resp_data = self.cache.get(snapshot_name, cache_params)
+            if resp_data is not None:
+                return resp_data
+
+        r = self.session.get(url, params=param, headers=self.headers)
         resp_data = json.loads(r.content)
         # print resp_data
+        if created is not None and r.status_code == 200:
+            self.cache.put(snapshot_name, cache_params, resp_data)
         return resp_data
 
+    def snapshot_iter_packages(self, snapshot_name, package_to_search=None, with_deps=0, detail='compact'):
+        """
+        SHOW PACKAGES/SEARCH (STREAMED)
+        GET /api/snapshots/:name/packages
+        Same as snapshot_show_packages, but returns a generator, which decodes the response while it
+        is received and yields one package at a time. Use it for huge snapshots.
+        """
+        url = self.cfg['route_snap'] + snapshot_name + '/packages'
+        return self._iter_packages(url, package_to_search, with_deps, detail, snapshot_name)
+
+    def snapshot_iter_package_refs(self, snapshot_name, package_to_search=None, with_deps=0):
+        """
+        SHOW PACKAGES/SEARCH (PACKAGE REFS)
+        GET /api/snapshots/:name/packages
+        Same as snapshot_iter_packages in compact format, but yields every package key parsed as PackageRef.
+        """
+        return parse_refs(self.snapshot_iter_packages(snapshot_name, package_to_search, with_deps))
+
+    @scheduled(READ)
     def snapshot_diff(self, snapshot_left, snapshot_right):
         """
         DIFFERENCE BETWEEN SNAPSHOTS
@@ -727,7 +1287,7 @@ class AptlyApiRequests(object):
         """
         url = self.cfg['route_snap'] + \
             snapshot_left + '/diff/' + snapshot_right
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
@@ -736,6 +1296,7 @@ class AptlyApiRequests(object):
     # PUBLISH API #
     ###############
 
+    @scheduled(READ)
     def publish_list(self):
         """
         LIST
@@ -746,11 +1307,12 @@ class AptlyApiRequests(object):
         $ curl http://localhost:8080/api/publish
         """
         url = self.cfg['route_pub']
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
 
+    @scheduled(MUTATE)
     def publish(self, prefix, src_kind, src_list, dist, comp_list, label=None, orig=None, overwrite=None, arch_list=None):
         """
         PUBLISH SNAPSHOT/LOCAL REPO
@@ -836,12 +1398,13 @@ class AptlyApiRequests(object):
             }
 
         # print dat
-        r = requests.post(url, data=json.dumps(dat), headers=self.headers)
+        r = self.session.post(url, data=json.dumps(dat), headers=self.headers)
         # print r.url
         resp = json.loads(r.content)
         # print resp
         return resp
 
+    @scheduled(MUTATE)
     def publish_switch(self, prefix, snapshot_list, dist, component=None, force_overwrite=0):
         """
         UPDATE PUBLISHED LOCAL REPO/SWITCH PUBLISHED SNAPSHOT
@@ -892,11 +1455,12 @@ class AptlyApiRequests(object):
             'Snapshots': snap_list_obj,
             'ForceOverwrite': fo
         }
-        r = requests.put(url, data=json.dumps(data), headers=self.headers)
+        r = self.session.put(url, data=json.dumps(data), headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
 
+    @scheduled(MUTATE)
     def publish_drop(self, prefix, distribution, force=0):
         """
         DROP PUBLISHED REPOSITORY
@@ -919,7 +1483,7 @@ class AptlyApiRequests(object):
             'force': force
         }
 
-        r = requests.delete(url, params=param, headers=self.headers)
+        r = self.session.delete(url, params=param, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
@@ -928,6 +1492,7 @@ class AptlyApiRequests(object):
     # PACKAGE API #
     ###############
 
+    @scheduled(READ)
     def package_show_by_key(self, package_key):
         """
         SHOW
@@ -951,7 +1516,7 @@ class AptlyApiRequests(object):
         Hint: %20 is url-encoded space.
         """
         url = self.cfg['route_pack'] + package_key
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
@@ -960,6 +1525,7 @@ class AptlyApiRequests(object):
     # GRAPH API #
     #############
 
+    @scheduled(READ)
     def graph(self, file_ext='.png'):
         """
         GET /api/graph.:ext
@@ -971,7 +1537,7 @@ class AptlyApiRequests(object):
         """
         url = self.cfg['route_graph'][:-1] + file_ext
         print url
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
@@ -980,6 +1546,7 @@ class AptlyApiRequests(object):
     # VERSION API #
     ###############
 
+    @scheduled(READ)
     def get_version(self):
         """
         GET /api/version
@@ -989,7 +1556,7 @@ class AptlyApiRequests(object):
         $ curl http://localhost:8080/api/version
         """
         url = self.cfg['route_vers']
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         resp = json.loads(r.content)
         # print resp
         return resp
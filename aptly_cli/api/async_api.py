@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" AsyncAptlyApiRequests
+Non-blocking variant of AptlyApiRequests, which allows to fan out
+many api calls at once.
+"""
+
+from multiprocessing.pool import ThreadPool
+from aptly_cli.api.api import AptlyApiRequests
+from aptly_cli.api.workers import DEFAULT_WORKERS
+
+# Timeout for waiting on results, keeps the main thread interruptible (Ctrl-C)
+_WAIT_TIMEOUT = 60 * 60 * 24
+
+# Api methods offered by AsyncAptlyApiRequests
+ASYNC_METHODS = (
+    # local repos
+    'repo_create', 'repo_show', 'repo_show_packages', 'repo_edit', 'repo_list', 'repo_delete',
+    'repo_add_package_from_upload', 'repo_add_packages_by_key', 'repo_delete_packages_by_key',
+    # files
+    'file_list_directories', 'file_upload', 'file_upload_many', 'file_list', 'file_delete_directory',
+    'file_delete',
+    # snapshots
+    'snapshot_list', 'snapshot_create_from_local_repo', 'snapshot_create_from_package_refs',
+    'snapshot_update', 'snapshot_show', 'snapshot_delete', 'snapshot_show_packages', 'snapshot_diff',
+    # publish
+    'publish_list', 'publish', 'publish_switch', 'publish_drop',
+    # packages
+    'package_show_by_key',
+    # version
+    'get_version'
+)
+
+
+class AsyncAptlyApiRequests(object):
+
+    """ AsyncAptlyApiRequests
+    Offers the methods of AptlyApiRequests, but every call returns at once with an
+    AsyncResult (see multiprocessing.pool). Its get() method waits for and returns the
+    response. At most max_concurrency calls are in flight, further calls are queued.
+
+    Example:
+    client = AsyncAptlyApiRequests(max_concurrency=16)
+    results = [client.snapshot_show(name) for name in names]
+    infos = client.gather(results)
+    """
+
+    def __init__(self, api=None, max_concurrency=DEFAULT_WORKERS):
+        """
+        Wraps the given AptlyApiRequests instance or creates a new one.
+        Only a created instance is closed by close(), a given one stays usable.
+        Keep pool_maxsize of the api at least at max_concurrency,
+        otherwise surplus connections are not reused.
+        """
+        self._owns_api = api is None
+        self.api = AptlyApiRequests() if self._owns_api else api
+        self.max_concurrency = int(max_concurrency)
+        self._pool = ThreadPool(self.max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, method_name, *args, **kwargs):
+        """ submit
+        Queues the api method by name and returns its AsyncResult.
+        """
+        if method_name not in ASYNC_METHODS:
+            raise AttributeError('Not an api method: ' + method_name)
+        return self._pool.apply_async(getattr(self.api, method_name), args, kwargs)
+
+    def map(self, method_name, args_list):
+        """ map
+        Queues the api method once for each tuple of arguments and returns the list of AsyncResults.
+        """
+        return [self.submit(method_name, *args) for args in args_list]
+
+    @staticmethod
+    def gather(results):
+        """ gather
+        Waits for all AsyncResults and returns their responses in the same order.
+        The first failed call raises its exception.
+        """
+        return [r.get(_WAIT_TIMEOUT) for r in results]
+
+    def close(self):
+        """ close
+        Waits for all queued calls and closes the worker pool, and the connections
+        of the api if created by this instance.
+        """
+        self._pool.close()
+        self._pool.join()
+        if self._owns_api:
+            self.api.close()
+
+
+def _make_async(method_name):
+    """ _make_async
+    Returns a method, which submits the api method by name.
+    """
+    def method(self, *args, **kwargs):
+        return self.submit(method_name, *args, **kwargs)
+    method.__name__ = method_name
+    method.__doc__ = getattr(AptlyApiRequests, method_name).__doc__
+    return method
+
+for _name in ASYNC_METHODS:
+    setattr(AsyncAptlyApiRequests, _name, _make_async(_name))
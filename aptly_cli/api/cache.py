@@ -0,0 +1,249 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" SnapshotCache
+On-disk cache for data of immutable aptly snapshots.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# Share of max_bytes the cache is shrunk to, when evicting, so scans stay rare
+EVICT_RATIO = 0.9
+
+# Prefix of entries being written
+_TMP_PREFIX = '.tmp-'
+
+
+class SnapshotCache(object):
+
+    """ SnapshotCache
+    Stores lists (package lists, snapshot metadata) per snapshot on disk, one json
+    document per line. Snapshots never change, so entries stay valid until the snapshot
+    is deleted or renamed. The least recently used entries are evicted, when the cache
+    grows beyond max_bytes.
+
+    Layout: <directory>/<hash of server url and snapshot name>/<hash of request params>
+    """
+
+    def __init__(self, directory, max_bytes, namespace=''):
+        """
+        Pass the cache directory, its size limit and a namespace (e.g. the server url),
+        which separates snapshots of equal names on different servers.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        # running total of the entry sizes, None until the cache has been scanned
+        self._size = None
+
+    def _snapshot_dir(self, snapshot_name):
+        """ _snapshot_dir
+        Returns the directory holding all entries of a snapshot.
+        """
+        key = (self.namespace + u'\0' + snapshot_name).encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest())
+
+    def _entry_path(self, snapshot_name, params):
+        """ _entry_path
+        Returns the file of a snapshot entry for the given request params.
+        """
+        key = json.dumps(params, sort_keys=True)
+        return os.path.join(self._snapshot_dir(snapshot_name), hashlib.sha1(key).hexdigest())
+
+    def iter(self, snapshot_name, params):
+        """ iter
+        Returns a generator over the cached list, None if there is no entry.
+        """
+        path = self._entry_path(snapshot_name, params)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        # mark as recently used
+        os.utime(path, None)
+        return self._iter_lines(f)
+
+    @staticmethod
+    def _iter_lines(f):
+        """ _iter_lines
+        Yields the decoded lines of an entry file and closes it.
+        """
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def get(self, snapshot_name, params):
+        """ get
+        Returns the cached list, None if there is no entry.
+        """
+        items = self.iter(snapshot_name, params)
+        return None if items is None else list(items)
+
+    def put(self, snapshot_name, params, items):
+        """ put
+        Stores a list.
+        """
+        writer = self.writer(snapshot_name, params)
+        for item in items:
+            writer.write(item)
+        writer.commit()
+
+    def writer(self, snapshot_name, params):
+        """ writer
+        Returns a writer, which stores a list item by item. The entry becomes
+        visible on commit(), abort() discards it.
+        """
+        return _EntryWriter(self, self._entry_path(snapshot_name, params))
+
+    def invalidate(self, snapshot_name):
+        """ invalidate
+        Drops all entries of a snapshot.
+        """
+        directory = self._snapshot_dir(snapshot_name)
+        freed = sum(size for _, size, _ in self._entries(directory))
+        shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            if self._size is not None:
+                self._size = max(self._size - freed, 0)
+
+    def clear(self):
+        """ clear
+        Drops all entries.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self._size = 0
+
+    @staticmethod
+    def _entries(directory):
+        """ _entries
+        Returns (mtime, size, path) of all committed entries below directory,
+        skipping files still being written.
+        """
+        entries = []
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.startswith(_TMP_PREFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _added(self, size):
+        """ _added
+        Accounts for size bytes committed (negative if freed) and evicts, once the cache
+        grows beyond max_bytes. The size is kept as a running total, the directory is
+        scanned only on the first commit and when evicting.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries(self.directory))
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        """ evict
+        Removes least recently used entries, until the cache fits into max_bytes.
+        """
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """ _evict
+        Scans the cache and removes least recently used entries, until the cache shrinks
+        to EVICT_RATIO of max_bytes, and then empty snapshot directories. Called with the lock held.
+        """
+        entries = self._entries(self.directory)
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+            for name in os.listdir(self.directory):
+                _remove_empty_dir(os.path.join(self.directory, name))
+        self._size = total
+
+
+def _remove_empty_dir(directory):
+    """ _remove_empty_dir
+    Removes directory, if it is empty.
+    """
+    try:
+        os.rmdir(directory)
+    except OSError:
+        # not empty or already removed
+        pass
+
+
+class _EntryWriter(object):
+
+    """ _EntryWriter
+    Writes an entry to a temporary file and moves it into place on commit.
+    """
+
+    def __init__(self, cache, path):
+        self._cache = cache
+        self._path = path
+        self._directory = os.path.dirname(path)
+        while True:
+            if not os.path.isdir(self._directory):
+                try:
+                    os.makedirs(self._directory)
+                except OSError:
+                    # created concurrently
+                    pass
+            try:
+                fd, self._tmp_path = tempfile.mkstemp(dir=self._directory, prefix=_TMP_PREFIX)
+                break
+            except OSError as e:
+                # removed concurrently, when empty
+                if e.errno != errno.ENOENT:
+                    raise
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, item):
+        self._file.write(json.dumps(item) + '\n')
+
+    def commit(self):
+        self._file.close()
+        size = os.path.getsize(self._tmp_path)
+        try:
+            size -= os.path.getsize(self._path)
+        except OSError:
+            # no entry to replace
+            pass
+        try:
+            os.rename(self._tmp_path, self._path)
+        except OSError:
+            # snapshot invalidated meanwhile
+            self.abort()
+            return
+        self._cache._added(size)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+        _remove_empty_dir(self._directory)
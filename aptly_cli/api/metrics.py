@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Metrics
+Counters and latency histograms of aptly api requests, fed by the request hook of
+AptlyApiRequests (see AptlyApiRequests.add_request_hook):
+
+    metrics = Metrics(api.scheduler)
+    api.add_request_hook(metrics)
+    ...
+    metrics.dump('aptly.prom')
+
+Every request is recorded by route template (e.g. /api/snapshots/:name), method and status.
+With a scheduler, its queue depth and wait times per kind of call are dumped as well.
+Dumps are json, or Prometheus text format for files ending in .prom.
+"""
+
+import json
+import threading
+import urlparse
+
+# Upper bounds of the latency buckets in seconds, as used by Prometheus clients
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# Path segments of aptly routes, which are no parameters
+_ROUTE_WORDS = ('packages', 'file', 'diff', 'snapshots')
+
+# Names of the parameters of aptly routes, in order of appearance
+_ROUTE_PARAMS = {
+    'repos': (':name', ':dir', ':file'),
+    'files': (':dir', ':name'),
+    'snapshots': (':name', ':withSnapshot'),
+    'publish': (':prefix', ':distribution'),
+    'packages': (':key',),
+}
+
+PROMETHEUS_EXT = '.prom'
+
+_PREFIX = 'aptly_cli_'
+
+
+def route_template(url):
+    """ route_template
+    Returns the route of an api url with parameters replaced by their names,
+    e.g. /api/snapshots/:name/diff/:withSnapshot.
+    """
+    segments = [s for s in urlparse.urlsplit(url).path.split('/') if s]
+    if len(segments) < 2 or segments[0] != 'api':
+        return '/' + '/'.join(segments)
+    params = iter(_ROUTE_PARAMS.get(segments[1], ()))
+    route = segments[:2]
+    for i, segment in enumerate(segments[2:]):
+        if i > 0 and segment in _ROUTE_WORDS:
+            route.append(segment)
+        else:
+            route.append(next(params, ':param'))
+    return '/' + '/'.join(route)
+
+
+def _bucket_label(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(labels.items()))
+
+
+class _Series(object):
+
+    """ _Series
+    Counters and latency histogram of one route and method.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, record):
+        status = str(record['Status']) if record['Status'] is not None else 'error'
+        self.count += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if record['Attempt'] > 1:
+            self.retries += 1
+        self.request_bytes += record['RequestBytes']
+        self.response_bytes += record['ResponseBytes']
+        self.seconds += record['Seconds']
+        self.max_seconds = max(self.max_seconds, record['Seconds'])
+        for i, bound in enumerate(BUCKETS):
+            if record['Seconds'] <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """ quantile
+        Estimates a latency quantile from the histogram, like Prometheus' histogram_quantile.
+        """
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(BUCKETS, self.buckets):
+            if n and seen + n >= rank:
+                if bound == float('inf'):
+                    return self.max_seconds
+                return min(lower + (bound - lower) * (rank - seen) / n, self.max_seconds)
+            seen += n
+            lower = bound
+        return 0.0
+
+
+class Metrics(object):
+
+    """ Metrics
+    Request hook keeping counters and latency histograms in memory. Thread-safe.
+    """
+
+    def __init__(self, scheduler=None):
+        """
+        Pass the RequestScheduler of the api, to report its queue depth and wait times.
+        """
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def __call__(self, record):
+        """ __call__
+        Records one request, see AptlyApiRequests.add_request_hook for its fields.
+        """
+        key = (record['Method'], record['Route'])
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.add(record)
+
+    def as_dict(self):
+        """ as_dict
+        Returns the metrics of every route and method, and of the scheduler by kind of call.
+        """
+        with self._lock:
+            items = sorted(self._series.items())
+            return {
+                'Scheduler': self.scheduler.metrics() if self.scheduler is not None else {},
+                'Requests': [{
+                    'Method': method,
+                    'Route': route,
+                    'Count': s.count,
+                    'Statuses': dict(s.statuses),
+                    'Retries': s.retries,
+                    'RequestBytes': s.request_bytes,
+                    'ResponseBytes': s.response_bytes,
+                    'Seconds': round(s.seconds, 6),
+                    'AvgSeconds': round(s.seconds / s.count, 6),
+                    'MaxSeconds': round(s.max_seconds, 6),
+                    'P50Seconds': round(s.quantile(0.5), 6),
+                    'P99Seconds': round(s.quantile(0.99), 6),
+                    'Buckets': [[_bucket_label(b), n] for b, n in zip(BUCKETS, s.buckets)]
+                } for (method, route), s in items]
+            }
+
+    def prometheus_text(self):
+        """ prometheus_text
+        Returns the metrics in Prometheus text format.
+        """
+        with self._lock:
+            items = sorted(self._series.items())
+            lines = [
+                '# HELP %srequest_seconds Latency of aptly api requests.' % _PREFIX,
+                '# TYPE %srequest_seconds histogram' % _PREFIX,
+            ]
+            for (method, route), s in items:
+                cumulative = 0
+                for bound, n in zip(BUCKETS, s.buckets):
+                    cumulative += n
+                    lines.append('%srequest_seconds_bucket%s %d' % (
+                        _PREFIX, _labels(method=method, route=route, le=_bucket_label(bound)), cumulative))
+                lines.append('%srequest_seconds_sum%s %r' % (_PREFIX, _labels(method=method, route=route), s.seconds))
+                lines.append('%srequest_seconds_count%s %d' % (_PREFIX, _labels(method=method, route=route), s.count))
+
+            lines.extend([
+                '# HELP %srequests_total Aptly api requests by status, error if no response was received.' % _PREFIX,
+                '# TYPE %srequests_total counter' % _PREFIX,
+            ])
+            for (method, route), s in items:
+                for status, n in sorted(s.statuses.items()):
+                    lines.append('%srequests_total%s %d' % (
+                        _PREFIX, _labels(method=method, route=route, status=status), n))
+
+            for name, help_text, attr in (
+                    ('retries_total', 'Retried aptly api requests.', 'retries'),
+                    ('request_bytes_total', 'Bytes sent in request bodies.', 'request_bytes'),
+                    ('response_bytes_total', 'Bytes received in response bodies.', 'response_bytes')):
+                lines.append('# HELP %s%s %s' % (_PREFIX, name, help_text))
+                lines.append('# TYPE %s%s counter' % (_PREFIX, name))
+                for (method, route), s in items:
+                    lines.append('%s%s%s %d' % (_PREFIX, name, _labels(method=method, route=route), getattr(s, attr)))
+
+            if self.scheduler is not None:
+                lines.extend(self._scheduler_lines())
+            return '\n'.join(lines) + '\n'
+
+    def _scheduler_lines(self):
+        """ _scheduler_lines
+        Returns the metrics of the scheduler in Prometheus text format.
+        """
+        stats = sorted(self.scheduler.metrics().items())
+        lines = []
+        for name, kind, help_text, key, fmt in (
+                ('scheduler_slots', 'gauge', 'Api calls allowed in flight at once.', 'Limit', '%d'),
+                ('scheduler_calls_total', 'counter', 'Api calls, which got a slot.', 'Calls', '%d'),
+                ('scheduler_running', 'gauge', 'Api calls in flight.', 'Running', '%d'),
+                ('scheduler_waiting', 'gauge', 'Api calls waiting for a slot (queue depth).', 'Waiting', '%d'),
+                ('scheduler_max_waiting', 'gauge', 'Maximum queue depth.', 'MaxWaiting', '%d'),
+                ('scheduler_wait_seconds_total', 'counter', 'Time spent waiting for a slot.', 'WaitSeconds', '%r'),
+                ('scheduler_max_wait_seconds', 'gauge', 'Longest wait for a slot.', 'MaxWaitSeconds', '%r')):
+            lines.append('# HELP %s%s %s' % (_PREFIX, name, help_text))
+            lines.append('# TYPE %s%s %s' % (_PREFIX, name, kind))
+            for call_kind, entry in stats:
+                lines.append(('%s%s%s ' + fmt) % (_PREFIX, name, _labels(kind=call_kind), entry[key]))
+        return lines
+
+    def dump(self, path):
+        """ dump
+        Writes the metrics to path, in Prometheus text format if it ends with .prom, else as json.
+        """
+        if path.endswith(PROMETHEUS_EXT):
+            text = self.prometheus_text()
+        else:
+            text = json.dumps(self.as_dict(), indent=2, sort_keys=True, separators=(',', ': ')) + '\n'
+        with open(path, 'w') as f:
+            f.write(text)
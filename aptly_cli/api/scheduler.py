@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Scheduler
+Schedules api calls by their effect on the aptly database. aptly serialises
+mutations on its database lock, so reads run with high concurrency, while
+mutations are serialised (or throttled to a few at once). The file api only
+touches the upload directory, not the database, and is scheduled like reads.
+"""
+
+import threading
+import time
+from functools import wraps
+from aptly_cli.config.config import DEFAULT_MAX_MUTATIONS
+
+# Kinds of api calls
+READ = 'read'
+MUTATE = 'mutate'
+
+# Reads in flight, if no other value is configured
+DEFAULT_MAX_READS = 16
+
+# Code flag of generator functions (as tested by inspect.isgeneratorfunction, without importing inspect)
+_CO_GENERATOR = 0x20
+
+
+class RequestScheduler(object):
+
+    """ RequestScheduler
+    Hands out slots for api calls, at most max_reads for reads and max_mutations
+    for mutations at once. Further calls wait for a free slot of their kind.
+    A call made while the same thread already holds a slot of its kind (e.g. a
+    mutation chunking its request, or any call while iterating a stream) reuses that
+    slot, so nested calls never deadlock. Reads nested in a mutation reuse the
+    mutation slot, as it runs alone anyway. A mutation nested in a read is upgraded:
+    it takes a mutation slot in addition.
+    """
+
+    def __init__(self, max_reads=DEFAULT_MAX_READS, max_mutations=DEFAULT_MAX_MUTATIONS):
+        """
+        Pass the number of reads and mutations allowed in flight at once.
+        """
+        self.limits = {
+            READ: max(int(max_reads), 1),
+            MUTATE: max(int(max_mutations), 1)
+        }
+        self._slots = dict((kind, threading.Semaphore(n)) for kind, n in self.limits.items())
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = dict((kind, {
+            'Calls': 0,
+            'Running': 0,
+            'Waiting': 0,
+            'MaxWaiting': 0,
+            'WaitSeconds': 0.0,
+            'MaxWaitSeconds': 0.0
+        }) for kind in self.limits)
+
+    def held(self):
+        """ held
+        Returns the number of slots held by the current thread, by kind. Pass it to
+        release, when the slot may be released by another thread (e.g. a stream
+        resumed elsewhere).
+        """
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = dict((kind, 0) for kind in self.limits)
+        return held
+
+    def acquire(self, kind):
+        """ acquire
+        Waits for a slot of kind. Returns False, if this thread already holds a slot
+        covering kind, which is reused then.
+        """
+        held = self.held()
+        if held[kind] or held[MUTATE]:
+            return False
+
+        stats = self._stats[kind]
+        start = time.time()
+        with self._lock:
+            stats['Waiting'] += 1
+            stats['MaxWaiting'] = max(stats['MaxWaiting'], stats['Waiting'])
+        try:
+            self._slots[kind].acquire()
+        finally:
+            waited = time.time() - start
+            with self._lock:
+                stats['Waiting'] -= 1
+        with self._lock:
+            stats['Calls'] += 1
+            stats['Running'] += 1
+            stats['WaitSeconds'] += waited
+            stats['MaxWaitSeconds'] = max(stats['MaxWaitSeconds'], waited)
+        held[kind] += 1
+        return True
+
+    def release(self, kind, held=None):
+        """ release
+        Frees a slot taken by acquire, held by the current thread unless held
+        (as returned by held) is passed.
+        """
+        if held is None:
+            held = self.held()
+        held[kind] -= 1
+        with self._lock:
+            self._stats[kind]['Running'] -= 1
+        self._slots[kind].release()
+
+    def metrics(self):
+        """ metrics
+        Returns per kind the limit, the number of calls, the calls running and waiting
+        right now (queue depth), the maximum queue depth and the time spent waiting.
+        """
+        with self._lock:
+            result = {}
+            for kind, stats in self._stats.items():
+                entry = dict(stats)
+                entry['Limit'] = self.limits[kind]
+                entry['AvgWaitSeconds'] = stats['WaitSeconds'] / stats['Calls'] if stats['Calls'] else 0.0
+                result[kind] = entry
+            return result
+
+
+def scheduled(kind):
+    """ scheduled
+    Decorates an api method, which then waits for a slot of kind on the scheduler of
+    its instance. Generator methods keep their slot until exhausted or closed, calls of
+    the same thread meanwhile reuse it.
+    """
+    def decorate(func):
+        if func.func_code.co_flags & _CO_GENERATOR:
+            @wraps(func)
+            def iter_wrapper(self, *args, **kwargs):
+                scheduler = self.scheduler
+                gen = func(self, *args, **kwargs)
+                held = scheduler.held()
+                acquired = False
+                try:
+                    acquired = scheduler.acquire(kind)
+                    for item in gen:
+                        yield item
+                finally:
+                    gen.close()
+                    if acquired:
+                        scheduler.release(kind, held)
+            return iter_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            scheduler = self.scheduler
+            acquired = scheduler.acquire(kind)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                if acquired:
+                    scheduler.release(kind)
+        return wrapper
+    return decorate
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Workers
+Helpers to run api calls on a bounded pool of worker threads.
+"""
+
+import Queue
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from aptly_cli.config.config import DEFAULT_WORKERS
+
+# Timeout for waiting on results, keeps the main thread interruptible (Ctrl-C)
+_WAIT_TIMEOUT = 60 * 60 * 24
+
+# Functions handing state of the calling thread over to worker threads, see add_handover
+_handovers = []
+
+
+def add_handover(capture):
+    """ add_handover
+    Registers capture, which is called on the thread submitting calls to worker threads.
+    It returns a function, which is called on the worker thread before each call, sets
+    the captured state and returns a function restoring it afterwards.
+    """
+    _handovers.append(capture)
+
+
+def remove_handover(capture):
+    """ remove_handover
+    Unregisters a function registered by add_handover.
+    """
+    _handovers.remove(capture)
+
+
+def _handed_over(func):
+    """ _handed_over
+    Returns func running with the state of the calling thread, as captured by the handovers.
+    """
+    if not _handovers:
+        return func
+    applies = [capture() for capture in _handovers]
+
+    def call(*args):
+        restores = [apply() for apply in applies]
+        try:
+            return func(*args)
+        finally:
+            for restore in reversed(restores):
+                restore()
+    return call
+
+
+def run_bounded(func, items, workers=DEFAULT_WORKERS):
+    """ run_bounded
+    Calls func for every item, running at most workers calls at once.
+    Returns the results in the order of items.
+    """
+    items = list(items)
+    workers = min(int(workers), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map_async(_handed_over(func), items, chunksize=1).get(_WAIT_TIMEOUT)
+    finally:
+        # all tasks are done at this point, the idle threads exit on their own
+        pool.close()
+
+
+def imap_bounded(func, items, workers=DEFAULT_WORKERS):
+    """ imap_bounded
+    Yields func(item) for every item, in the order of items, as soon as it is available.
+    At most workers calls are running or waiting to be consumed at once, so results are
+    buffered only for a small window ahead of the consumer.
+    """
+    workers = max(int(workers), 1)
+    func = _handed_over(func)
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= workers:
+                yield pending.popleft().get(_WAIT_TIMEOUT)
+        while pending:
+            yield pending.popleft().get(_WAIT_TIMEOUT)
+    finally:
+        pool.close()
+
+
+def first_match(func, items, accept, workers=DEFAULT_WORKERS):
+    """ first_match
+    Calls func for every item, running at most workers calls at once, until a result
+    is accepted. Then returns at once: calls not started yet are cancelled, calls still
+    in flight are abandoned and their results dropped. They finish on daemon threads,
+    which don't keep the process alive. An exception of a call cancels the rest likewise
+    and is raised.
+
+    Returns the (item, result) pairs in order of completion and the accepted pair,
+    which is None if no result has been accepted.
+    """
+    items = list(items)
+    func = _handed_over(func)
+    tasks = Queue.Queue()
+    for item in items:
+        tasks.put(item)
+    results = Queue.Queue()
+    cancelled = threading.Event()
+
+    def work():
+        while not cancelled.is_set():
+            try:
+                item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((item, func(item), None))
+            except Exception as e:
+                results.put((item, None, e))
+
+    for _ in range(min(int(workers), len(items))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    completed = []
+    try:
+        for _ in items:
+            item, result, error = results.get(True, _WAIT_TIMEOUT)
+            if error is not None:
+                raise error
+            completed.append((item, result))
+            if accept(result):
+                return completed, (item, result)
+    finally:
+        cancelled.set()
+    return completed, None
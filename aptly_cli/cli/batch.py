@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Batch
+Runs many operations in one process (--batch), sharing one set of pooled connections.
+
+Every input line is a json object naming a method of AptlyApiRequests or Util:
+{"id": "snap", "method": "snapshot_show", "args": ["snap1"], "kwargs": {}, "parallel": "lookup"}
+
+id, args, kwargs and parallel are optional. Consecutive operations with the same parallel
+tag are independent of each other and run concurrently, all others run one after the other.
+For every operation one json line is written, in input order, as soon as it is done:
+{"Id": "snap", "Method": "snapshot_show", "Result": {...}, "Error": null, "Output": null, "Seconds": 0.01}
+"""
+
+import json
+import sys
+import time
+from StringIO import StringIO
+from aptly_cli.api.workers import add_handover, imap_bounded, remove_handover
+from aptly_cli.cli.daemon import ThreadOutput
+
+
+class _Data(object):
+
+    """ _Data
+    Data argument of repo_create and repo_edit, given as json object.
+    """
+
+    def __init__(self, values):
+        self.comment = values.get('comment')
+        self.default_distribution = values.get('default_distribution')
+        self.default_component = values.get('default_component')
+
+
+def read_operations(lines):
+    """ read_operations
+    Yields the operations of json lines, in groups to run concurrently.
+    A line, which can't be parsed, yields an operation carrying the error.
+    """
+    group = []
+    tag = None
+    for nr, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            op = json.loads(line)
+            if not isinstance(op, dict) or 'method' not in op:
+                raise ValueError('Not an operation: ' + line)
+        except ValueError as e:
+            op = {'error': str(e)}
+        op.setdefault('id', nr)
+
+        op_tag = op.get('parallel')
+        if group and (op_tag is None or op_tag != tag):
+            yield group
+            group = []
+        group.append(op)
+        tag = op_tag
+    if group:
+        yield group
+
+
+def _resolve(util, name):
+    """ _resolve
+    Returns the public method of the api or util instance by name.
+    """
+    if isinstance(name, basestring) and not name.startswith('_'):
+        for obj in (util.api, util):
+            method = getattr(obj, name, None)
+            if callable(method):
+                return method
+    raise ValueError('Unknown method: %s' % name)
+
+
+def run_operation(util, op):
+    """ run_operation
+    Runs one operation and returns its result line (as dict). Output printed by the method
+    is captured, when running within run_batch.
+    """
+    start = time.time()
+    output = StringIO()
+    if isinstance(sys.stdout, ThreadOutput):
+        sys.stdout.target = output
+    result = None
+    error = op.get('error')
+    try:
+        if error is None:
+            method = _resolve(util, op['method'])
+            kwargs = dict((str(k), v) for k, v in (op.get('kwargs') or {}).items())
+            if isinstance(kwargs.get('data'), dict):
+                kwargs['data'] = _Data(kwargs['data'])
+            result = method(*(op.get('args') or []), **kwargs)
+            if hasattr(result, 'next'):
+                result = list(result)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    finally:
+        if isinstance(sys.stdout, ThreadOutput):
+            sys.stdout.target = None
+
+    return {
+        'Id': op['id'],
+        'Method': op.get('method'),
+        'Result': result,
+        'Error': error,
+        'Output': output.getvalue() or None,
+        'Seconds': round(time.time() - start, 6)
+    }
+
+
+def run_batch(util, source, out=None, workers=None):
+    """ run_batch
+    Runs the operations read from source (file name, - for stdin or an iterable of lines)
+    and writes one json line per result to out (default: stdout). Groups of operations
+    tagged as parallel run on at most workers threads (default: workers from config).
+    Returns the number of failed operations.
+    """
+    if workers is None:
+        workers = util.config.workers
+    stdout = sys.stdout
+    out = out or stdout
+    lines = source
+    if source == '-':
+        lines = sys.stdin
+    elif isinstance(source, basestring):
+        lines = open(source)
+    opened = lines is not source and lines is not sys.stdin
+
+    failed = 0
+    sys.stdout = ThreadOutput(stdout)
+    add_handover(sys.stdout.capture)
+    try:
+        for group in read_operations(lines):
+            if len(group) == 1:
+                results = [run_operation(util, group[0])]
+            else:
+                results = imap_bounded(lambda op: run_operation(util, op), group, workers)
+            for res in results:
+                if res['Error'] is not None:
+                    failed += 1
+                out.write(json.dumps(res, default=str) + '\n')
+                out.flush()
+    finally:
+        remove_handover(sys.stdout.capture)
+        sys.stdout = stdout
+        if opened:
+            lines.close()
+    return failed
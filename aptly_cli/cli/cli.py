@@ -6,30 +6,86 @@ The CLI with option parser
 """
 
 import sys
-import json
 import os
 from optparse import OptionParser
-from aptly_cli.util.util import Util
+from aptly_cli.cli import daemon, output
+from aptly_cli.config.config import CONFIG_PATH, create_config_file
+
+# Options modifying a command, which are no command on their own
+_MODIFIER_OPTIONS = ('output', 'chunk_size', 'start_chunk', 'socket_path')
 
 
 def main():
     """
     Main entry point for cli.
+    Commands are forwarded to the daemon, if one is running (see --serve).
     """
-    util = Util()
     parser = _get_parser_opts()
     (opts, args) = parser.parse_args()
-    _execute_opts(opts, args, util)
+    util = LazyUtil()
+    if opts.serve:
+        daemon.serve(util, parser, _execute_opts, opts.socket_path)
+        return
+
+    if _has_command(parser, opts):
+        status = daemon.forward(sys.argv[1:], opts.socket_path)
+        if status is not None:
+            sys.exit(status)
+
+    metrics = None
+    if opts.metrics_out:
+        from aptly_cli.api.metrics import Metrics
+        metrics = Metrics(util.api.scheduler)
+        util.api.add_request_hook(metrics)
+    tracer = None
+    if opts.trace:
+        from aptly_cli.util import trace
+        tracer = trace.start()
+        util.api.add_request_hook(tracer)
+    try:
+        if tracer is not None:
+            with tracer.span('aptly_api_cli', 'cli', Argv=sys.argv[1:]):
+                _execute_opts(opts, args, util)
+        else:
+            _execute_opts(opts, args, util)
+    finally:
+        if metrics is not None:
+            metrics.dump(opts.metrics_out)
+        if tracer is not None:
+            tracer.dump(opts.trace)
 
     if len(sys.argv) == 1:
         parser.print_help()
-        home = os.path.expanduser("~")
-        name = home + '/aptly-cli.conf'
-        if not os.path.exists(name):
+        if not os.path.exists(CONFIG_PATH):
             print "No config file (aptly-cli.conf) found at $HOME. Please create one by --create_config option"
             sys.exit(0)
 
 
+class LazyUtil(object):
+
+    """ LazyUtil
+    Stands in for Util and creates it on first use. The api client (and requests)
+    are loaded only by commands talking to aptly, so help and local commands start fast.
+    """
+
+    def __init__(self):
+        self._util = None
+
+    def __getattr__(self, name):
+        if self._util is None:
+            from aptly_cli.util.util import Util
+            self._util = Util()
+        return getattr(self._util, name)
+
+
+def _has_command(parser, opts):
+    """ _has_command
+    Returns whether opts hold a command, not only options modifying one.
+    """
+    return any(getattr(opts, name) != value for name, value in parser.defaults.items()
+               if name not in _MODIFIER_OPTIONS)
+
+
 def _get_parser_opts():
     """ _get_parser_opts
     Create parser, options and return object.
@@ -75,14 +131,26 @@ def _get_parser_opts():
                       help='Delete packages from repository by key',
                       metavar='REPO_NAME PACKAGE_REFS')
 
+    parser.add_option('--chunk_size',
+                      type='int',
+                      help='Send the package refs of --repo_add_packages_by_key and --repo_delete_packages_by_key \
+in chunks of this size',
+                      metavar='NR_OF_REFS')
+
+    parser.add_option('--start_chunk',
+                      type='int',
+                      default=0,
+                      help='Resume a chunked --repo_add_packages_by_key or --repo_delete_packages_by_key at this chunk',
+                      metavar='CHUNK')
+
     parser.add_option('--file_list_dirs',
                       action='store_true',
                       help='Lists all upload-directories')
 
     parser.add_option('--file_upload',
                       nargs=2,
-                      help='Upload file to local upload-directory',
-                      metavar='UPLOAD_DIR FILE')
+                      help='Upload files to local upload-directory',
+                      metavar='UPLOAD_DIR FILE [FILE ...]')
 
     parser.add_option('--repo_add_package_from_upload',
                       nargs=3,
@@ -143,6 +211,11 @@ def _get_parser_opts():
                       help='Delete snapshot by name. Optionally force deletion.',
                       metavar='SNAPSHOT_NAME [FORCE_DELETION]')
 
+    parser.add_option('--snapshot_delete_many',
+                      nargs=1,
+                      help='Delete many snapshots by name, max_mutations at a time. Optionally force deletion.',
+                      metavar='SNAPSHOT_NAMES [FORCE_DELETION]')
+
     parser.add_option('--publish_list',
                       action='store_true',
                       help='List all available repositories to publish to')
@@ -172,10 +245,47 @@ def _get_parser_opts():
                       help='Show packages by key',
                       metavar='PACKAGE_KEY')
 
+    parser.add_option('--output',
+                      type='choice',
+                      choices=output.FORMATS,
+                      default=output.DEFAULT_FORMAT,
+                      help='Output format: json (default), ndjson (one json line per element), tsv or compact \
+(json on one line). Lists are written element by element.',
+                      metavar='FORMAT')
+
+    parser.add_option('--metrics_out',
+                      nargs=1,
+                      help='Write request counts, bytes and latency histograms per api route and the queue depth and \
+wait times of the scheduler to FILE on exit, in Prometheus text format if FILE ends with .prom, else as json',
+                      metavar='FILE')
+
+    parser.add_option('--trace',
+                      nargs=1,
+                      help='Write nested timing spans of workflows, their phases and api requests to FILE \
+as Chrome trace events (open in chrome://tracing or Perfetto)',
+                      metavar='FILE')
+
     parser.add_option('--create_config',
                       action='store_true',
                       help='Creates standard config file (aptly-cli.conf) in $HOME')
 
+    parser.add_option('--serve',
+                      action='store_true',
+                      help='Run as daemon on a local unix socket (see --socket_path). Further calls of \
+aptly-cli are forwarded to it, sharing its connections and caches.')
+
+    parser.add_option('--socket_path',
+                      nargs=1,
+                      help='Unix socket of the daemon, to serve on or forward to \
+(default: $APTLY_CLI_SOCKET or ~/.aptly-cli.sock)',
+                      metavar='PATH')
+
+    parser.add_option('--batch',
+                      nargs=1,
+                      help='Run the operations of a json lines file (- for stdin) in one process, \
+write results as json lines',
+                      metavar='FILE')
+
     parser.add_option('--get_last_snapshots',
                       nargs=2,
                       help='Returns the last n snapshots by prefix or optional postfix.',
@@ -222,6 +332,9 @@ def _execute_opts(opts, args, util):
     """ _execute_opts
     Execute functions due to options and arguments.
     """
+    def write(resp):
+        output.write(resp, opts.output)
+
     class Data(object):
         """
         Create dat object and use it as argument.
@@ -233,7 +346,7 @@ def _execute_opts(opts, args, util):
     #
     if opts.repo_list:
         resp = util.api.repo_list()
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.repo_create:
         if len(args) >= 3:
@@ -243,20 +356,20 @@ def _execute_opts(opts, args, util):
             resp = util.api.repo_create(opts.repo_create, Data)
         else:
             resp = util.api.repo_create(opts.repo_create)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.repo_show_packages:
         resp = None
         if len(args) >= 3:
-            resp = util.api.repo_show_packages(
+            resp = util.api.repo_iter_packages(
                 opts.repo_show_packages, args[0], args[1], args[2])
         else:
-            resp = util.api.repo_show_packages(opts.repo_show_packages)
-        print json.dumps(resp, indent=2)
+            resp = util.api.repo_iter_packages(opts.repo_show_packages)
+        write(resp)
 
     if opts.repo_show:
         resp = util.api.repo_show(opts.repo_show)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.repo_edit:
         if len(args) >= 3:
@@ -264,47 +377,58 @@ def _execute_opts(opts, args, util):
             Data.default_distribution = args[1]
             Data.default_component = args[2]
             resp = util.api.repo_edit(opts.repo_edit, Data)
-            print json.dumps(resp, indent=2)
+            write(resp)
         else:
             print 'Wrong usage!'
 
     if opts.repo_delete:
         resp = util.api.repo_delete(opts.repo_delete)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.file_list_dirs:
         resp = util.api.file_list_directories()
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.file_upload:
-        resp = util.api.file_upload(opts.file_upload[0], opts.file_upload[1])
-        print json.dumps(resp, indent=2)
+        if len(args) >= 1:
+            resp = util.api.file_upload_many(opts.file_upload[0], [opts.file_upload[1]] + args)
+        else:
+            resp = util.api.file_upload(opts.file_upload[0], opts.file_upload[1])
+        write(resp)
 
     if opts.repo_add_package_from_upload:
         o = opts.repo_add_package_from_upload
         resp = util.api.repo_add_package_from_upload(o[0], o[1], o[2])
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.repo_add_packages_by_key:
         print 'repo_add_packages_by_key'
         o = opts.repo_add_packages_by_key
         key_list = o[1].split(', ')
-        resp = util.api.repo_add_packages_by_key(o[0], key_list)
-        print json.dumps(resp, indent=2)
+        if opts.chunk_size or opts.start_chunk:
+            resp = util.api.repo_add_packages_by_key_chunked(o[0], key_list, opts.chunk_size, opts.start_chunk,
+                                                             util.print_progress)
+        else:
+            resp = util.api.repo_add_packages_by_key(o[0], key_list)
+        write(resp)
 
     if opts.repo_delete_packages_by_key:
         print 'repo_delete_packages_by_key'
         o = opts.repo_delete_packages_by_key
         key_list = o[1].split(', ')
-        resp = util.api.repo_delete_packages_by_key(o[0], key_list)
-        print json.dumps(resp, indent=2)
+        if opts.chunk_size or opts.start_chunk:
+            resp = util.api.repo_delete_packages_by_key_chunked(o[0], key_list, opts.chunk_size, opts.start_chunk,
+                                                                util.print_progress)
+        else:
+            resp = util.api.repo_delete_packages_by_key(o[0], key_list)
+        write(resp)
 
     if opts.file_list:
         resp = util.api.file_list()
 
     if opts.file_delete_dir:
         resp = util.api.file_delete_directory(opts.file_delete_dir)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.file_delete:
         resp = util.api.file_delete(opts.file_delete[0], opts.file_delete[1])
@@ -316,7 +440,7 @@ def _execute_opts(opts, args, util):
             resp = util.api.snapshot_create_from_local_repo(o[0], o[1], args[0])
         else:
             resp = util.api.snapshot_create_from_local_repo(o[0], o[1])
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.snapshot_create_by_pack_refs:
         o = opts.snapshot_create_by_pack_refs
@@ -326,31 +450,31 @@ def _execute_opts(opts, args, util):
             resp = util.api.snapshot_create_from_package_refs(o[0], o[1].split(', '), l, args[0])
         else:
             resp = util.api.snapshot_create_from_package_refs(o[0], o[1].split(', '), l)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.snapshot_show_packages:
         o = opts.snapshot_show_packages
         resp = None
         if len(args) >= 3:
-            resp = util.api.snapshot_show_packages(o, args[0], args[1], args[2])
+            resp = util.api.snapshot_iter_packages(o, args[0], args[1], args[2])
         else:
-            resp = util.api.snapshot_show_packages(o)
-        print json.dumps(resp, indent=2)
+            resp = util.api.snapshot_iter_packages(o)
+        write(resp)
 
     if opts.snapshot_update:
         o = opts.snapshot_update
         if len(args) >= 1:
             resp = util.api.snapshot_update(o[0], o[1], args[0])
-            print json.dumps(resp, indent=2)
+            write(resp)
 
     if opts.snapshot_list:
         if len(args) >= 1:
-            print json.dumps(util.api.snapshot_list(args[0]), indent=2)
+            write(util.api.snapshot_list(args[0]))
         else:
-            print json.dumps(util.api.snapshot_list(), indent=2)
+            write(util.api.snapshot_list())
 
     if opts.snapshot_diff:
-        print json.dumps(util.api.snapshot_diff(opts.snapshot_diff[0], opts.snapshot_diff[1]), indent=2)
+        write(util.api.snapshot_diff(opts.snapshot_diff[0], opts.snapshot_diff[1]))
 
     if opts.snapshot_delete:
         resp = None
@@ -359,11 +483,19 @@ def _execute_opts(opts, args, util):
             resp = util.api.snapshot_delete(opts.snapshot_delete, args[0])
         else:
             resp = util.api.snapshot_delete(opts.snapshot_delete)
-        print json.dumps(resp, indent=2)
+        write(resp)
+
+    if opts.snapshot_delete_many:
+        names = opts.snapshot_delete_many.split(', ')
+        if len(args) >= 1:
+            resp = util.api.snapshot_delete_many(names, args[0])
+        else:
+            resp = util.api.snapshot_delete_many(names)
+        write(resp)
 
     if opts.publish_list:
         resp = util.api.publish_list()
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.publish:
         o = opts.publish
@@ -373,7 +505,7 @@ def _execute_opts(opts, args, util):
                 o[0], o[1], o[2].split(', '), o[3], o[4].split(', '), args[1], args[2], args[3], args[4].split(', '))
         else:
             resp = util.api.publish(o[0], o[1], o[2].split(', '), o[3], o[4].split(', '))
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.publish_switch:
         o = opts.publish_switch
@@ -382,7 +514,7 @@ def _execute_opts(opts, args, util):
             res = util.api.publish_switch(o[0], o[1], o[2], args[0], args[1])
         else:
             res = util.api.publish_switch(o[0], o[1], o[2])
-        print json.dumps(res, indent=2)
+        write(res)
 
     if opts.publish_drop:
         o = opts.publish_drop
@@ -391,22 +523,29 @@ def _execute_opts(opts, args, util):
             resp = util.api.publish_drop(o[0], o[1], args[0])
         else:
             resp = util.api.publish_drop(o[0], o[1])
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.package_show_by_key:
         resp = util.api.package_show_by_key(opts.package_show_by_key)
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     if opts.get_version:
         resp = util.api.get_version()
-        print json.dumps(resp, indent=2)
+        write(resp)
 
     #
     # Extended functionalities
     #
     if opts.create_config:
         # package prefix, reponame
-        util.create_init_file()
+        create_config_file()
+
+    if opts.batch:
+        # loaded on use, it pulls in the worker pool
+        from aptly_cli.cli.batch import run_batch
+        failed = run_batch(util, opts.batch)
+        if failed:
+            sys.exit(1)
 
     if opts.get_last_snapshots:
         o = opts.get_last_snapshots
@@ -415,10 +554,10 @@ def _execute_opts(opts, args, util):
         else:
             res = util.get_last_snapshots(o[0], o[1])
 
-        if len(res) == 1:
+        if len(res) == 1 and opts.output == output.DEFAULT_FORMAT:
             print ''.join(res)
         else:
-            print json.dumps(res, indent=2)
+            write(res)
 
     if opts.clean_last_snapshots:
         o = opts.clean_last_snapshots
@@ -427,7 +566,7 @@ def _execute_opts(opts, args, util):
         else:
             res = util.clean_last_snapshots(o[0], o[1])
 
-        print json.dumps(res, indent=2)
+        write(res)
 
     if opts.diff_both_last_snapshots_mirrors:
         # package prefix, reponame
@@ -452,10 +591,10 @@ def _execute_opts(opts, args, util):
         else:
             res = util.get_last_packages(o[0], o[1], o[2])
 
-        if len(res) == 1:
+        if len(res) == 1 and opts.output == output.DEFAULT_FORMAT:
             print ''.join(res)
         else:
-            print json.dumps(res, indent=2)
+            write(res)
 
     if opts.clean_last_packages:
         o = opts.clean_last_packages
@@ -0,0 +1,465 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Daemon
+Resident mode of the cli. A daemon started with --serve listens on a local
+unix socket and runs the commands forwarded to it, keeping pooled connections,
+the parsed config and the caches warm. Identical read-only commands arriving
+while one of them is running share its result.
+
+The reply to a command is a sequence of frames: a type byte, the payload length
+(4 bytes, big-endian) and the payload. Output frames carry stdout and stderr of the
+command, the last frame its exit status.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
+from SocketServer import StreamRequestHandler, ThreadingUnixStreamServer
+
+# Unix socket of the daemon, unless given by --socket_path or the environment variable SOCKET_ENV
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.aptly-cli.sock')
+SOCKET_ENV = 'APTLY_CLI_SOCKET'
+
+# Options, which are always run by the calling process: they touch local files or start the daemon
+LOCAL_OPTIONS = ('--file_upload', '--create_config', '--serve', '--batch', '--metrics_out', '--trace')
+
+# Options, which do not change anything on the aptly server
+READ_ONLY_OPTIONS = (
+    'repo_list', 'repo_show', 'repo_show_packages', 'file_list_dirs', 'file_list', 'snapshot_show',
+    'snapshot_show_packages', 'snapshot_list', 'snapshot_diff', 'publish_list', 'get_version',
+    'package_show_by_key', 'get_last_snapshots', 'get_last_packages', 'list_repos_and_packages',
+    'diff_both_last_snapshots_mirrors', 'output'
+)
+
+# Size of the blocks the output is received in
+RECV_SIZE = 64 * 1024
+
+# Types of reply frames
+FRAME_STDOUT = 'o'
+FRAME_STDERR = 'e'
+FRAME_EXIT = 'x'
+
+_FRAME_HEADER = struct.Struct('>cI')
+
+# Exit status of a command, whose daemon went away before reporting it
+LOST_STATUS = 1
+
+# Timeout for waiting on a shared result, keeps the thread interruptible
+_WAIT_TIMEOUT = 60 * 60 * 24
+
+
+def socket_path(path=None):
+    """ socket_path
+    Returns the socket of the daemon: path if given, else from the environment or the default.
+    The config file is not read, so forwarding a command costs no parsing.
+    """
+    return os.path.expanduser(path or os.environ.get(SOCKET_ENV) or DEFAULT_SOCKET_PATH)
+
+
+def forward(argv, path=None, out=None, err=None):
+    """ forward
+    Runs the command line argv on the daemon at path (see socket_path) and writes its output
+    to out and err (default: stdout and stderr). Returns the exit status of the command.
+    Returns None without doing anything, if no daemon is listening or argv has to be run locally.
+    """
+    if not argv:
+        return None
+    for arg in argv:
+        name = arg.split('=')[0]
+        if name.startswith('--') and any(opt.startswith(name) for opt in LOCAL_OPTIONS):
+            return None
+
+    path = socket_path(path)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+
+    out = out or sys.stdout
+    err = err or sys.stderr
+    try:
+        sock.sendall(json.dumps({'argv': list(argv)}) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        for kind, payload in _read_frames(sock):
+            if kind == FRAME_EXIT:
+                return int(payload)
+            stream = err if kind == FRAME_STDERR else out
+            stream.write(payload)
+            stream.flush()
+    finally:
+        sock.close()
+    err.write('Connection to the aptly-cli daemon lost\n')
+    return LOST_STATUS
+
+
+def _read_frames(sock):
+    """ _read_frames
+    Yields the (type, payload) frames received on sock, until it is closed.
+    """
+    buf = ''
+    while True:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return
+        buf += data
+        pos = 0
+        while len(buf) - pos >= _FRAME_HEADER.size:
+            kind, size = _FRAME_HEADER.unpack_from(buf, pos)
+            end = pos + _FRAME_HEADER.size + size
+            if len(buf) < end:
+                break
+            yield kind, buf[pos + _FRAME_HEADER.size:end]
+            pos = end
+        buf = buf[pos:]
+
+
+def _exit_status(e):
+    """ _exit_status
+    Returns the exit status of a SystemExit as the interpreter does: 0 for None, other
+    codes than integers are printed to stderr and give 1.
+    """
+    if e.code is None:
+        return 0
+    if isinstance(e.code, (int, long)):
+        return int(e.code)
+    print >> sys.stderr, e.code
+    return 1
+
+
+def is_running(path):
+    """ is_running
+    Returns whether a daemon is listening on the socket path.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(util, parser, execute, path=None):
+    """ serve
+    Runs the daemon on the socket path (see socket_path) until interrupted.
+    Commands are parsed by parser and run by execute(opts, args, util).
+    """
+    path = socket_path(path)
+    if os.path.exists(path):
+        if is_running(path):
+            print "A daemon is already listening on", path
+            return
+        os.remove(path)
+
+    # the socket is accessible by the current user only
+    umask = os.umask(0o077)
+    try:
+        server = DaemonServer(path, util, parser, execute)
+    finally:
+        os.umask(umask)
+
+    with redirect_output():
+        print "aptly-cli daemon listening on", path
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(path)
+
+
+@contextmanager
+def redirect_output():
+    """ redirect_output
+    Replaces sys.stdout and sys.stderr by ThreadOutput, so output of a command (and the
+    worker threads it starts) goes to the client it was forwarded from.
+    """
+    # loaded on use, it pulls in the worker pool
+    from aptly_cli.api.workers import add_handover, remove_handover
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = ThreadOutput(stdout)
+    sys.stderr = ThreadOutput(stderr)
+    add_handover(sys.stdout.capture)
+    add_handover(sys.stderr.capture)
+    try:
+        yield
+    finally:
+        remove_handover(sys.stdout.capture)
+        remove_handover(sys.stderr.capture)
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+class DaemonServer(ThreadingUnixStreamServer):
+
+    """ DaemonServer
+    Unix socket server running each forwarded command in its own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, util, parser, execute):
+        """
+        Binds to the socket path. Commands are parsed by parser and run by execute(opts, args, util).
+        """
+        ThreadingUnixStreamServer.__init__(self, path, _Handler)
+        self.util = util
+        self.parser = parser
+        self.execute_opts = execute
+        self.coalesced = 0
+        self._parser_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _parse(self, argv):
+        """ _parse
+        Parses argv, the parser is not thread-safe.
+        """
+        with self._parser_lock:
+            return self.parser.parse_args(list(argv))
+
+    def _is_read_only(self, opts):
+        """ _is_read_only
+        Returns whether all options given are read-only.
+        """
+        given = [dest for dest, default in self.parser.defaults.items()
+                 if getattr(opts, dest) != default]
+        return bool(given) and all(dest in READ_ONLY_OPTIONS for dest in given)
+
+    def execute(self, argv, client):
+        """ execute
+        Runs the command line argv, writes its output to the client and returns its exit
+        status. A read-only command joins an identical command in flight instead of running again.
+        """
+        sys.stdout.target = client.stdout
+        sys.stderr.target = client.stderr
+        try:
+            try:
+                opts, args = self._parse(argv)
+            except SystemExit as e:
+                return _exit_status(e)
+
+            flight = None
+            if self._is_read_only(opts):
+                key = tuple(argv)
+                with self._lock:
+                    flight = self._flights.get(key)
+                    if flight is not None:
+                        self.coalesced += 1
+                    else:
+                        self._flights[key] = _Flight()
+                if flight is not None:
+                    return flight.follow(client)
+                flight = self._flights[key]
+                sys.stdout.target = _Tee(flight, client, 'stdout')
+                sys.stderr.target = _Tee(flight, client, 'stderr')
+
+            status = 1
+            try:
+                self.execute_opts(opts, args, self.util)
+                status = 0
+            except SystemExit as e:
+                status = _exit_status(e)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if flight is not None:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.finish(status)
+            return status
+        finally:
+            sys.stdout.target = sys.stderr.target = None
+
+
+class _Handler(StreamRequestHandler):
+
+    """ _Handler
+    Reads one forwarded command, streams its output back and reports its exit status.
+    """
+
+    def handle(self):
+        client = _Client(self.wfile)
+        try:
+            request = json.loads(self.rfile.readline())
+            argv = [unicode(arg).encode('utf-8') for arg in request['argv']]
+        except (ValueError, KeyError, TypeError):
+            client.stderr.write('Invalid request\n')
+            client.exit(2)
+            return
+        client.exit(self.server.execute(argv, client))
+
+
+class _Client(object):
+
+    """ _Client
+    Connection to a client, sending output and exit status as frames. Thread-safe, worker
+    threads of a command write concurrently. A client hanging up does not abort the command,
+    other clients may be waiting for its result.
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.gone = False
+        self.stdout = _ClientStream(self, FRAME_STDOUT)
+        self.stderr = _ClientStream(self, FRAME_STDERR)
+        self._lock = threading.Lock()
+
+    def send(self, kind, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        with self._lock:
+            if self.gone:
+                return
+            try:
+                self.wfile.write(_FRAME_HEADER.pack(kind, len(data)) + data)
+                if kind == FRAME_EXIT:
+                    self.wfile.flush()
+            except socket.error:
+                self.gone = True
+
+    def exit(self, status):
+        self.send(FRAME_EXIT, str(status))
+
+
+class _ClientStream(object):
+
+    """ _ClientStream
+    stdout or stderr of a client.
+    """
+
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+
+    def write(self, data):
+        if data:
+            self.client.send(self.kind, data)
+
+    def flush(self):
+        pass
+
+
+class _Flight(object):
+
+    """ _Flight
+    Output and exit status of a read-only command in flight, for the clients joining it.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.status = None
+        self.done = False
+        self._cond = threading.Condition()
+
+    def write(self, stream, data):
+        """ write
+        Records data written to stream (stdout or stderr) of the command.
+        """
+        with self._cond:
+            self.chunks.append((stream, data))
+            self._cond.notify_all()
+
+    def finish(self, status):
+        with self._cond:
+            self.status = status
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self, client):
+        """ follow
+        Writes all output so far and all further output to the client, until the command
+        has finished. Returns its exit status.
+        """
+        pos = 0
+        while True:
+            with self._cond:
+                while pos == len(self.chunks) and not self.done:
+                    self._cond.wait(_WAIT_TIMEOUT)
+                chunks = self.chunks[pos:]
+                pos += len(chunks)
+                done = self.done and pos == len(self.chunks)
+            for stream, data in chunks:
+                getattr(client, stream).write(data)
+            if done:
+                return self.status
+
+
+class _Tee(object):
+
+    """ _Tee
+    Writes to a stream of the client running a command and to the clients joining it.
+    """
+
+    def __init__(self, flight, client, stream):
+        self.flight = flight
+        self.out = getattr(client, stream)
+        self.stream = stream
+
+    def write(self, data):
+        self.out.write(data)
+        self.flight.write(self.stream, data)
+
+    def flush(self):
+        pass
+
+
+class ThreadOutput(object):
+
+    """ ThreadOutput
+    Replaces sys.stdout and sys.stderr of the daemon. Writes go to the target of the
+    current thread, i.e. the client its command was forwarded from, or to the terminal.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self._local, 'target', None) or self.default
+
+    @target.setter
+    def target(self, out):
+        self._local.target = out
+
+    def capture(self):
+        """ capture
+        Captures the target of the current thread for a worker thread, see add_handover.
+        """
+        target = getattr(self._local, 'target', None)
+
+        def apply():
+            previous = getattr(self._local, 'target', None)
+            self._local.target = target
+            return lambda: setattr(self._local, 'target', previous)
+        return apply
+
+    @property
+    def softspace(self):
+        # state of the print statement, kept per thread
+        return getattr(self._local, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self._local.softspace = value
+
+    def write(self, data):
+        self.target.write(data)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Output
+Writes the results of cli commands in the format chosen by --output:
+
+json     indented json (default)
+ndjson   one compact json document per line, one line per list element
+tsv      tab separated values, lists of objects get a header line
+compact  json on a single line
+
+Lists and iterables (e.g. the streamed package lists) are written element by element,
+as they are decoded, so huge results are never held in memory and the first element
+shows up immediately.
+"""
+
+import json
+import sys
+
+FORMATS = ('json', 'ndjson', 'tsv', 'compact')
+
+DEFAULT_FORMAT = 'json'
+
+_COMPACT = (',', ':')
+
+# Escapes of tsv fields, a value must not break its column or line
+_TSV_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+
+def _is_sequence(resp):
+    """ _is_sequence
+    Returns whether resp is written element by element.
+    """
+    return isinstance(resp, (list, tuple)) or hasattr(resp, 'next')
+
+
+def _tsv_field(value):
+    """ _tsv_field
+    Returns value as tsv field, objects and lists as compact json.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list, tuple)):
+        value = json.dumps(value, separators=_COMPACT)
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    for char, escape in _TSV_ESCAPES:
+        value = value.replace(char, escape)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value
+
+
+def _write_json(items, out, indent):
+    """ _write_json
+    Writes the elements as json array, one element at a time.
+    """
+    if indent:
+        start, sep, end = '[\n  ', ',\n  ', '\n]\n'
+        dump = lambda item: json.dumps(item, indent=indent).replace('\n', '\n  ')
+    else:
+        start, sep, end = '[', ',', ']\n'
+        dump = lambda item: json.dumps(item, separators=_COMPACT)
+    first = True
+    for item in items:
+        out.write((start if first else sep) + dump(item))
+        if first:
+            out.flush()
+            first = False
+    out.write('[]\n' if first else end)
+
+
+def _write_ndjson(items, out):
+    """ _write_ndjson
+    Writes one compact json line per element.
+    """
+    first = True
+    for item in items:
+        out.write(json.dumps(item, separators=_COMPACT) + '\n')
+        if first:
+            out.flush()
+            first = False
+
+
+def _write_tsv(items, out):
+    """ _write_tsv
+    Writes one line per element. Objects are written as columns, named by the keys
+    of the first object in a header line.
+    """
+    columns = None
+    first = True
+    for item in items:
+        if isinstance(item, dict):
+            if columns is None:
+                columns = sorted(item)
+                out.write('\t'.join(_tsv_field(c) for c in columns) + '\n')
+            out.write('\t'.join(_tsv_field(item.get(c)) for c in columns) + '\n')
+        else:
+            out.write(_tsv_field(item) + '\n')
+        if first:
+            out.flush()
+            first = False
+
+
+def write(resp, fmt=DEFAULT_FORMAT, out=None):
+    """ write
+    Writes resp to out (default: stdout) in format fmt, see FORMATS. Lists and iterables
+    are written element by element. A failing stream ends the output with its error.
+    """
+    out = out or sys.stdout
+    if fmt not in FORMATS:
+        raise ValueError('Unknown output format: %s' % fmt)
+
+    if not _is_sequence(resp):
+        if fmt == 'json':
+            out.write(json.dumps(resp, indent=2) + '\n')
+        elif fmt == 'tsv' and isinstance(resp, dict):
+            for key in sorted(resp):
+                out.write(_tsv_field(key) + '\t' + _tsv_field(resp[key]) + '\n')
+        elif fmt == 'tsv':
+            out.write(_tsv_field(resp) + '\n')
+        else:
+            out.write(json.dumps(resp, separators=_COMPACT) + '\n')
+        return
+
+    try:
+        if fmt == 'json':
+            _write_json(resp, out, 2)
+        elif fmt == 'compact':
+            _write_json(resp, out, None)
+        elif fmt == 'ndjson':
+            _write_ndjson(resp, out)
+        else:
+            _write_tsv(resp, out)
+    except ValueError as e:
+        out.write('\n%s\n' % e)
@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Config
+The aptly-cli configuration, parsed once per process.
+"""
+
+import os
+import threading
+from ConfigParser import ConfigParser
+
+# Default location of the config file
+CONFIG_PATH = os.path.join(os.path.expanduser('~'), 'aptly-cli.conf')
+
+# Connection pool defaults
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+
+# Number of api calls run concurrently by the workflows
+DEFAULT_WORKERS = 4
+
+# Number of mutating api calls in flight at once, aptly serialises them anyway
+DEFAULT_MAX_MUTATIONS = 1
+
+# Number of package keys sent per request by the chunked package apis
+DEFAULT_CHUNK_SIZE = 500
+
+# Snapshot cache defaults
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'aptly-cli')
+DEFAULT_CACHE_MAX_MB = 256
+
+# Content of the config file written by --create_config
+CONFIG_TEMPLATE = '''[general]
+basic_url=http://localhost
+port=:9003
+save_last_snap=3
+save_last_pkg=10
+prefixes_mirrors=
+package_prefixes=
+repos_to_clean=
+[3rd_party]
+repos=
+staging_snap_pre_post=
+'''
+
+# Keys read from the config file, by section
+_SECTIONS = {
+    'general': ('basic_url', 'port', 'prefixes_mirrors', 'save_last_snap', 'save_last_pkg', 'repos_to_clean',
+                'package_prefixes', 'pool_connections', 'pool_maxsize', 'pool_block', 'keep_alive', 'workers',
+                'cache_dir', 'cache_max_mb', 'local_diff', 'chunk_size', 'max_reads', 'max_mutations'),
+    '3rd_party': ('repos', 'staging_snap_pre_post')
+}
+
+_lock = threading.Lock()
+_cached = None
+
+
+def _split(value):
+    """ _split
+    Splits a comma separated config value into a list.
+    """
+    if not value:
+        return []
+    return [x.strip() for x in value.split(',') if x.strip()]
+
+
+class Config(object):
+
+    """ Config
+    Typed view of the config values. List-valued keys are pre-split,
+    numbers and flags converted. Missing keys fall back to defaults.
+    """
+
+    def __init__(self, values=None, path=None):
+        """
+        Pass the raw string values as read from the config file.
+        """
+        self.path = path
+        self.found = values is not None
+        self.values = dict(values or {})
+        get = self.values.get
+
+        # server
+        self.basic_url = get('basic_url') or 'http://localhost'
+        self.port = get('port') or ':9003'
+        self.url = self.basic_url + self.port
+
+        # connection pool and concurrency
+        self.pool_connections = int(get('pool_connections') or DEFAULT_POOL_CONNECTIONS)
+        self.pool_maxsize = int(get('pool_maxsize') or DEFAULT_POOL_MAXSIZE)
+        self.pool_block = get('pool_block') == '1'
+        self.keep_alive = get('keep_alive') != '0'
+        self.workers = int(get('workers') or DEFAULT_WORKERS)
+        self.chunk_size = int(get('chunk_size') or DEFAULT_CHUNK_SIZE)
+
+        # api calls in flight, reads default to one per pooled connection
+        self.max_reads = int(get('max_reads') or self.pool_maxsize)
+        self.max_mutations = int(get('max_mutations') or DEFAULT_MAX_MUTATIONS)
+
+        # snapshot cache, disabled with a size of 0
+        self.cache_dir = os.path.expanduser(get('cache_dir') or DEFAULT_CACHE_DIR)
+        self.cache_max_mb = int(get('cache_max_mb') or DEFAULT_CACHE_MAX_MB)
+
+        # diff snapshots on the client instead of the server
+        self.local_diff = get('local_diff') == '1'
+
+        # retention
+        self.save_last_snap = int(get('save_last_snap') or 3)
+        self.save_last_pkg = int(get('save_last_pkg') or 10)
+        self.prefixes_mirrors = _split(get('prefixes_mirrors'))
+        self.repos_to_clean = _split(get('repos_to_clean'))
+        self.package_prefixes = _split(get('package_prefixes'))
+
+        # 3rd party
+        self.repos = _split(get('repos'))
+        self.staging_snap_pre_post = _split(get('staging_snap_pre_post'))
+
+    @classmethod
+    def from_file(cls, path=CONFIG_PATH):
+        """ from_file
+        Parses the config file. Returns a Config with default values, if the file can't be read.
+        """
+        config_file = ConfigParser()
+        if not config_file.read(path):
+            return cls(None, path)
+
+        values = {}
+        for section, keys in _SECTIONS.items():
+            for key in keys:
+                if config_file.has_option(section, key):
+                    values[key] = config_file.get(section, key)
+        return cls(values, path)
+
+    def as_dict(self):
+        """ as_dict
+        Returns the raw string values, as found in the config file.
+        """
+        return dict(self.values)
+
+
+def create_config_file(path=CONFIG_PATH):
+    """ create_config_file
+    Will create a config file with default values, if it does not exist.
+    """
+    print "Look for already existing file..."
+
+    if not os.path.exists(path):
+        print 'Create_init_file'
+        try:
+            with open(path, 'a') as conf:
+                conf.write(CONFIG_TEMPLATE)
+        except IOError:
+            print('Something went wrong! Can\'t tell what?')
+
+    else:
+        print "File already exists! Stop action"
+        print path
+
+
+def get_config(reload=False):
+    """ get_config
+    Returns the Config of this process. The file is parsed on first use only,
+    or again when reload is set.
+    """
+    global _cached
+    with _lock:
+        if _cached is None or reload:
+            _cached = Config.from_file()
+        return _cached
+
+
+def reload_config():
+    """ reload_config
+    Parses the config file again and returns the new Config.
+    """
+    return get_config(reload=True)
@@ -0,0 +1,865 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" FakeAptlyServer
+A stand-in for the aptly REST api, holding repos, snapshots, uploaded files, published
+repos and packages in memory. It implements the routes used by AptlyApiRequests, so the
+client can be benchmarked and load-tested offline:
+
+    server = FakeAptlyServer()
+    server.state.seed(repos=50, snapshots=10000, packages=1000000)
+    server.start()
+    api = AptlyApiRequests(Config(server.config_values()))
+
+Faults can be injected: latency of every request, a global write lock taken by every mutation
+(like the aptly database lock) and errors.
+
+$ python -m aptly_cli.fake_server.server --port 9003 --snapshots 10000 --latency 0.01
+"""
+
+import cgi
+import hashlib
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+
+# Version reported by /api/version
+APTLY_VERSION = '0.9.7'
+
+# Elements written at once, when streaming a json array
+STREAM_BATCH = 4096
+
+# Ways the write lock behaves, while a mutation holds it
+LOCK_NONE = 'none'
+LOCK_WAIT = 'wait'
+LOCK_FAIL = 'fail'
+
+# Error of a mutation failing on a held write lock, as reported by aptly
+LOCK_ERROR = 'unable to open database: resource temporarily unavailable (database is locked)'
+
+ARCHS = ('amd64', 'i386', 'all')
+
+
+def package_key(arch, name, version):
+    """ package_key
+    Returns the aptly package key of a package, with a files hash derived from it.
+    """
+    files_hash = hashlib.md5('%s %s %s' % (arch, name, version)).hexdigest()[:16]
+    return u'P%s %s %s %s' % (arch, name, version, files_hash)
+
+
+def _package_details(key):
+    """ _package_details
+    Returns the details of a package as listed in format=details.
+    """
+    arch, name, version, files_hash = key[1:].split(' ')
+    return {
+        'Key': key,
+        'Package': name,
+        'Version': version,
+        'Architecture': arch,
+        'FilesHash': files_hash
+    }
+
+
+def _now():
+    # fractions of a second, like aptly, so snapshots re-created at once differ
+    now = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.%06dZ' % (now % 1 * 1000000)
+
+
+class ApiError(Exception):
+
+    """ ApiError
+    Ends a request with an aptly error response.
+    """
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class Faults(object):
+
+    """ Faults
+    Faults injected into every request.
+
+    latency - seconds every request is delayed, plus up to jitter seconds at random
+    write_lock - how mutations take the global write lock: none, wait for it or fail while it is held
+    write_seconds - seconds a mutation holds the write lock
+    error_rate - share of requests (0 to 1) answered with error_status
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, write_lock=LOCK_WAIT, write_seconds=0.0, error_rate=0.0,
+                 error_status=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.write_lock = write_lock
+        self.write_seconds = write_seconds
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+
+class AptlyState(object):
+
+    """ AptlyState
+    In-memory aptly database. Package lists are lists of package keys, snapshots seeded from
+    the same packages share them. All methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.repos = {}
+        self.repo_packages = {}
+        self.snapshots = {}
+        self.snapshot_packages = {}
+        self.snapshot_order = []
+        self.files = {}
+        self.published = {}
+        self.packages = set()
+        self.versions = 20
+
+    #
+    # Seeding
+    #
+    def seed(self, repos=50, snapshots=10000, packages=1000000, mirrors=20, versions=20, mirror_packages=200,
+             staging=10, rand=None):
+        """ seed
+        Fills the database with synthetic content:
+        repos local repos (repo-00, ...) holding packages package refs in total, every package name
+        (pkg-00000, ...) in versions versions, snapshots snapshots taken from mirrors mirrors (mirror-00_000001, ...)
+        of mirror_packages packages each, and staging 3rd party snapshots. Consecutive snapshots of a
+        mirror differ in a few packages, so diffs have content.
+        Returns the config values of an aptly-cli using the seeded content, see config_values.
+        """
+        rand = rand or random.Random(0)
+        with self._lock:
+            self.versions = versions
+            per_repo = packages // repos if repos else 0
+            for r in range(repos):
+                name = 'repo-%02d' % r
+                keys = []
+                for i in range(per_repo):
+                    pkg, v = divmod(i, versions)
+                    version = '%d:1.%d.%d%s-%d' % (r % 2, v, r, '~rc1' if v % 7 == 6 else '', rand.randint(1, 3))
+                    keys.append(package_key(ARCHS[pkg % len(ARCHS)], 'pkg-%05d' % pkg, version))
+                self._create_repo(name, 'Seeded repo %d' % r, 'trusty', 'main')
+                self.repo_packages[name] = keys
+                self.packages.update(keys)
+
+            nr_mirror = max(snapshots - staging, 0)
+            for m in range(mirrors if nr_mirror else 0):
+                base = [package_key('amd64', 'mirror-%02d-pkg-%03d' % (m, i), '1.%d' % rand.randint(0, 99))
+                        for i in range(mirror_packages)]
+                self.packages.update(base)
+                count = nr_mirror // mirrors + (1 if m < nr_mirror % mirrors else 0)
+                for i in range(count):
+                    update = package_key('amd64', 'mirror-%02d-pkg-%03d' % (m, i % mirror_packages), '2.%d' % i)
+                    self.packages.add(update)
+                    snap = base[:]
+                    snap[i % mirror_packages] = update
+                    self._create_snapshot('mirror-%02d_%06d' % (m, i), 'Snapshot from mirror', snap)
+
+            for i in range(staging):
+                self._create_snapshot('3rdparty-s3-repo_%06d_3rdparty-staging_snapshot' % i, 'Staging', [])
+            self.published[('s3:3rdparty-eu-west-1:', 'precise')] = self._published(
+                's3:3rdparty-eu-west-1:', 'precise', 'snapshot', [])
+            self.published[('s3:3rdparty-us-east-1:', 'precise')] = self._published(
+                's3:3rdparty-us-east-1:', 'precise', 'snapshot', [])
+        return self.config_values()
+
+    def config_values(self):
+        """ config_values
+        Returns the config values (as read from aptly-cli.conf) matching the seeded content,
+        but basic_url and port.
+        """
+        with self._lock:
+            mirrors = sorted(set(name.split('_')[0] + '_' for name in self.snapshots if name.startswith('mirror-')))
+            repos = sorted(self.repos)
+        return {
+            'prefixes_mirrors': ', '.join(mirrors),
+            'repos_to_clean': ', '.join(repos),
+            'package_prefixes': ', '.join('pkg-%05d' % i for i in range(5)),
+            'repos': '3rdparty-eu-west-1, 3rdparty-us-east-1',
+            'staging_snap_pre_post': '3rdparty-s3-repo, 3rdparty-staging_snapshot',
+            'save_last_snap': '3',
+            'save_last_pkg': str(max(self.versions // 2, 1))
+        }
+
+    #
+    # Repos
+    #
+    def _create_repo(self, name, comment='', distribution='', component=''):
+        self.repos[name] = {
+            'Name': name,
+            'Comment': comment or '',
+            'DefaultDistribution': distribution or '',
+            'DefaultComponent': component or ''
+        }
+        self.repo_packages[name] = []
+        return self.repos[name]
+
+    def repo(self, name):
+        with self._lock:
+            if name not in self.repos:
+                raise ApiError(404, 'local repo with name %s not found' % name)
+            return self.repos[name]
+
+    def repo_list(self):
+        with self._lock:
+            return [self.repos[name] for name in sorted(self.repos)]
+
+    def repo_create(self, data):
+        name = data.get('Name')
+        if not name:
+            raise ApiError(400, 'Name is required')
+        with self._lock:
+            if name in self.repos:
+                raise ApiError(400, 'local repo with name %s already exists' % name)
+            return self._create_repo(name, data.get('Comment'), data.get('DefaultDistribution'),
+                                     data.get('DefaultComponent'))
+
+    def repo_edit(self, name, data):
+        with self._lock:
+            repo = self.repo(name)
+            for key in ('Comment', 'DefaultDistribution', 'DefaultComponent'):
+                if data.get(key) is not None:
+                    repo[key] = data[key]
+            return repo
+
+    def repo_delete(self, name):
+        with self._lock:
+            self.repo(name)
+            for pub in self.published.values():
+                if pub['SourceKind'] == 'local' and any(s['Name'] == name for s in pub['Sources']):
+                    raise ApiError(409, 'unable to drop, local repo is published')
+            del self.repos[name]
+            del self.repo_packages[name]
+            return {}
+
+    def repo_packages_of(self, name):
+        with self._lock:
+            self.repo(name)
+            return self.repo_packages[name]
+
+    def repo_add_packages(self, name, keys):
+        with self._lock:
+            self.repo(name)
+            missing = [k for k in keys if k not in self.packages]
+            if missing:
+                raise ApiError(404, 'package %s: not found' % missing[0])
+            present = set(self.repo_packages[name])
+            self.repo_packages[name] = self.repo_packages[name] + [k for k in keys if k not in present]
+            return self.repos[name]
+
+    def repo_delete_packages(self, name, keys):
+        with self._lock:
+            self.repo(name)
+            drop = set(keys)
+            self.repo_packages[name] = [k for k in self.repo_packages[name] if k not in drop]
+            return self.repos[name]
+
+    def repo_add_from_upload(self, name, dir_name, file_name, no_remove):
+        with self._lock:
+            self.repo(name)
+            if dir_name not in self.files:
+                raise ApiError(404, 'directory %s not found' % dir_name)
+            names = [file_name] if file_name else sorted(self.files[dir_name])
+            added, failed = [], []
+            for f in names:
+                parts = f[:-4].split('_') if f.endswith('.deb') else []
+                if len(parts) != 3 or f not in self.files[dir_name]:
+                    failed.append(f)
+                    continue
+                key = package_key(parts[2], parts[0], parts[1])
+                self.packages.add(key)
+                if key not in self.repo_packages[name]:
+                    self.repo_packages[name] = self.repo_packages[name] + [key]
+                added.append('%s_%s_%s added' % (parts[0], parts[1], parts[2]))
+                if not no_remove:
+                    del self.files[dir_name][f]
+            return {
+                'FailedFiles': failed,
+                'Report': {
+                    'Warnings': [],
+                    'Added': added,
+                    'Removed': []
+                }
+            }
+
+    #
+    # Files
+    #
+    def file_dirs(self):
+        with self._lock:
+            return sorted(self.files)
+
+    def file_list(self, dir_name):
+        with self._lock:
+            if dir_name not in self.files:
+                raise ApiError(404, 'directory %s not found' % dir_name)
+            return sorted(self.files[dir_name])
+
+    def file_upload(self, dir_name, uploads):
+        with self._lock:
+            files = self.files.setdefault(dir_name, {})
+            for file_name, size in uploads:
+                files[file_name] = size
+            return ['%s/%s' % (dir_name, f) for f, _ in uploads]
+
+    def file_delete(self, dir_name, file_name=None):
+        with self._lock:
+            if file_name is None:
+                self.files.pop(dir_name, None)
+            elif dir_name in self.files:
+                self.files[dir_name].pop(file_name, None)
+            return {}
+
+    #
+    # Snapshots
+    #
+    def _create_snapshot(self, name, description, keys):
+        self.snapshots[name] = {
+            'Name': name,
+            'CreatedAt': _now(),
+            'Description': description or ''
+        }
+        self.snapshot_packages[name] = keys
+        self.snapshot_order.append(name)
+        return self.snapshots[name]
+
+    def snapshot(self, name):
+        with self._lock:
+            if name not in self.snapshots:
+                raise ApiError(404, 'snapshot with name %s not found' % name)
+            return self.snapshots[name]
+
+    def snapshot_list(self, sort='name'):
+        with self._lock:
+            names = list(self.snapshot_order) if sort == 'time' else sorted(self.snapshots)
+            return [self.snapshots[name] for name in names]
+
+    def snapshot_from_repo(self, repo_name, data):
+        with self._lock:
+            self.repo(repo_name)
+            name = data.get('Name')
+            if not name or name in self.snapshots:
+                raise ApiError(400, 'snapshot with name %s already exists' % name)
+            return self._create_snapshot(name, data.get('Description'), list(self.repo_packages[repo_name]))
+
+    def snapshot_from_refs(self, data):
+        with self._lock:
+            name = data.get('Name')
+            if not name or name in self.snapshots:
+                raise ApiError(400, 'snapshot with name %s already exists' % name)
+            for source in data.get('SourceSnapshots') or []:
+                self.snapshot(source)
+            keys = data.get('PackageRefs') or []
+            missing = [k for k in keys if k not in self.packages]
+            if missing:
+                raise ApiError(404, 'package %s: not found' % missing[0])
+            return self._create_snapshot(name, data.get('Description'), list(keys))
+
+    def snapshot_update(self, name, data):
+        with self._lock:
+            snap = self.snapshot(name)
+            new_name = data.get('Name') or name
+            if new_name != name:
+                if new_name in self.snapshots:
+                    raise ApiError(409, 'unable to rename: snapshot %s already exists' % new_name)
+                del self.snapshots[name]
+                self.snapshots[new_name] = snap
+                self.snapshot_packages[new_name] = self.snapshot_packages.pop(name)
+                self.snapshot_order[self.snapshot_order.index(name)] = new_name
+                snap['Name'] = new_name
+            if data.get('Description') is not None:
+                snap['Description'] = data['Description']
+            return snap
+
+    def snapshot_delete(self, name, force):
+        with self._lock:
+            self.snapshot(name)
+            for pub in self.published.values():
+                if pub['SourceKind'] == 'snapshot' and any(s['Name'] == name for s in pub['Sources']):
+                    raise ApiError(409, 'unable to drop: snapshot is published')
+            del self.snapshots[name]
+            del self.snapshot_packages[name]
+            self.snapshot_order.remove(name)
+            return {}
+
+    def snapshot_packages_of(self, name):
+        with self._lock:
+            self.snapshot(name)
+            return self.snapshot_packages[name]
+
+    def snapshot_diff(self, left, right):
+        with self._lock:
+            left_keys = self.snapshot_packages_of(left)
+            right_keys = self.snapshot_packages_of(right)
+        by_name = lambda keys: dict((tuple(k.split(' ')[:2]), k) for k in keys)
+        left_by, right_by = by_name(left_keys), by_name(right_keys)
+        diff = []
+        for name in sorted(set(left_by) | set(right_by)):
+            l, r = left_by.get(name), right_by.get(name)
+            if l != r:
+                diff.append({'Left': l, 'Right': r})
+        return diff
+
+    #
+    # Publish
+    #
+    @staticmethod
+    def _published(prefix, distribution, kind, sources, data=None):
+        data = data or {}
+        return {
+            'Prefix': prefix,
+            'Distribution': distribution,
+            'SourceKind': kind,
+            'Sources': sources,
+            'Architectures': data.get('Architectures') or ['amd64'],
+            'Label': data.get('Label') or '',
+            'Origin': data.get('Origin') or '',
+            'Storage': prefix.rsplit(':', 1)[0] if ':' in prefix else ''
+        }
+
+    def publish_list(self):
+        with self._lock:
+            return [self.published[key] for key in sorted(self.published)]
+
+    def publish(self, prefix, data):
+        with self._lock:
+            dist = data.get('Distribution') or ''
+            if (prefix, dist) in self.published:
+                raise ApiError(400, 'prefix/distribution already used by another published repo')
+            kind = data.get('SourceKind')
+            sources = data.get('Sources') or []
+            for source in sources:
+                if kind == 'snapshot':
+                    self.snapshot(source.get('Name'))
+                else:
+                    self.repo(source.get('Name'))
+            pub = self._published(prefix, dist, kind, sources, data)
+            self.published[(prefix, dist)] = pub
+            return pub
+
+    def publish_switch(self, prefix, dist, data):
+        with self._lock:
+            if (prefix, dist) not in self.published:
+                raise ApiError(404, 'published repo with prefix/distribution %s/%s not found' % (prefix, dist))
+            pub = self.published[(prefix, dist)]
+            snapshots = data.get('Snapshots') or []
+            for snap in snapshots:
+                self.snapshot(snap.get('Name'))
+            pub['SourceKind'] = 'snapshot'
+            pub['Sources'] = [{'Component': s.get('Component') or 'main', 'Name': s['Name']} for s in snapshots]
+            return pub
+
+    def publish_drop(self, prefix, dist):
+        with self._lock:
+            if self.published.pop((prefix, dist), None) is None:
+                raise ApiError(404, 'published repo with prefix/distribution %s/%s not found' % (prefix, dist))
+            return {}
+
+    def package(self, key):
+        with self._lock:
+            if key not in self.packages:
+                raise ApiError(404, 'package %s not found' % key)
+        return _package_details(key)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    """ _Handler
+    Dispatches requests to the AptlyState of the server by route.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    # (method, route, handler name, mutation)
+    ROUTES = [
+        ('GET', r'/api/version', '_version', False),
+        ('GET', r'/api/repos', '_repo_list', False),
+        ('POST', r'/api/repos', '_repo_create', True),
+        ('GET', r'/api/repos/([^/]+)', '_repo_show', False),
+        ('PUT', r'/api/repos/([^/]+)', '_repo_edit', True),
+        ('DELETE', r'/api/repos/([^/]+)', '_repo_delete', True),
+        ('GET', r'/api/repos/([^/]+)/packages', '_repo_packages', False),
+        ('POST', r'/api/repos/([^/]+)/packages', '_repo_add_packages', True),
+        ('DELETE', r'/api/repos/([^/]+)/packages', '_repo_delete_packages', True),
+        ('POST', r'/api/repos/([^/]+)/file/([^/]+)(?:/([^/]+))?', '_repo_add_from_upload', True),
+        ('POST', r'/api/repos/([^/]+)/snapshots', '_snapshot_from_repo', True),
+        ('GET', r'/api/files', '_file_dirs', False),
+        ('GET', r'/api/files/([^/]+)', '_file_list', False),
+        ('POST', r'/api/files/([^/]+)', '_file_upload', False),
+        ('DELETE', r'/api/files/([^/]+)', '_file_delete_dir', False),
+        ('DELETE', r'/api/files/([^/]+)/([^/]+)', '_file_delete', False),
+        ('GET', r'/api/snapshots', '_snapshot_list', False),
+        ('POST', r'/api/snapshots', '_snapshot_from_refs', True),
+        ('GET', r'/api/snapshots/([^/]+)', '_snapshot_show', False),
+        ('PUT', r'/api/snapshots/([^/]+)', '_snapshot_update', True),
+        ('DELETE', r'/api/snapshots/([^/]+)', '_snapshot_delete', True),
+        ('GET', r'/api/snapshots/([^/]+)/packages', '_snapshot_packages', False),
+        ('GET', r'/api/snapshots/([^/]+)/diff/([^/]+)', '_snapshot_diff', False),
+        ('GET', r'/api/publish', '_publish_list', False),
+        ('POST', r'/api/publish/([^/]*)', '_publish', True),
+        ('PUT', r'/api/publish/([^/]*)/([^/]+)', '_publish_switch', True),
+        ('DELETE', r'/api/publish/([^/]*)/([^/]+)', '_publish_drop', True),
+        ('GET', r'/api/packages/([^/]+)', '_package_show', False),
+    ]
+    _ROUTES = [(method, re.compile(route + '/?$'), name, mutation) for method, route, name, mutation in ROUTES]
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _dispatch(self):
+        url = urlparse.urlsplit(self.path)
+        self.query = dict(urlparse.parse_qsl(url.query))
+        self.body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.count(self.command)
+        faults = self.server.faults
+        try:
+            if faults.latency or faults.jitter:
+                time.sleep(faults.latency + random.random() * faults.jitter)
+            if faults.error_rate and random.random() < faults.error_rate:
+                raise ApiError(faults.error_status, 'injected error')
+            for method, route, name, mutation in self._ROUTES:
+                match = route.match(url.path)
+                if match and method == self.command:
+                    args = [urllib.unquote(a) if a is not None else None for a in match.groups()]
+                    if mutation:
+                        with self.server.write_lock():
+                            result = getattr(self, name)(*args)
+                    else:
+                        result = getattr(self, name)(*args)
+                    if isinstance(result, list) and len(result) > STREAM_BATCH:
+                        self._send_stream(result)
+                    else:
+                        self._send(200, result)
+                    return
+            raise ApiError(404, 'page not found')
+        except ApiError as e:
+            self._send(e.status, [{'error': str(e), 'meta': 'Operation aborted'}])
+        except ValueError as e:
+            self._send(400, [{'error': str(e), 'meta': 'Operation aborted'}])
+
+    def _json_body(self):
+        return json.loads(self.body) if self.body else {}
+
+    def _send(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, items):
+        """ _send_stream
+        Sends a huge json array in chunks, without building it as one string.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        write = self.wfile.write
+        for start in range(0, len(items), STREAM_BATCH):
+            part = ','.join(json.dumps(x) for x in items[start:start + STREAM_BATCH])
+            part = ('[' if start == 0 else ',') + part + (']' if start + STREAM_BATCH >= len(items) else '')
+            write('%x\r\n%s\r\n' % (len(part), part))
+        write('0\r\n\r\n')
+
+    def _packages(self, keys):
+        query = self.query.get('q')
+        if query:
+            name = query.split(' ')[0].split('(')[0]
+            keys = [k for k in keys if k.split(' ')[1] == name]
+        if self.query.get('format') == 'details':
+            return [_package_details(k) for k in keys]
+        return keys
+
+    #
+    # Handlers, one per route
+    #
+    def _version(self):
+        return {'Version': APTLY_VERSION}
+
+    def _repo_list(self):
+        return self.server.state.repo_list()
+
+    def _repo_create(self):
+        return self.server.state.repo_create(self._json_body())
+
+    def _repo_show(self, name):
+        return self.server.state.repo(name)
+
+    def _repo_edit(self, name):
+        return self.server.state.repo_edit(name, self._json_body())
+
+    def _repo_delete(self, name):
+        return self.server.state.repo_delete(name)
+
+    def _repo_packages(self, name):
+        return self._packages(self.server.state.repo_packages_of(name))
+
+    def _repo_add_packages(self, name):
+        return self.server.state.repo_add_packages(name, self._json_body().get('PackageRefs') or [])
+
+    def _repo_delete_packages(self, name):
+        return self.server.state.repo_delete_packages(name, self._json_body().get('PackageRefs') or [])
+
+    def _repo_add_from_upload(self, name, dir_name, file_name):
+        return self.server.state.repo_add_from_upload(name, dir_name, file_name,
+                                                      self.query.get('noRemove') == '1')
+
+    def _snapshot_from_repo(self, name):
+        return self.server.state.snapshot_from_repo(name, self._json_body())
+
+    def _file_dirs(self):
+        return self.server.state.file_dirs()
+
+    def _file_list(self, dir_name):
+        return self.server.state.file_list(dir_name)
+
+    def _file_upload(self, dir_name):
+        form = cgi.FieldStorage(fp=_Body(self.body), headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': self.headers['Content-Type']})
+        uploads = []
+        for field in form.list or []:
+            if field.filename:
+                uploads.append((field.filename, len(field.value)))
+        return self.server.state.file_upload(dir_name, uploads)
+
+    def _file_delete_dir(self, dir_name):
+        return self.server.state.file_delete(dir_name)
+
+    def _file_delete(self, dir_name, file_name):
+        return self.server.state.file_delete(dir_name, file_name)
+
+    def _snapshot_list(self):
+        return self.server.state.snapshot_list(self.query.get('sort', 'name'))
+
+    def _snapshot_from_refs(self):
+        return self.server.state.snapshot_from_refs(self._json_body())
+
+    def _snapshot_show(self, name):
+        return self.server.state.snapshot(name)
+
+    def _snapshot_update(self, name):
+        return self.server.state.snapshot_update(name, self._json_body())
+
+    def _snapshot_delete(self, name):
+        return self.server.state.snapshot_delete(name, self.query.get('force') == '1')
+
+    def _snapshot_packages(self, name):
+        return self._packages(self.server.state.snapshot_packages_of(name))
+
+    def _snapshot_diff(self, left, right):
+        return self.server.state.snapshot_diff(left, right)
+
+    def _publish_list(self):
+        return self.server.state.publish_list()
+
+    def _publish(self, prefix):
+        return self.server.state.publish(prefix, self._json_body())
+
+    def _publish_switch(self, prefix, dist):
+        return self.server.state.publish_switch(prefix, dist, self._json_body())
+
+    def _publish_drop(self, prefix, dist):
+        return self.server.state.publish_drop(prefix, dist)
+
+    def _package_show(self, key):
+        return self.server.state.package(key)
+
+
+class _Body(object):
+
+    """ _Body
+    File-like view of a request body already read, for cgi.FieldStorage.
+    """
+
+    def __init__(self, data):
+        self._pos = 0
+        self._data = data
+
+    def read(self, size=-1):
+        end = len(self._data) if size < 0 else self._pos + size
+        data = self._data[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        end = self._data.find('\n', self._pos)
+        end = len(self._data) if end < 0 else end + 1
+        if size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+
+class FakeAptlyServer(ThreadingMixIn, HTTPServer):
+
+    """ FakeAptlyServer
+    Threaded http server answering like the aptly api, from an AptlyState. Listens on
+    a free port of 127.0.0.1, unless told otherwise.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, state=None, faults=None, verbose=False):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.state = state if state is not None else AptlyState()
+        self.faults = faults if faults is not None else Faults()
+        self.verbose = verbose
+        self._write_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self.counts = {}
+        self._thread = None
+        self._connections_lock = threading.Lock()
+        self._connections = {}
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def config_values(self):
+        """ config_values
+        Returns the config values of an aptly-cli talking to this server, matching the seeded content.
+        """
+        values = self.state.config_values()
+        values['basic_url'] = 'http://%s' % self.server_address[0]
+        values['port'] = ':%d' % self.server_address[1]
+        return values
+
+    def count(self, method):
+        with self._counts_lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+
+    def write_lock(self):
+        """ write_lock
+        Context manager holding the global write lock for a mutation, see Faults.
+        """
+        return _WriteLock(self)
+
+    def start(self):
+        """ start
+        Serves requests in a background thread. Returns the url of the server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-aptly')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def process_request_thread(self, request, client_address):
+        with self._connections_lock:
+            self._connections[request] = threading.current_thread()
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.pop(request, None)
+
+    def stop(self):
+        """ stop
+        Stops serving, closes the socket and the connections kept alive by clients
+        and waits for their threads.
+        """
+        self.shutdown()
+        self.server_close()
+        with self._connections_lock:
+            connections = self._connections.items()
+        for request, thread in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # closed meanwhile
+                pass
+            thread.join()
+
+
+class _WriteLock(object):
+
+    """ _WriteLock
+    The global write lock as taken by one mutation.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.held = False
+
+    def __enter__(self):
+        faults = self.server.faults
+        if faults.write_lock == LOCK_NONE:
+            return self
+        if not self.server._write_lock.acquire(faults.write_lock == LOCK_WAIT):
+            raise ApiError(500, LOCK_ERROR)
+        self.held = True
+        if faults.write_seconds:
+            time.sleep(faults.write_seconds)
+        return self
+
+    def __exit__(self, *exc):
+        if self.held:
+            self.server._write_lock.release()
+        return False
+
+
+def main():
+    parser = OptionParser(usage='python -m aptly_cli.fake_server.server [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=9003)
+    parser.add_option('--repos', type='int', default=50, help='Seeded local repos')
+    parser.add_option('--snapshots', type='int', default=10000, help='Seeded snapshots')
+    parser.add_option('--packages', type='int', default=1000000, help='Seeded package refs of all repos')
+    parser.add_option('--mirrors', type='int', default=20, help='Mirrors the snapshots are taken from')
+    parser.add_option('--latency', type='float', default=0.0, help='Seconds every request is delayed')
+    parser.add_option('--jitter', type='float', default=0.0, help='Random extra delay up to seconds')
+    parser.add_option('--write_lock', type='choice', choices=(LOCK_NONE, LOCK_WAIT, LOCK_FAIL), default=LOCK_WAIT,
+                      help='Mutations wait for the global write lock, fail while it is held or ignore it')
+    parser.add_option('--write_seconds', type='float', default=0.0, help='Seconds a mutation holds the write lock')
+    parser.add_option('--error_rate', type='float', default=0.0, help='Share of requests failing with HTTP 500')
+    parser.add_option('--verbose', action='store_true', help='Log every request')
+    opts, _ = parser.parse_args()
+
+    faults = Faults(opts.latency, opts.jitter, opts.write_lock, opts.write_seconds, opts.error_rate)
+    server = FakeAptlyServer(opts.host, opts.port, faults=faults, verbose=opts.verbose)
+    start = time.time()
+    server.state.seed(opts.repos, opts.snapshots, opts.packages, opts.mirrors)
+    sys.stderr.write('Seeded %d repos, %d snapshots, %d packages in %.1f s\n' % (
+        len(server.state.repos), len(server.state.snapshots), len(server.state.packages), time.time() - start))
+    sys.stderr.write('Serving fake aptly api on %s, config values:\n' % server.url)
+    for key, value in sorted(server.config_values().items()):
+        sys.stderr.write('%s=%s\n' % (key, value))
+    # an empty line ends the config values, for tools reading them
+    sys.stderr.write('\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
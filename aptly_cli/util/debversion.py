@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Debian versions
+Sort keys ordering Debian package versions like dpkg does: epoch first, then the
+upstream version and the revision. Letters sort before other characters and '~'
+sorts before anything, even the end of the version ("1.0~rc1" < "1.0" < "1.0a").
+
+Sorting with version_key as key function computes every key once, instead of
+comparing versions pairwise. Keys are flat tuples of ints, which compare fast.
+"""
+
+import re
+
+# Splits a version part into runs of non-digits followed by digits
+_PARTS = re.compile(r'(\D*)(\d*)')
+
+# Weight of the end of a non-digit run, sorts before any character but '~'
+_END = 0
+
+# Empty non-digit run followed by 0, the same as the end of a version part
+_ZERO = ((_END,), 0)
+
+# Marks the end of a version part, see _part_key
+_SENTINEL = (_END, 0, 0)
+
+# Keys of non-digit runs, they repeat a lot ('.', '-', '~rc', '+deb')
+_run_keys = {}
+_MAX_RUN_KEYS = 10000
+
+# Keys of versions, they repeat across packages and archs
+_version_keys = {}
+_MAX_VERSION_KEYS = 200000
+
+
+def _weight(char):
+    """ _weight
+    Sort weight of a character within a non-digit run.
+    """
+    if char == '~':
+        return -1
+    if char.isalpha() and ord(char) < 128:
+        return ord(char)
+    return ord(char) + 256
+
+
+def _run_key(run):
+    """ _run_key
+    Key of a non-digit run: the weights of its characters, ended by _END.
+    """
+    key = _run_keys.get(run)
+    if key is None:
+        key = tuple([_weight(c) for c in run]) + (_END,)
+        if len(_run_keys) < _MAX_RUN_KEYS:
+            _run_keys[run] = key
+    return key
+
+
+def _part_key(part):
+    """ _part_key
+    Key of the upstream version or the revision: its (non-digit run, number) pairs,
+    flattened. Every run ends with _END, so the pairs of two keys stay aligned.
+    The end of a part compares like endless _ZERO pairs. So trailing _ZERO pairs are
+    dropped and _SENTINEL is appended, which sorts after '~' runs and before any other
+    run or number, exactly like the end.
+    Only the first pair can be _ZERO and be followed by more pairs (e.g. "0~bpo8").
+    Compared to the end, the following pair decides. Its sign (-1 for a '~' run) is
+    added as third item, which makes the pair sort around _SENTINEL the right way.
+    """
+    pairs = [(_run_key(run), int(digits) if digits else 0)
+             for run, digits in _PARTS.findall(part)]
+    while pairs and pairs[-1] == _ZERO:
+        pairs.pop()
+    key = []
+    if len(pairs) > 1 and pairs[0] == _ZERO:
+        key.extend((_END, 0, -1 if pairs[1][0][0] < _END else 1))
+        del pairs[0]
+    for run, number in pairs:
+        key.extend(run)
+        key.append(number)
+    key.extend(_SENTINEL)
+    return key
+
+
+def split_version(version):
+    """ split_version
+    Returns epoch (int), upstream version and revision of a Debian version.
+    """
+    epoch = 0
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+        epoch = int(epoch) if epoch.isdigit() else 0
+    revision = ''
+    if '-' in version:
+        version, revision = version.rsplit('-', 1)
+    return epoch, version, revision
+
+
+def version_key(version):
+    """ version_key
+    Returns the sort key of a Debian version.
+    """
+    key = _version_keys.get(version)
+    if key is None:
+        epoch, upstream, revision = split_version(version)
+        key = tuple([epoch] + _part_key(upstream) + _part_key(revision))
+        if len(_version_keys) < _MAX_VERSION_KEYS:
+            _version_keys[version] = key
+    return key
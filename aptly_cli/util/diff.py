@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Diff
+Client-side snapshot diff over package lists.
+"""
+
+
+def _index(items):
+    """ _index
+    Returns the set of package keys of a package list and, for lists in details
+    format, a lookup of the package objects by key.
+    """
+    items = list(items)
+    if items and not isinstance(items[0], basestring):
+        lookup = dict((x[u'Key'], x) for x in items)
+        return set(lookup), lookup
+    return set(items), None
+
+
+def _arch_name(ref):
+    """ _arch_name
+    Returns the architecture and name part of a package key "P<arch> <name> <version> <hash>".
+    """
+    return ref.split(u' ', 2)[:2]
+
+
+def diff_package_lists(left, right):
+    """ diff_package_lists
+    Calculates the difference of two package lists, as returned by the packages apis in compact
+    (package keys) or details format. The result has the shape of GET /api/snapshots/:name/diff/:withSnapshot:
+    a list of objects with Left and Right, where a package missing on one side is None and
+    different versions of the same package (architecture and name) are paired.
+
+    Both lists are sorted by package key and walked side by side like aptly's PackageRefList.Diff,
+    skipping identical keys, so several versions of a package are paired the way aptly pairs them.
+    """
+    left_refs, left_lookup = _index(left)
+    right_refs, right_lookup = _index(right)
+    left_refs = sorted(left_refs)
+    right_refs = sorted(right_refs)
+
+    def left_item(ref):
+        return ref if left_lookup is None else left_lookup[ref]
+
+    def right_item(ref):
+        return ref if right_lookup is None else right_lookup[ref]
+
+    result = []
+    il = ir = 0
+    while il < len(left_refs) or ir < len(right_refs):
+        if ir >= len(right_refs):
+            result.append({'Left': left_item(left_refs[il]), 'Right': None})
+            il += 1
+        elif il >= len(left_refs):
+            result.append({'Left': None, 'Right': right_item(right_refs[ir])})
+            ir += 1
+        else:
+            ref_left = left_refs[il]
+            ref_right = right_refs[ir]
+            if ref_left == ref_right:
+                il += 1
+                ir += 1
+            elif _arch_name(ref_left) == _arch_name(ref_right):
+                result.append({'Left': left_item(ref_left), 'Right': right_item(ref_right)})
+                il += 1
+                ir += 1
+            elif ref_left < ref_right:
+                result.append({'Left': left_item(ref_left), 'Right': None})
+                il += 1
+            else:
+                result.append({'Left': None, 'Right': right_item(ref_right)})
+                ir += 1
+    return result
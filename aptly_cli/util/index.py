@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" SnapshotIndex
+Index over snapshot names for fast "last n snapshots by prefix" lookups.
+"""
+
+import re
+from bisect import bisect_left
+from operator import itemgetter
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def natural_keys(text):
+    """ natural_keys
+    Split up string at int, so that 'snap_10' sorts after 'snap_9'.
+    """
+    parts = _DIGITS.split(text)
+    # the split puts the digit runs at the odd positions
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+
+class SnapshotIndex(object):
+
+    """ SnapshotIndex
+    Built once from a snapshot list (as returned by snapshot_list). Names are kept
+    sorted together with their natural sort keys, so a prefix is found by bisection
+    instead of a scan, and lookups are memoized.
+    """
+
+    def __init__(self, snaplist):
+        """
+        Pass the snapshot list, either dicts with a Name or plain names.
+        """
+        names = sorted(x[u'Name'] if isinstance(x, dict) else x for x in snaplist)
+        self._names = names
+        self._keys = [natural_keys(x) for x in names]
+        self._found = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, prefix, postfix=None):
+        """ find
+        Returns all names starting with prefix, optionally containing postfix, in natural order.
+        """
+        lookup = (prefix, postfix)
+        if lookup not in self._found:
+            names = self._names
+            matches = []
+            i = bisect_left(names, prefix)
+            while i < len(names) and names[i].startswith(prefix):
+                if postfix is None or postfix in names[i]:
+                    matches.append((self._keys[i], names[i]))
+                i += 1
+            matches.sort(key=itemgetter(0))
+            self._found[lookup] = [name for _, name in matches]
+        return self._found[lookup]
+
+    def last(self, prefix, nr_of_leftover, postfix=None):
+        """ last
+        Returns the last n names by prefix and optional postfix, in natural order.
+        """
+        return self.find(prefix, postfix)[-int(nr_of_leftover):]
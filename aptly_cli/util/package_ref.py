@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" PackageRef
+Compact, parsed form of aptly package keys like "Pamd64 name 1.2.3 hash".
+"""
+
+from aptly_cli.util.debversion import version_key
+
+# Interned field values. intern() takes byte strings only, the keys decoded from json are unicode.
+# Bounded, as a resident daemon sees package lists for its whole life.
+_interned = {}
+_MAX_INTERNED = 200000
+
+
+# _shared(text) returns the shared copy of text, None if there is none
+_shared = _interned.get
+
+
+def _intern(text):
+    """ _intern
+    Returns the one shared copy of text, text itself once the table is full.
+    Hot paths try _shared first.
+    """
+    shared = _shared(text)
+    if shared is None:
+        if len(_interned) < _MAX_INTERNED:
+            _interned[text] = text
+        return text
+    return shared
+
+
+class PackageRef(object):
+
+    """ PackageRef
+    A package key split into arch, name, version and files hash. Arch, name and version are
+    interned, as they repeat across huge package lists. The sort key is computed once.
+    """
+
+    __slots__ = ('arch', 'name', 'version', 'files_hash', '_sort_key')
+
+    def __init__(self, arch, name, version, files_hash):
+        self.arch = _intern(arch)
+        self.name = _intern(name)
+        self.version = _intern(version)
+        self.files_hash = files_hash
+
+    @classmethod
+    def parse(cls, key):
+        """ parse
+        Returns the PackageRef of a package key. A PackageRef is returned as is.
+        """
+        if isinstance(key, PackageRef):
+            return key
+        return cls.from_parts(key.split(' '))
+
+    @classmethod
+    def from_parts(cls, parts):
+        """ from_parts
+        Returns the PackageRef of a package key already split at spaces, e.g. to look at
+        the name before parsing. Skips __init__, this runs once per package of huge lists.
+        """
+        if len(parts) != 4 or not parts[0].startswith('P'):
+            raise ValueError('Not a package key: %s' % ' '.join(parts))
+        arch, name, version, files_hash = parts
+        arch = arch[1:]
+        ref = object.__new__(cls)
+        ref.arch = _shared(arch) or _intern(arch)
+        ref.name = _shared(name) or _intern(name)
+        ref.version = _shared(version) or _intern(version)
+        ref.files_hash = files_hash
+        return ref
+
+    @property
+    def key(self):
+        """ key
+        The package key, as used by the aptly api.
+        """
+        return u'P%s %s %s %s' % (self.arch, self.name, self.version, self.files_hash)
+
+    @property
+    def sort_key(self):
+        """ sort_key
+        Orders packages by Debian version (see debversion), then name, arch and hash.
+        Computed on first use.
+        """
+        try:
+            return self._sort_key
+        except AttributeError:
+            self._sort_key = (version_key(self.version), self.name, self.arch, self.files_hash)
+            return self._sort_key
+
+    def _fields(self):
+        return (self.arch, self.name, self.version, self.files_hash)
+
+    def __eq__(self, other):
+        return isinstance(other, PackageRef) and self._fields() == other._fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __unicode__(self):
+        return self.key
+
+    def __str__(self):
+        return self.key.encode('utf-8')
+
+    def __repr__(self):
+        return 'PackageRef(%r)' % self.key
+
+
+def parse_refs(keys):
+    """ parse_refs
+    Yields the PackageRef of every package key.
+    """
+    parse = PackageRef.parse
+    for key in keys:
+        yield parse(key)
+
+
+def keys_of(refs):
+    """ keys_of
+    Returns the package keys of PackageRefs or keys, as sent to the aptly api.
+    """
+    return [x.key if isinstance(x, PackageRef) else x for x in refs]
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Trace
+Nested timing spans of workflows, their phases and the api requests they send, written
+as Chrome trace events (--trace FILE). Open the file in chrome://tracing or Perfetto.
+
+    tracer = trace.start()
+    api.add_request_hook(tracer)
+    with trace.span('fetch inventory'):
+        ...
+    tracer.dump('run.trace.json')
+
+Spans are only recorded while a tracer is started, otherwise span and traced cost next to nothing.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Categories of spans, from outer to inner
+WORKFLOW = 'workflow'
+PHASE = 'phase'
+HTTP = 'http'
+
+# The started tracer of this process
+_tracer = None
+
+
+class Tracer(object):
+
+    """ Tracer
+    Collects spans of all threads as complete events ("ph": "X"). Nesting is given by time:
+    a span lies within the spans enclosing it on the same thread. Also serves as request hook
+    of AptlyApiRequests, recording every request as span.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+        self._start = time.time()
+        self._pid = os.getpid()
+
+    def add(self, name, cat, start, seconds, args=None):
+        """ add
+        Records a span of the current thread, started at start (time.time()) and lasting seconds.
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - self._start) * 1e6, 1),
+            'dur': round(seconds * 1e6, 1),
+            'pid': self._pid,
+            'tid': thread.ident,
+            'args': args or {}
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name, cat=PHASE, **args):
+        """ span
+        Context manager recording the time spent within as span.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, cat, start, time.time() - start, args)
+
+    def __call__(self, record):
+        """ __call__
+        Records an api request, see AptlyApiRequests.add_request_hook.
+        """
+        args = dict((k, record[k]) for k in ('Url', 'Status', 'RequestBytes', 'ResponseBytes', 'Attempt'))
+        self.add('%s %s' % (record['Method'], record['Route']), HTTP,
+                 time.time() - record['Seconds'], record['Seconds'], args)
+
+    def as_dict(self):
+        """ as_dict
+        Returns the trace in Chrome trace event format.
+        """
+        with self._lock:
+            events = sorted(self._events, key=lambda e: (e['ts'], -e['dur']))
+            names = [{
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self._pid,
+                'tid': tid,
+                'args': {'name': name}
+            } for tid, name in sorted(self._threads.items())]
+        return {
+            'traceEvents': names + events,
+            'displayTimeUnit': 'ms'
+        }
+
+    def dump(self, path):
+        """ dump
+        Writes the trace to path.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f)
+
+
+class _NoSpan(object):
+
+    """ _NoSpan
+    Stands in for a span, while no tracer is started.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+def start():
+    """ start
+    Starts and returns the tracer of this process.
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    """ stop
+    Stops tracing and returns the tracer, None if none was started.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name, cat=PHASE, **args):
+    """ span
+    Context manager recording a span with the started tracer, if any.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, cat, **args)
+
+
+def traced(cat=WORKFLOW):
+    """ traced
+    Decorator recording every call of the function as span, named like the function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(func.__name__, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -5,9 +5,15 @@
 Instance for utils and tools.
 """
 
-import re
-from os.path import expanduser, exists
+import time
+from itertools import chain
 from aptly_cli.api.api import AptlyApiRequests
+from aptly_cli.config.config import create_config_file
+from aptly_cli.api.workers import first_match, imap_bounded
+from aptly_cli.util.diff import diff_package_lists
+from aptly_cli.util.index import SnapshotIndex, natural_keys
+from aptly_cli.util.package_ref import PackageRef, keys_of
+from aptly_cli.util import trace
 
 
 class Util(object):
@@ -16,11 +22,18 @@ class Util(object):
     Instance for utils and tools.
     """
 
-    def __init__(self):
+    def __init__(self, api=None):
         """
         Init contstructor
         """
-        self.api = AptlyApiRequests()
+        self.api = api if api is not None else AptlyApiRequests()
+
+    @property
+    def config(self):
+        """ config
+        The parsed config, shared with the api instance.
+        """
+        return self.api.config
 
     @staticmethod
     def _atoi(text):
@@ -34,71 +47,36 @@ class Util(object):
         """ create_init_file
         Will create a config file at home folder, if it does not exist.
         """
-        home = expanduser("~")
-        name = home + '/aptly-cli.conf'
-
-        print "Look for already existing file..."
-
-        if not exists(name):
-            print 'Create_init_file'
-            try:
-                conf = open(name, 'a')
-                conf.write(
-                    '[general]\nbasic_url=http://localhost\nport=:9003\nsave_last_snap=3\nsave_last_pkg=10\n \
-prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstaging_snap_pre_post=')
-                conf.close()
-
-            except:
-                print('Something went wrong! Can\'t tell what?')
-
-        else:
-            print "File already exists! Stop action"
-            print name
+        create_config_file()
 
-    def _natural_keys(self, text):
+    @staticmethod
+    def _natural_keys(text):
         """ _natural_keys
         Split up string at int.
         """
-        return [self._atoi(c) for c in re.split('(\\d+)', text)]
+        return natural_keys(text)
 
-    def _sort_out_last_n_snap(self, snaplist, prefix, nr_of_leftover, postfix=None):
+    @staticmethod
+    def _sort_out_last_n_snap(snaplist, prefix, nr_of_leftover, postfix=None):
         """ _sort_out_last_n_snap
         Returns n sorted items from given input list by prefix.
+        Pass a SnapshotIndex instead of a list, when looking up more than one prefix.
         """
-        snapstaginglist = []
-        for x in snaplist:
-            if prefix in x[u'Name']:
-                if postfix is None:
-                    # end of string contains
-                    snapstaginglist.append(x[u'Name'])
-                else:
-                    if postfix in x[u'Name']:
-                        snapstaginglist.append(x[u'Name'])
-
-        slen = len(snapstaginglist)
-        snapstaginglist.sort(key=self._natural_keys)
-        ret = []
-        nr_o = int(nr_of_leftover)
-        if slen > (nr_o - 1):
-            for a in snapstaginglist[-nr_o:]:
-                ret.append(a)
-        else:
-            ret = snapstaginglist
+        if not isinstance(snaplist, SnapshotIndex):
+            snaplist = SnapshotIndex(snaplist)
+        return snaplist.last(prefix, nr_of_leftover, postfix)
 
-        return ret
+    def get_snapshot_index(self):
+        """ get_snapshot_index
+        Fetches the snapshot list and returns an index over it.
+        """
+        return SnapshotIndex(self.api.snapshot_list())
 
     def get_last_snapshots(self, prefix, nr_of_vers, postfix=None):
         """ get_last_snapshots
         Returns n versions of snapshots, sorted out by a prefix and optional postfix.
         """
-        snaplist = self.api.snapshot_list()
-        if postfix is None:
-            res = self._sort_out_last_n_snap(snaplist, prefix, nr_of_vers)
-        else:
-            res = self._sort_out_last_n_snap(
-                snaplist, prefix, nr_of_vers, postfix)
-
-        return res
+        return self.get_snapshot_index().last(prefix, nr_of_vers, postfix)
 
     def clean_last_snapshots(self, prefix, nr_of_vers, postfix=None):
         """ clean_last_snapshots
@@ -110,89 +88,131 @@ prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstagin
             items_to_delete = self.get_last_snapshots(
                 prefix, nr_of_vers, postfix)
 
-        nr_to_left_over = int(
-            self.api.get_config_from_file()['save_last_snap'])
+        nr_to_left_over = self.config.save_last_snap
 
         if len(items_to_delete) > nr_to_left_over:
-            for item in items_to_delete[:-nr_to_left_over]:
-                if item:
-                    # force removal
-                    self.api.snapshot_delete(item, '1')
+            # force removal
+            results = self.api.snapshot_delete_many([x for x in items_to_delete[:-nr_to_left_over] if x], '1')
+            for res in results:
+                print ('Deleted' if res['Deleted'] else 'FAILED to delete'), res['Name'], res['Error'] or ''
+            return results
         else:
             print prefix
             print "Nothing to delete...."
 
+    def diff_snapshots(self, snapshot_left, snapshot_right):
+        """ diff_snapshots
+        Returns the difference of two snapshots, like the snapshot_diff api. With local_diff set in the
+        config, it is calculated from the (cached) package lists instead of by the aptly server.
+        """
+        if not self.config.local_diff:
+            return self.api.snapshot_diff(snapshot_left, snapshot_right)
+
+        left = self.api.snapshot_show_packages(snapshot_left)
+        if not isinstance(left, list):
+            return left
+        right = self.api.snapshot_show_packages(snapshot_right)
+        if not isinstance(right, list):
+            return right
+        return diff_package_lists(left, right)
+
+    def check_mirrors_for_updates(self):
+        """ check_mirrors_for_updates
+        Diffs the last two snapshots of every mirror (from config) concurrently. The first mirror
+        with new content cancels the remaining diffs.
+        Returns the changed mirrors, the mirrors checked and cancelled and the diff of the changed mirror.
+        """
+        index = self.get_snapshot_index()
+        pairs = []
+        for x in self.config.prefixes_mirrors:
+            res_list = index.last(x, 2)
+            if len(res_list) >= 2:
+                pairs.append((x, res_list))
+
+        completed, changed = first_match(
+            lambda pair: self.diff_snapshots(pair[1][0], pair[1][1]), pairs, bool, self.config.workers)
+
+        checked = [pair[0] for pair, _ in completed]
+        return {
+            'Changed': [changed[0][0]] if changed else [],
+            'Checked': checked,
+            'Cancelled': [pair[0] for pair in pairs if pair[0] not in checked],
+            'Diff': changed[1] if changed else None
+        }
+
     def diff_both_last_snapshots_mirrors(self):
         """ diff_both_last_snapshots_mirrors
         Fetches out last two versions of snapshots from a given list of mirrors and diffs both.
         Return, if all mirrors have new content to update or not (EMPTY).
+        The diffs run concurrently, see check_mirrors_for_updates.
         """
-        local_cfg = self.api.get_config_from_file()
-        if local_cfg['prefixes_mirrors']:
-            prefix_list = local_cfg['prefixes_mirrors'].split(', ')
-        else:
+        if not self.config.prefixes_mirrors:
             print "Error: Prefix list is empty: please add prefixes_mirrors to your configfile!"
+            return ""
 
-        snaplist = self.api.snapshot_list()
-        results = []
-        result = ""
-
-        for x in prefix_list:
-            res_list = self._sort_out_last_n_snap(snaplist, x, 2)
-            if len(res_list) >= 2:
-                res = self.api.snapshot_diff(res_list[0], res_list[1])
-                if not res:
-                    results.append("EMPTY")
-                else:
-                    results.append(res)
-                    break
-            else:
-                results.append("EMPTY")
-
-        # print results
-        result = ""
-        for y in results:
-            if y == "EMPTY":
-                result = "EMPTY"
-            else:
-                result = y
-                break
+        check = self.check_mirrors_for_updates()
+        if check['Changed']:
+            print "New content in mirror:", ', '.join(check['Changed'])
+            result = check['Diff']
+        else:
+            result = "EMPTY"
 
         print result
         return result
 
     def list_all_repos_and_packages(self):
         """ list_all_repos_and_packages
+        Package lists are streamed and printed in repo order. A bounded pool of workers
+        requests the next repos ahead, but decodes only their first package, so at most
+        workers responses are open and none is held in memory as a whole.
         """
-        repos = self.api.repo_list()
-        for repo in repos:
-            print repo[u'Name']
-            packs = self.api.repo_show_packages(repo[u'Name'])
-            for pack in packs:
-                print pack
+        def fetch(repo):
+            packs = self.api.repo_iter_packages(repo[u'Name'])
+            try:
+                return repo[u'Name'], chain([next(packs)], packs)
+            except StopIteration:
+                return repo[u'Name'], []
+            except ValueError as e:
+                # not a package list, e.g. an error response
+                return repo[u'Name'], e
+
+        for name, packs in imap_bounded(fetch, self.api.repo_list(), self.config.workers):
+            print name
+            if isinstance(packs, Exception):
+                print packs
+            else:
+                for pack in packs:
+                    print pack
 
     def get_last_packages(self, repo_name, pack_prefix, nr_of_leftover, postfix=None):
         """ get_last_packages
+        Returns the package keys of the last n packages (highest Debian versions) by reponame and prefix.
         """
-        resp = None
-        packs = self.api.repo_show_packages(repo_name)
+        return keys_of(self._get_last_package_refs(repo_name, pack_prefix, nr_of_leftover, postfix))
+
+    def _get_last_package_refs(self, repo_name, pack_prefix, nr_of_leftover, postfix=None, packs=None):
+        """ _get_last_package_refs
+        Same as get_last_packages, but returns PackageRefs. Pass the packages of the repo
+        (keys or PackageRefs) as packs, if already fetched.
+        """
+        if packs is None:
+            packs = self.api.repo_iter_packages(repo_name)
         if postfix:
-            resp = self._sort_out_last_n_packages(packs, pack_prefix, nr_of_leftover, postfix)
-        else:
-            resp = self._sort_out_last_n_packages(packs, pack_prefix, nr_of_leftover)
-        return resp
+            return self._sort_out_last_n_packages(packs, pack_prefix, nr_of_leftover, postfix)
+        return self._sort_out_last_n_packages(packs, pack_prefix, nr_of_leftover)
 
-    def clean_last_packages(self, repo_name, pack_prefix, nr_of_leftover, postfix=None):
+    def clean_last_packages(self, repo_name, pack_prefix, nr_of_leftover, postfix=None, packs=None):
         """ clean_last_packages
+        Pass the packages of the repo (keys or PackageRefs) as packs, if already fetched.
         """
         items_to_delete = None
-        if postfix:
-            items_to_delete = self.get_last_packages(repo_name, pack_prefix, nr_of_leftover, postfix)
-        else:
-            items_to_delete = self.get_last_packages(repo_name, pack_prefix, nr_of_leftover)
+        with trace.span('compute retention', Repo=repo_name, Prefix=pack_prefix):
+            if postfix:
+                items_to_delete = self._get_last_package_refs(repo_name, pack_prefix, nr_of_leftover, postfix, packs)
+            else:
+                items_to_delete = self._get_last_package_refs(repo_name, pack_prefix, nr_of_leftover, packs=packs)
 
-        nr_to_left_over = int(
-            self.api.get_config_from_file()['save_last_pkg'])
+        nr_to_left_over = self.config.save_last_pkg
 
         print nr_to_left_over
 
@@ -204,24 +224,42 @@ prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstagin
                     print item
                     worklist.append(item)
 
-            self.api.repo_delete_packages_by_key(repo_name, worklist)
+            with trace.span('delete', Repo=repo_name, Packages=len(worklist)):
+                res = self.api.repo_delete_packages_by_key_chunked(repo_name, worklist, progress=self.print_progress)
+            if res['Failed']:
+                print "Removal failed at chunk %d of %d: %s" % (
+                    res['Failed']['Chunk'] + 1, res['Chunks'], res['Failed']['Error'])
+            return res
         else:
             print "Nothing to delete..."
 
-    def _sort_out_last_n_packages(self, packlist, prefix, nr_of_leftover, postfix=None):
+    @staticmethod
+    def print_progress(chunk, nr_of_chunks, nr_done):
+        """ print_progress
+        Prints the progress of a chunked package operation.
+        """
+        print "Chunk %d of %d done (%d packages)" % (chunk + 1, nr_of_chunks, nr_done)
+
+    @staticmethod
+    def _sort_out_last_n_packages(packlist, prefix, nr_of_leftover, postfix=None):
         """ _sort_out_last_n_snap
         Returns n sorted items from given input list by prefix.
+        Takes package keys or PackageRefs and returns PackageRefs, ordered by Debian version.
         """
         # print packlist
         worklist = []
-        for pack_blob in packlist:
-            pack_tmp = pack_blob.split(' ')
-            if pack_tmp[1] in prefix:
-                worklist.append(pack_blob)
-            # print pack_tmp[1]
+        for pack in packlist:
+            if isinstance(pack, PackageRef):
+                if pack.name in prefix:
+                    worklist.append(pack)
+            else:
+                # only matching keys are parsed
+                parts = pack.split(' ')
+                if parts[1] in prefix:
+                    worklist.append(PackageRef.from_parts(parts))
 
         slen = len(worklist)
-        worklist.sort(key=self._natural_keys)
+        worklist.sort(key=lambda x: x.sort_key)
         ret = []
         nr_o = int(nr_of_leftover)
         if slen > (nr_o - 1):
@@ -232,42 +270,79 @@ prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstagin
 
         return ret
 
+    @trace.traced()
     def clean_mirrored_snapshots(self):
         """ clean_mirrored_snapshots
         Clean out all snapshots that were taken from mirrors. The mirror entries are taken from config file.
+        The snapshot list is fetched and indexed once for all mirrors. Deletions are issued by a pool of workers
+        and run max_mutations at a time.
+        Returns the outcome of every deletion and the total wall time.
         """
         print "clean mirrored snapshots"
-        local_cfg = self.api.get_config_from_file()
-        if local_cfg['prefixes_mirrors']:
-            prefix_list = local_cfg['prefixes_mirrors'].split(', ')
+        start = time.time()
+        if self.config.prefixes_mirrors:
+            prefix_list = self.config.prefixes_mirrors
         else:
             print "Error: Prefix list is empty: please add prefixes_mirrors to your configfile!"
-
-        for x in prefix_list:
-            self.clean_last_snapshots(x, 100)
-
+            return
+
+        nr_to_left_over = self.config.save_last_snap
+        with trace.span('fetch inventory'):
+            index = self.get_snapshot_index()
+
+        items_to_delete = []
+        seen = set()
+        with trace.span('compute retention', Prefixes=len(prefix_list)):
+            for x in prefix_list:
+                res_list = index.last(x, 100)
+                if len(res_list) > nr_to_left_over:
+                    for item in res_list[:-nr_to_left_over]:
+                        if item and item not in seen:
+                            seen.add(item)
+                            items_to_delete.append(item)
+                else:
+                    print x
+                    print "Nothing to delete...."
+
+        with trace.span('delete', Snapshots=len(items_to_delete)):
+            results = self.api.snapshot_delete_many(items_to_delete, '1')
+        for res in results:
+            print ('Deleted' if res['Deleted'] else 'FAILED to delete'), res['Name'], res['Error'] or ''
+
+        report = {
+            'Results': results,
+            'Seconds': round(time.time() - start, 3)
+        }
+        print "Deleted %d of %d snapshots in %.3f seconds" % (
+            len([r for r in results if r['Deleted']]), len(results), report['Seconds'])
+        return report
+
+    @trace.traced()
     def clean_repo_packages(self):
         """ clean_repo_snapshots
         Clean out all snapshots that were taken from repos. The repo entries are taken from config file.
+        The package list of each repo is fetched and parsed once for all prefixes.
         """
         print "clean snapshots from repos"
-        local_cfg = self.api.get_config_from_file()
-        if local_cfg['repos_to_clean']:
-            repo_list = local_cfg['repos_to_clean'].split(', ')
+        if self.config.repos_to_clean:
+            repo_list = self.config.repos_to_clean
         else:
             print "Error: Prefix list is empty: please add repos_to_clean to your configfile!"
 
-        if local_cfg['package_prefixes']:
-            pack_pref_list = local_cfg['package_prefixes'].split(', ')
+        if self.config.package_prefixes:
+            pack_pref_list = self.config.package_prefixes
         else:
             print "Error: Prefix list is empty: please add package_prefixes to your configfile!"
 
         for repo_name in repo_list:
             print repo_name
+            with trace.span('fetch inventory', Repo=repo_name):
+                packs = list(self.api.repo_iter_package_refs(repo_name))
             for pack_prefix in pack_pref_list:
                 print pack_prefix
-                self.clean_last_packages(repo_name, pack_prefix, 100)
+                self.clean_last_packages(repo_name, pack_prefix, 100, packs=packs)
 
+    @trace.traced()
     def publish_switch_3rdparty_production(self):
         """ publish_switch_s3_3rd_party_production
         Publish the latest 3rd party snapshot from staging to production, only if there is new content available.
@@ -275,14 +350,13 @@ prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstagin
         print "publish_switch_s3_3rd_party_production"
 
         # Get Config
-        local_cfg = self.api.get_config_from_file()
-        if local_cfg['repos']:
-            s3_list = local_cfg['repos'].split(', ')
+        if self.config.repos:
+            s3_list = self.config.repos
         else:
             print "Error: Prefix list is empty: please add s3 buckets to your configfile!"
 
-        if local_cfg['staging_snap_pre_post']:
-            prefix_postfix = local_cfg['staging_snap_pre_post'].split(', ')
+        if self.config.staging_snap_pre_post:
+            prefix_postfix = self.config.staging_snap_pre_post
         else:
             print "Error: Prefix list is empty: please add staging_snap_pre_post to your configfile!"
 
@@ -298,15 +372,18 @@ prefixes_mirrors=\npackage_prefixes=\nrepos_to_clean=\n[general]\nrepos=\nstagin
             print "New packages were found...", res
 
             # Get most actual snapshot from 3rdparty staging
-            last_snap = self.get_last_snapshots(prefix_postfix[0], 1, prefix_postfix[1])
+            with trace.span('fetch inventory'):
+                last_snap = self.get_last_snapshots(prefix_postfix[0], 1, prefix_postfix[1])
             print "This is the new snapshot: ", last_snap
 
             # publish snapshots to production on s3
             print ("Publish ", last_snap, s3_list[0])
-            self.api.publish_switch(s3_list[0], last_snap, "precise", "main", 0)
+            with trace.span('publish switch', Prefix=s3_list[0]):
+                self.api.publish_switch(s3_list[0], last_snap, "precise", "main", 0)
 
             print ("Publish ", last_snap, s3_list[1])
-            self.api.publish_switch(s3_list[1], last_snap, "precise", "main", 0)
+            with trace.span('publish switch', Prefix=s3_list[1]):
+                self.api.publish_switch(s3_list[1], last_snap, "precise", "main", 0)
 
             # clean out
             self.clean_mirrored_snapshots()
@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_debversion
+Sorts a large list of Debian versions with the precomputed version_key and with the
+natural sort keys used for retention before. Checks version_key against a pairwise
+port of dpkg's comparison and counts the versions the natural sort misplaces.
+
+$ python benchmarks/bench_debversion.py [NR_OF_VERSIONS]
+"""
+
+import os
+import random
+import sys
+import time
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.util.debversion import version_key, split_version
+from aptly_cli.util.index import natural_keys
+
+NR_OF_CHECKS = 20000
+
+
+def _order(char):
+    """ _order
+    Character order of dpkg, '' stands for the end of the string.
+    """
+    if char.isdigit() or char == '':
+        return 0
+    if char.isalpha():
+        return ord(char)
+    if char == '~':
+        return -1
+    return ord(char) + 256
+
+
+def _verrevcmp(a, b):
+    """ _verrevcmp
+    Port of the pairwise comparison of dpkg (lib/dpkg/version.c), character by character.
+    """
+    # the C code relies on the terminating NUL, '' stands for it here
+    char = lambda text, pos: text[pos] if pos < len(text) else ''
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (char(a, i) and not char(a, i).isdigit()) or (char(b, j) and not char(b, j).isdigit()):
+            ac = _order(char(a, i))
+            bc = _order(char(b, j))
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while char(a, i) == '0':
+            i += 1
+        while char(b, j) == '0':
+            j += 1
+        while char(a, i).isdigit() and char(b, j).isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if char(a, i).isdigit():
+            return 1
+        if char(b, j).isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _dpkg_cmp(a, b):
+    """ _dpkg_cmp
+    Compares two Debian versions pairwise.
+    """
+    epoch_a, upstream_a, revision_a = split_version(a)
+    epoch_b, upstream_b, revision_b = split_version(b)
+    return (cmp(epoch_a, epoch_b) or
+            _verrevcmp(upstream_a, upstream_b) or
+            _verrevcmp(revision_a, revision_b))
+
+
+def _random_version():
+    """ _random_version
+    A version as found in the wild: epochs, pre-releases, revisions and backports.
+    """
+    version = '%d.%d' % (random.randint(0, 12), random.randint(0, 30))
+    if random.random() < 0.5:
+        version += '.%d' % random.randint(0, 200)
+    if random.random() < 0.1:
+        version = '%d:%s' % (random.randint(1, 3), version)
+    if random.random() < 0.2:
+        version += random.choice(['~rc%d' % random.randint(1, 5), '~beta', 'a', '+dfsg', '.0'])
+    if random.random() < 0.7:
+        version += '-%d' % random.randint(0, 9)
+        if random.random() < 0.2:
+            version += random.choice(['ubuntu%d' % random.randint(1, 3), '~bpo8+1', '+deb8u%d' % random.randint(1, 4)])
+    return version
+
+
+def main():
+    nr_of_versions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    pool = [_random_version() for _ in xrange(min(nr_of_versions, 50000))]
+    versions = [random.choice(pool) for _ in xrange(nr_of_versions)]
+
+    start = time.time()
+    by_natural = sorted(versions, key=natural_keys)
+    natural_time = time.time() - start
+
+    start = time.time()
+    by_version = sorted(versions, key=version_key)
+    version_time = time.time() - start
+
+    checks = random.sample(pool, min(len(pool), NR_OF_CHECKS))
+    checks.sort(key=version_key)
+    for a, b in zip(checks, checks[1:]):
+        assert _dpkg_cmp(a, b) <= 0, (a, b)
+    for a, b in zip(random.sample(pool, 2000), random.sample(pool, 2000)):
+        key_order = cmp(version_key(a), version_key(b))
+        assert key_order == cmp(_dpkg_cmp(a, b), 0), (a, b)
+
+    misplaced = sum(1 for a, b in zip(by_natural, by_version) if a != b)
+
+    print 'versions:                %d' % nr_of_versions
+    print 'natural keys sort:       %.2f s' % natural_time
+    print 'version_key sort:        %.2f s' % version_time
+    print 'misplaced by natural:    %.1f %%' % (100.0 * misplaced / nr_of_versions)
+    print 'checked against dpkg:    %d pairs' % (len(checks) - 1 + 2000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_diff
+Measures the client-side snapshot diff on two large package lists,
+which differ in a few versions, removals and additions.
+
+$ python benchmarks/bench_diff.py [NR_OF_PACKAGES]
+"""
+
+import os
+import random
+import sys
+import time
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.util.diff import diff_package_lists
+
+
+def main():
+    nr_of_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    left = [u'Pamd64 package%d 1.%d-1 %016x' % (i, i % 97, i) for i in xrange(nr_of_packages)]
+    right = list(left)
+    for i in random.sample(xrange(nr_of_packages), 1000):
+        right[i] = right[i].replace(u' 1.', u' 2.')
+    del right[:100]
+    right.extend(u'Pi386 added%d 1.0 %016x' % (i, i) for i in xrange(100))
+    random.shuffle(right)
+
+    start = time.time()
+    diff = diff_package_lists(left, right)
+    elapsed = time.time() - start
+
+    print 'packages per snapshot:   %d' % nr_of_packages
+    print 'diff entries:            %d' % len(diff)
+    print 'diff time:               %.1f ms' % (elapsed * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_e2e
+End-to-end benchmark of every AptlyApiRequests method and the Util workflows against the
+fake aptly server (aptly_cli.fake_server), seeded at scale in a separate process.
+Reports calls, throughput and p50/p99 latency per method and workflow, optionally writes
+them as json and compares them against a stored baseline.
+
+clean_mirrored_snapshots and clean_repo_packages delete what they clean, so they run once,
+after all other measurements. The snapshot cache is disabled, every call goes to the server.
+
+$ python benchmarks/bench_e2e.py [--snapshots N] [--repos N] [--packages N] [--calls N] [--runs N]
+      [--latency S] [--write_seconds S] [--out FILE] [--baseline FILE] [--threshold RATIO]
+"""
+
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from optparse import OptionParser
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.api.api import AptlyApiRequests
+from aptly_cli.config.config import Config
+from aptly_cli.util.util import Util
+
+# Seconds to wait for the server to seed and listen
+START_TIMEOUT = 600
+
+# Workflows, which don't change the server state, measured runs times
+READ_WORKFLOWS = ('diff_both_last_snapshots_mirrors', 'list_all_repos_and_packages')
+
+# Workflows deleting what they clean, measured once in this order
+CLEAN_WORKFLOWS = ('clean_mirrored_snapshots', 'clean_repo_packages')
+
+
+class _Data(object):
+
+    """ _Data
+    Data argument of repo_create and repo_edit.
+    """
+
+    comment = 'benchmark'
+    default_distribution = 'trusty'
+    default_component = 'main'
+
+
+@contextmanager
+def _quiet():
+    """ _quiet
+    Silences the output of api methods and workflows while measuring.
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _start_server(opts):
+    """ _start_server
+    Starts the seeded fake server and returns the process and the config values it prints.
+    """
+    port = _free_port()
+    cmd = [sys.executable, '-m', 'aptly_cli.fake_server.server', '--port', str(port),
+           '--repos', str(opts.repos), '--snapshots', str(opts.snapshots), '--packages', str(opts.packages),
+           '--mirrors', str(opts.mirrors), '--latency', str(opts.latency), '--write_seconds', str(opts.write_seconds)]
+    proc = subprocess.Popen(cmd, stderr=subprocess.PIPE, env=dict(os.environ, PYTHONPATH=ROOT))
+    values = {}
+    start = time.time()
+    in_values = False
+    while time.time() - start < START_TIMEOUT:
+        line = proc.stderr.readline()
+        if not line:
+            break
+        line = line.rstrip('\n')
+        if line.startswith('Seeded'):
+            print line
+        elif line.startswith('Serving'):
+            in_values = True
+        elif in_values and not line:
+            return proc, values
+        elif in_values:
+            key, value = line.split('=', 1)
+            values[key] = value
+    proc.kill()
+    raise RuntimeError('Fake aptly server did not start')
+
+
+def _percentile(samples, q):
+    """ _percentile
+    Nearest-rank percentile of sorted samples.
+    """
+    return samples[min(len(samples) - 1, max(0, int(round(q * len(samples) + 0.5)) - 1))]
+
+
+def _is_error(resp):
+    if isinstance(resp, list) and resp and isinstance(resp[0], dict):
+        resp = resp[0]
+    return isinstance(resp, dict) and 'error' in resp
+
+
+def _summary(samples, errors=0):
+    """ _summary
+    Returns calls, throughput and latency percentiles of the sample durations (seconds).
+    """
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'Calls': len(samples),
+        'Errors': errors,
+        'Seconds': round(total, 6),
+        'Throughput': round(len(samples) / total, 3) if total else None,
+        'P50Ms': round(_percentile(samples, 0.5) * 1000, 3),
+        'P99Ms': round(_percentile(samples, 0.99) * 1000, 3)
+    }
+
+
+class _Recorder(object):
+
+    """ _Recorder
+    Collects the durations of calls by name.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def call(self, name, func, *args):
+        start = time.time()
+        try:
+            resp = func(*args)
+            if hasattr(resp, 'next'):
+                resp = list(resp)
+            failed = _is_error(resp)
+        except Exception:
+            resp = None
+            failed = True
+        self.samples.setdefault(name, []).append(time.time() - start)
+        self.errors[name] = self.errors.get(name, 0) + (1 if failed else 0)
+        return resp
+
+    def results(self):
+        return dict((name, _summary(samples, self.errors[name])) for name, samples in sorted(self.samples.items()))
+
+
+def _bench_methods(api, values, nr_of_calls, tmp):
+    """ _bench_methods
+    Calls every api method nr_of_calls times. Mutations work on objects created for the benchmark,
+    in the order of their lifecycle, so the seeded content stays as it is.
+    """
+    rec = _Recorder()
+    repo = values['repos_to_clean'].split(', ')[0]
+    mirror = values['prefixes_mirrors'].split(', ')[0]
+    snaps = [s['Name'] for s in api.snapshot_list('name') if s['Name'].startswith(mirror)]
+    keys = api.repo_show_packages(repo)[:100]
+    deb = os.path.join(tmp, 'bench-pkg_1.0_amd64.deb')
+    with open(deb, 'wb') as f:
+        f.write('\0' * 4096)
+
+    for i in xrange(nr_of_calls):
+        # reads of seeded content
+        rec.call('get_version', api.get_version)
+        rec.call('repo_list', api.repo_list)
+        rec.call('repo_show', api.repo_show, repo)
+        rec.call('repo_show_packages', api.repo_show_packages, repo)
+        rec.call('repo_iter_packages', api.repo_iter_packages, repo)
+        rec.call('snapshot_list', api.snapshot_list)
+        rec.call('snapshot_show', api.snapshot_show, snaps[i % len(snaps)])
+        rec.call('snapshot_show_packages', api.snapshot_show_packages, snaps[i % len(snaps)])
+        rec.call('snapshot_diff', api.snapshot_diff, snaps[i % len(snaps)], snaps[(i + 1) % len(snaps)])
+        rec.call('publish_list', api.publish_list)
+        rec.call('package_show_by_key', api.package_show_by_key, keys[i % len(keys)])
+
+        # lifecycle of a repo, its snapshots and publishing
+        name = 'bench-%d' % i
+        rec.call('repo_create', api.repo_create, name, _Data)
+        rec.call('repo_edit', api.repo_edit, name, _Data)
+        rec.call('repo_add_packages_by_key', api.repo_add_packages_by_key, name, keys)
+        rec.call('repo_delete_packages_by_key', api.repo_delete_packages_by_key, name, keys[:10])
+        rec.call('file_upload', api.file_upload, name, deb)
+        rec.call('file_list_directories', api.file_list_directories)
+        rec.call('file_list', api.file_list, name)
+        rec.call('repo_add_package_from_upload', api.repo_add_package_from_upload, name, name)
+        rec.call('file_upload_many', api.file_upload_many, name, [deb])
+        rec.call('file_delete', api.file_delete, name, os.path.basename(deb))
+        rec.call('file_delete_directory', api.file_delete_directory, name)
+        rec.call('snapshot_create_from_local_repo', api.snapshot_create_from_local_repo, name, name)
+        rec.call('snapshot_create_from_package_refs', api.snapshot_create_from_package_refs,
+                 name + '-refs', [name], keys[:10])
+        rec.call('snapshot_update', api.snapshot_update, name + '-refs', name + '-renamed')
+        rec.call('publish', api.publish, 's3:bench%d:' % i, 'snapshot', [name], 'trusty', ['main'])
+        rec.call('publish_switch', api.publish_switch, 'bench%d' % i, name + '-renamed', 'trusty', 'main')
+        rec.call('publish_drop', api.publish_drop, 's3:bench%d:' % i, 'trusty')
+        rec.call('snapshot_delete', api.snapshot_delete, name + '-renamed')
+        rec.call('snapshot_delete_many', api.snapshot_delete_many, [name])
+        rec.call('repo_add_packages_by_key_chunked', api.repo_add_packages_by_key_chunked, name, keys, 25)
+        rec.call('repo_delete_packages_by_key_chunked', api.repo_delete_packages_by_key_chunked, name, keys, 25)
+        rec.call('repo_delete', api.repo_delete, name)
+    return rec.results()
+
+
+def _bench_workflows(util, nr_of_runs):
+    """ _bench_workflows
+    Runs the read-only workflows nr_of_runs times, then each cleaning workflow once.
+    """
+    rec = _Recorder()
+    for _ in xrange(nr_of_runs):
+        for name in READ_WORKFLOWS:
+            rec.call(name, getattr(util, name))
+    for name in CLEAN_WORKFLOWS:
+        rec.call(name, getattr(util, name))
+    return rec.results()
+
+
+def _compare(results, baseline, threshold):
+    """ _compare
+    Returns the entries, whose p50 latency grew by more than threshold (ratio) over the baseline.
+    """
+    regressions = []
+    for section in ('Methods', 'Workflows'):
+        for name, res in sorted(results[section].items()):
+            base = baseline.get(section, {}).get(name)
+            if not base or not base['P50Ms']:
+                continue
+            ratio = res['P50Ms'] / base['P50Ms']
+            if ratio > 1 + threshold:
+                regressions.append((section, name, base['P50Ms'], res['P50Ms'], ratio))
+    return regressions
+
+
+def _print_table(title, results):
+    print
+    print '%-40s %7s %6s %10s %10s %10s' % (title, 'calls', 'errors', 'calls/s', 'p50 ms', 'p99 ms')
+    for name, res in sorted(results.items()):
+        print '%-40s %7d %6d %10.1f %10.2f %10.2f' % (name, res['Calls'], res['Errors'], res['Throughput'] or 0,
+                                                      res['P50Ms'], res['P99Ms'])
+
+
+def main():
+    parser = OptionParser(usage='python benchmarks/bench_e2e.py [options]')
+    parser.add_option('--repos', type='int', default=50)
+    parser.add_option('--snapshots', type='int', default=10000)
+    parser.add_option('--packages', type='int', default=1000000, help='Package refs of all repos')
+    parser.add_option('--mirrors', type='int', default=20)
+    parser.add_option('--calls', type='int', default=20, help='Calls per api method')
+    parser.add_option('--runs', type='int', default=3, help='Runs of the read-only workflows')
+    parser.add_option('--latency', type='float', default=0.0, help='Latency injected by the server')
+    parser.add_option('--write_seconds', type='float', default=0.0, help='Seconds mutations hold the write lock')
+    parser.add_option('--out', help='Write the results as json to FILE', metavar='FILE')
+    parser.add_option('--baseline', help='Compare against the results in FILE', metavar='FILE')
+    parser.add_option('--threshold', type='float', default=0.25,
+                      help='Fail, if a p50 latency grows by more than this ratio over the baseline')
+    opts, _ = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    proc, values = _start_server(opts)
+    try:
+        values['cache_max_mb'] = '0'
+        values['cache_dir'] = tmp
+        api = AptlyApiRequests(Config(values))
+        util = Util(api)
+
+        start = time.time()
+        with _quiet():
+            methods = _bench_methods(api, values, opts.calls, tmp)
+            workflows = _bench_workflows(util, opts.runs)
+        api.close()
+    finally:
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(tmp)
+
+    results = {
+        'Scale': {
+            'Repos': opts.repos,
+            'Snapshots': opts.snapshots,
+            'Packages': opts.packages,
+            'Mirrors': opts.mirrors,
+            'Calls': opts.calls,
+            'Runs': opts.runs,
+            'Latency': opts.latency,
+            'WriteSeconds': opts.write_seconds
+        },
+        'Python': platform.python_version(),
+        'Seconds': round(time.time() - start, 3),
+        'Methods': methods,
+        'Workflows': workflows
+    }
+    _print_table('method', methods)
+    _print_table('workflow', workflows)
+    print
+    print 'total:                   %.1f s' % results['Seconds']
+
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+    failed = False
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('Scale') != results['Scale']:
+            print 'baseline was taken at another scale: %s' % baseline.get('Scale')
+        regressions = _compare(results, baseline, opts.threshold)
+        for section, name, before, after, ratio in regressions:
+            print 'REGRESSION %s %s: p50 %.2f ms -> %.2f ms (%.2fx)' % (section.lower(), name, before, after, ratio)
+        print 'compared with %s: %d regressions over %d %%' % (opts.baseline, len(regressions), opts.threshold * 100)
+        failed = bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_retention
+Micro-benchmarks of the retention routines of Util on synthetic snapshot names and package
+keys, from 1k to 1M items: _natural_keys (as sort key), _sort_out_last_n_snap and
+_sort_out_last_n_packages. Reports time (best of --repeat) and peak memory of every routine
+and size, optionally writes them as json and compares them against a stored baseline.
+
+Every measurement runs in a forked child, so peak memory is the growth of its max resident
+set size (ru_maxrss) during the routine, not skewed by earlier measurements.
+
+$ python benchmarks/bench_retention.py [--sizes 1000,10000,100000,1000000] [--repeat N]
+      [--out FILE] [--baseline FILE] [--threshold RATIO]
+"""
+
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+from optparse import OptionParser
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.util.util import Util
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+NR_OF_PREFIXES = 50
+
+# Package names of the synthetic keys, one of them is looked up
+NR_OF_NAMES = 10
+
+# Differences below these are noise, never regressions
+MIN_SECONDS = 0.005
+MIN_PEAK_KB = 2048
+
+
+def _snapshot_names(size, rand):
+    prefixes = [u'mirror%02d_' % i for i in range(NR_OF_PREFIXES)]
+    return [u'%s%d_snapshot' % (rand.choice(prefixes), 20150000000000 + i) for i in xrange(size)]
+
+
+def _package_keys(size, rand):
+    return [u'P%s pkg%d %d:%d.%d~rc%d-%d %016x' % (rand.choice(('amd64', 'i386')), rand.randrange(NR_OF_NAMES),
+                                                  rand.randint(0, 1), rand.randint(0, 9), rand.randint(0, 99),
+                                                  rand.randint(1, 3), rand.randint(1, 9), i)
+            for i in xrange(size)]
+
+
+def _natural_keys(size, rand):
+    names = _snapshot_names(size, rand)
+    return lambda: sorted(names, key=Util._natural_keys)
+
+
+def _sort_out_last_n_snap(size, rand):
+    snaplist = [{u'Name': name} for name in _snapshot_names(size, rand)]
+    return lambda: Util._sort_out_last_n_snap(snaplist, u'mirror07_', 3)
+
+
+def _sort_out_last_n_packages(size, rand):
+    keys = _package_keys(size, rand)
+    return lambda: Util._sort_out_last_n_packages(keys, u'pkg3', 10)
+
+# Routines by name, each prepares its input and returns the call to measure
+ROUTINES = (
+    ('_natural_keys', _natural_keys),
+    ('_sort_out_last_n_snap', _sort_out_last_n_snap),
+    ('_sort_out_last_n_packages', _sort_out_last_n_packages),
+)
+
+
+def _measure(prepare, size, repeat):
+    """ _measure
+    Runs the routine repeat times and returns its best time and its peak memory in kB.
+    """
+    routine = prepare(size, random.Random(size))
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        routine()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+        if i == 0:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return {
+        'Seconds': round(best, 6),
+        'PeakKb': peak
+    }
+
+
+def _measure_forked(prepare, size, repeat):
+    """ _measure_forked
+    Runs _measure in a child process and returns its result.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        code = 0
+        try:
+            result = _measure(prepare, size, repeat)
+        except BaseException as e:
+            result = {'Error': '%s: %s' % (type(e).__name__, e)}
+            code = 1
+        os.write(write_end, json.dumps(result))
+        os._exit(code)
+    os.close(write_end)
+    chunks = []
+    while True:
+        chunk = os.read(read_end, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    result = json.loads(''.join(chunks))
+    if 'Error' in result:
+        raise RuntimeError(result['Error'])
+    return result
+
+
+def _compare(results, baseline, threshold):
+    """ _compare
+    Returns the measurements, whose time or peak memory grew by more than threshold (ratio)
+    over the baseline, ignoring noise.
+    """
+    regressions = []
+    for name, by_size in sorted(results.items()):
+        for size, res in sorted(by_size.items(), key=lambda x: int(x[0])):
+            base = baseline.get(name, {}).get(size)
+            if base is None:
+                continue
+            for field, slack in (('Seconds', MIN_SECONDS), ('PeakKb', MIN_PEAK_KB)):
+                if res[field] > base[field] * (1 + threshold) and res[field] - base[field] > slack:
+                    regressions.append((name, size, field, base[field], res[field]))
+    return regressions
+
+
+def main():
+    parser = OptionParser(usage='python benchmarks/bench_retention.py [options]')
+    parser.add_option('--sizes', default=','.join(str(s) for s in SIZES), help='Comma separated input sizes')
+    parser.add_option('--repeat', type='int', default=3, help='Runs per measurement, the best time is taken')
+    parser.add_option('--out', help='Write the results as json to FILE', metavar='FILE')
+    parser.add_option('--baseline', help='Compare against the results in FILE', metavar='FILE')
+    parser.add_option('--threshold', type='float', default=0.25,
+                      help='Fail, if time or peak memory grows by more than this ratio over the baseline')
+    opts, _ = parser.parse_args()
+    sizes = [int(s) for s in opts.sizes.split(',')]
+
+    results = {}
+    print '%-28s %9s %12s %12s' % ('routine', 'size', 'time ms', 'peak kB')
+    for name, prepare in ROUTINES:
+        for size in sizes:
+            res = _measure_forked(prepare, size, opts.repeat)
+            results.setdefault(name, {})[str(size)] = res
+            print '%-28s %9d %12.2f %12d' % (name, size, res['Seconds'] * 1000, res['PeakKb'])
+            sys.stdout.flush()
+
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+    failed = False
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        regressions = _compare(results, baseline, opts.threshold)
+        for name, size, field, before, after in regressions:
+            print 'REGRESSION %s %s %s: %s -> %s' % (name, size, field, before, after)
+        print 'compared with %s: %d regressions over %d %%' % (opts.baseline, len(regressions), opts.threshold * 100)
+        failed = bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_session
+Compares the per-call latency of one-off requests against the pooled
+session of AptlyApiRequests, using a local stand-in for the aptly api.
+
+$ python benchmarks/bench_session.py [NR_OF_CALLS]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import requests
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.api.api import AptlyApiRequests
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    """ _Handler
+    Answers every GET with an empty repo list, keeping the connection open.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps([])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _timed(func, nr_of_calls):
+    """ _timed
+    Returns the mean latency of func in milliseconds.
+    """
+    start = time.time()
+    for _ in xrange(nr_of_calls):
+        func()
+    return (time.time() - start) * 1000.0 / nr_of_calls
+
+
+def main():
+    nr_of_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    server = _Server(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/api/repos/' % server.server_address[1]
+
+    api = AptlyApiRequests()
+    api.cfg['route_repo'] = url
+
+    one_off = _timed(lambda: json.loads(requests.get(url, headers=api.headers).content), nr_of_calls)
+    pooled = _timed(api.repo_list, nr_of_calls)
+
+    print 'calls per run:      %d' % nr_of_calls
+    print 'one-off requests:   %.3f ms/call' % one_off
+    print 'pooled session:     %.3f ms/call' % pooled
+    print 'speedup:            %.2fx' % (one_off / pooled)
+
+    api.close()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_snapshot_index
+Compares "last n snapshots by prefix" lookups of the SnapshotIndex against
+a rescan of the snapshot list per lookup, as Util did before.
+
+$ python benchmarks/bench_snapshot_index.py [NR_OF_SNAPSHOTS]
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+# Run from a checkout, without installing aptly_cli
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aptly_cli.util.index import SnapshotIndex
+
+NR_OF_PREFIXES = 50
+
+
+def _legacy_last_n(snaplist, prefix, nr_of_leftover):
+    """ _legacy_last_n
+    Scan and sort, as done by Util._sort_out_last_n_snap before the index.
+    """
+    keys = lambda text: [int(c) if c.isdigit() else c for c in re.split('(\\d+)', text)]
+    found = [x[u'Name'] for x in snaplist if prefix in x[u'Name']]
+    found.sort(key=keys)
+    return found[-nr_of_leftover:]
+
+
+def main():
+    nr_of_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    prefixes = [u'mirror%02d_' % i for i in range(NR_OF_PREFIXES)]
+    snaplist = [{u'Name': u'%s%d_snapshot' % (random.choice(prefixes), 20150000000000 + i)}
+                for i in xrange(nr_of_snapshots)]
+
+    start = time.time()
+    legacy = [_legacy_last_n(snaplist, x, 3) for x in prefixes]
+    legacy_time = time.time() - start
+
+    start = time.time()
+    index = SnapshotIndex(snaplist)
+    build_time = time.time() - start
+    indexed = [index.last(x, 3) for x in prefixes]
+    lookup_time = time.time() - start - build_time
+
+    assert legacy == indexed
+
+    print 'snapshots:               %d' % nr_of_snapshots
+    print 'prefix lookups:          %d' % len(prefixes)
+    print 'rescan per lookup:       %.1f ms' % (legacy_time * 1000)
+    print 'index build:             %.1f ms' % (build_time * 1000)
+    print 'index lookups:           %.1f ms' % (lookup_time * 1000)
+    print 'speedup (incl. build):   %.1fx' % (legacy_time / (build_time + lookup_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_startup
+Measures the startup time of the cli for help and local commands, which have to stay
+below TARGET_MS. Cold runs import from source (no compiled files), warm runs use the
+compiled modules. Also lists the heavy modules each command loads.
+
+$ python benchmarks/bench_startup.py [NR_OF_RUNS]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TARGET_MS = 100
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = (
+    ['--help'],
+    ['--create_config'],
+)
+
+# Modules, which must not be loaded by help and local commands
+HEAVY_MODULES = ('requests', 'multiprocessing', 'aptly_cli.api.api', 'aptly_cli.util.util')
+
+_LIST_MODULES = """
+import sys
+sys.argv = ['aptly-cli'] + sys.argv[1:]
+from aptly_cli.cli.cli import main
+try:
+    main()
+except SystemExit:
+    pass
+sys.stderr.write(' '.join(sorted(m for m in sys.modules if sys.modules[m] is not None)))
+"""
+
+
+def _run(args, root, env, flags=()):
+    """ _run
+    Runs the cli once and returns the wall time in ms.
+    """
+    env = dict(env, PYTHONPATH=root)
+    start = time.time()
+    subprocess.check_call([sys.executable] + list(flags) + [os.path.join(root, 'aptly_api_cli')] + args,
+                          env=env, stdout=open(os.devnull, 'w'))
+    return (time.time() - start) * 1000
+
+
+def _run_python(env):
+    """ _run_python
+    Bare interpreter startup, the floor of every cli run.
+    """
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'pass'], env=env)
+    return (time.time() - start) * 1000
+
+
+def _loaded_modules(args, env):
+    """ _loaded_modules
+    Returns the heavy modules loaded by the command.
+    """
+    proc = subprocess.Popen([sys.executable, '-c', _LIST_MODULES] + args, env=dict(env, PYTHONPATH=ROOT),
+                            stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+    modules = proc.communicate()[1].split()
+    return [h for h in HEAVY_MODULES if any(m == h or m.startswith(h + '.') for m in modules)]
+
+
+def _source_copy(tmp):
+    """ _source_copy
+    Copies the cli without compiled files, for cold runs.
+    """
+    root = os.path.join(tmp, 'src')
+    shutil.copytree(os.path.join(ROOT, 'aptly_cli'), os.path.join(root, 'aptly_cli'),
+                    ignore=shutil.ignore_patterns('*.pyc'))
+    shutil.copy(os.path.join(ROOT, 'aptly_api_cli'), root)
+    return root
+
+
+def main():
+    nr_of_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tmp = tempfile.mkdtemp()
+    try:
+        # a home with a config file, so --create_config finds it and does not write
+        env = dict(os.environ, HOME=tmp)
+        with open(os.path.join(tmp, 'aptly-cli.conf'), 'w') as conf:
+            conf.write('[general]\nbasic_url=http://localhost\nport=:9003\n')
+        cold_root = _source_copy(tmp)
+        _run(['--help'], ROOT, env)
+
+        failed = False
+        print 'python startup:          %.1f ms' % min(_run_python(env) for _ in range(nr_of_runs))
+        for args in COMMANDS:
+            cold = _run(args, cold_root, env, ['-B'])
+            warm = sorted(_run(args, ROOT, env) for _ in range(nr_of_runs))
+            median = warm[len(warm) // 2]
+            heavy = _loaded_modules(args, env)
+            ok = median < TARGET_MS and not heavy
+            failed = failed or not ok
+            print '%-24s cold %.1f ms, warm median %.1f ms, min %.1f ms  %s' % (
+                ' '.join(args) + ':', cold, median, warm[0], 'OK' if ok else 'FAILED')
+            if heavy:
+                print '  loads %s' % ', '.join(heavy)
+        print 'target:                  %d ms' % TARGET_MS
+    finally:
+        shutil.rmtree(tmp)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" fake
+Test case running the fake aptly server in process, with an api client talking to it.
+"""
+
+import unittest
+
+from aptly_cli.api.api import AptlyApiRequests
+from aptly_cli.config.config import Config
+from aptly_cli.fake_server.server import FakeAptlyServer
+
+# Seeded content, small enough to seed per test
+SEED = {
+    'repos': 3,
+    'snapshots': 60,
+    'packages': 600,
+    'mirrors': 4,
+    'versions': 20,
+    'mirror_packages': 20,
+    'staging': 3
+}
+
+
+class FakeServerTestCase(unittest.TestCase):
+
+    """ FakeServerTestCase
+    Starts a seeded fake aptly server per test. self.api talks to it, with the
+    snapshot cache disabled unless config_values says otherwise.
+    """
+
+    seed = SEED
+
+    def config_values(self):
+        """ config_values
+        Returns extra config values of the api client.
+        """
+        return {'cache_max_mb': '0'}
+
+    def setUp(self):
+        self.server = FakeAptlyServer()
+        self.state = self.server.state
+        self.state.seed(**self.seed)
+        self.server.start()
+        self.values = self.server.config_values()
+        self.values.update(self.config_values())
+        self.config = Config(self.values)
+        self.api = AptlyApiRequests(self.config)
+        self.requests = []
+        self.api.add_request_hook(self.requests.append)
+
+    def tearDown(self):
+        self.api.session.close()
+        self.server.stop()
+
+    def routes(self, method=None):
+        """ routes
+        Returns the routes requested so far, of the given HTTP method.
+        """
+        return [r['Route'] for r in self.requests if method is None or r['Method'] == method]
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_async_api
+Tests of the non-blocking api client.
+"""
+
+from aptly_cli.api import async_api
+from aptly_cli.api.async_api import AsyncAptlyApiRequests
+from tests.fake import FakeServerTestCase
+
+
+class TestAsyncAptlyApiRequests(FakeServerTestCase):
+
+    def _closes(self, api):
+        closed = []
+        close = api.close
+
+        def recording():
+            closed.append(True)
+            close()
+        api.close = recording
+        return closed
+
+    def test_gather_in_order(self):
+        names = sorted(self.state.snapshots)[:10]
+        with AsyncAptlyApiRequests(self.api, max_concurrency=4) as client:
+            infos = client.gather([client.snapshot_show(name) for name in names])
+        self.assertEqual([i['Name'] for i in infos], names)
+
+    def test_map(self):
+        repos = self.api.repo_list()
+        with AsyncAptlyApiRequests(self.api, max_concurrency=2) as client:
+            infos = client.gather(client.map('repo_show', [(r['Name'],) for r in repos]))
+        self.assertEqual(infos, [self.api.repo_show(r['Name']) for r in repos])
+
+    def test_failed_call_raises(self):
+        with AsyncAptlyApiRequests(self.api) as client:
+            results = [client.get_version(), client.repo_show()]
+            self.assertRaises(TypeError, client.gather, results)
+
+    def test_not_an_api_method(self):
+        with AsyncAptlyApiRequests(self.api) as client:
+            self.assertRaises(AttributeError, client.submit, 'close')
+
+    def test_keeps_given_api_open(self):
+        closed = self._closes(self.api)
+        with AsyncAptlyApiRequests(self.api) as client:
+            client.gather([client.get_version()])
+        self.assertEqual(closed, [])
+        self.assertTrue(self.api.get_version())
+
+    def test_closes_created_api(self):
+        closed = self._closes(self.api)
+        created = async_api.AptlyApiRequests
+        async_api.AptlyApiRequests = lambda: self.api
+        try:
+            with AsyncAptlyApiRequests() as client:
+                client.gather([client.get_version()])
+        finally:
+            async_api.AptlyApiRequests = created
+        self.assertEqual(closed, [True])
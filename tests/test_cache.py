@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_cache
+Tests of the on-disk snapshot cache.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from aptly_cli.api.cache import SnapshotCache
+from tests.fake import FakeServerTestCase
+
+# Bytes of an entry holding ENTRY_ITEM once
+ENTRY_ITEM = 'x' * 98
+ENTRY_BYTES = 101
+
+
+def _files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, files in os.walk(directory) for name in files)
+
+
+def _dirs(directory):
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _put(self, cache, name, mtime=None):
+        cache.put(name, {'q': 'p'}, [ENTRY_ITEM])
+        path = cache._entry_path(name, {'q': 'p'})
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_roundtrip(self):
+        cache = SnapshotCache(self.directory, 10 * ENTRY_BYTES)
+        self.assertEqual(cache.get('snap', {'q': 'p'}), None)
+        cache.put('snap', {'q': 'p'}, [{'Key': 1}, u'ä'])
+        self.assertEqual(cache.get('snap', {'q': 'p'}), [{'Key': 1}, u'ä'])
+        self.assertEqual(cache.get('snap', {'q': 'other'}), None)
+
+    def test_evicts_least_recently_used(self):
+        cache = SnapshotCache(self.directory, 3 * ENTRY_BYTES)
+        now = time.time()
+        old = self._put(cache, 'old', now - 30)
+        used = self._put(cache, 'used', now - 20)
+        new = self._put(cache, 'new', now - 10)
+        self.assertEqual(os.path.getsize(old), ENTRY_BYTES)
+        # reading marks as recently used
+        self.assertEqual(cache.get('used', {'q': 'p'}), [ENTRY_ITEM])
+
+        newest = self._put(cache, 'newest')
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(os.path.exists(new))
+        self.assertTrue(os.path.exists(used))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(cache._size, 2 * ENTRY_BYTES)
+        # empty snapshot directories are removed
+        self.assertEqual(len(_dirs(self.directory)), 2)
+
+    def test_scans_only_when_full(self):
+        cache = SnapshotCache(self.directory, 3 * ENTRY_BYTES)
+        self._put(cache, 'a')
+        scans = []
+        entries = cache._entries
+        cache._entries = lambda directory: scans.append(directory) or entries(directory)
+        self._put(cache, 'b')
+        self._put(cache, 'c')
+        self.assertEqual(scans, [])
+        self.assertEqual(cache._size, 3 * ENTRY_BYTES)
+        self._put(cache, 'd')
+        self.assertEqual(scans, [self.directory])
+
+    def test_replacing_an_entry_keeps_the_size(self):
+        cache = SnapshotCache(self.directory, 3 * ENTRY_BYTES)
+        self._put(cache, 'a')
+        self._put(cache, 'a')
+        self.assertEqual(cache._size, ENTRY_BYTES)
+
+    def test_skips_entries_being_written(self):
+        cache = SnapshotCache(self.directory, 2 * ENTRY_BYTES)
+        writer = cache.writer('pending', {'q': 'p'})
+        writer.write('y' * 1000)
+        self._put(cache, 'a', time.time() - 20)
+        self._put(cache, 'b', time.time() - 10)
+        self._put(cache, 'c')
+        # the pending entry is neither counted nor removed
+        self.assertEqual(len([f for f in _files(self.directory) if '.tmp-' in f]), 1)
+        self.assertEqual(cache._size, ENTRY_BYTES)
+        self.assertEqual(cache.get('c', {'q': 'p'}), [ENTRY_ITEM])
+        writer.abort()
+
+    def test_abort_removes_empty_directory(self):
+        cache = SnapshotCache(self.directory, ENTRY_BYTES)
+        writer = cache.writer('missing', {'q': 'p'})
+        writer.write('y')
+        writer.abort()
+        self.assertEqual(_files(self.directory), [])
+        self.assertEqual(_dirs(self.directory), [])
+
+    def test_invalidate(self):
+        cache = SnapshotCache(self.directory, 3 * ENTRY_BYTES)
+        self._put(cache, 'a')
+        self._put(cache, 'b')
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a', {'q': 'p'}), None)
+        self.assertEqual(cache._size, ENTRY_BYTES)
+
+class TestApiCache(FakeServerTestCase):
+
+    """ TestApiCache
+    Package lists of snapshots served by AptlyApiRequests from the cache.
+    """
+
+    def config_values(self):
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+        return {'cache_dir': self.directory, 'cache_max_mb': '1'}
+
+    def tearDown(self):
+        FakeServerTestCase.tearDown(self)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _fetches(self):
+        return self.routes('GET').count('/api/snapshots/:name/packages')
+
+    def _recreate(self, name, keys):
+        # as done by other tools, not seen by this client
+        self.state.snapshot_delete(name, '0')
+        with self.state._lock:
+            self.state._create_snapshot(name, '', keys)
+
+    def test_served_from_cache(self):
+        name = sorted(self.state.snapshots)[0]
+        packages = self.api.snapshot_show_packages(name)
+        self.assertEqual(self.api.snapshot_show_packages(name), packages)
+        # the streamed and the buffered list share the entry
+        self.assertEqual(list(self.api.snapshot_iter_packages(name)), packages)
+        self.assertEqual(self._fetches(), 1)
+
+    def test_recreated_snapshot(self):
+        name = sorted(self.state.snapshots)[0]
+        packages = self.api.snapshot_show_packages(name)
+        list(self.api.snapshot_iter_packages(name))
+        self._recreate(name, packages[:1])
+        self.assertEqual(self.api.snapshot_show_packages(name), packages[:1])
+        self.assertEqual(list(self.api.snapshot_iter_packages(name)), packages[:1])
+        self.assertEqual(self._fetches(), 2)
+
+    def test_missing_snapshot(self):
+        self.assertTrue(self.api.snapshot_show_packages('no-such-snapshot'))
+        self.assertEqual(_files(self.directory), [])
+
+if __name__ == '__main__':
+    unittest.main()
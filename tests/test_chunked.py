@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_chunked
+Tests of adding and deleting package refs in chunks, resuming after a failed chunk.
+"""
+
+from aptly_cli.fake_server.server import LOCK_FAIL
+from tests.fake import FakeServerTestCase
+
+
+class TestPackagesByKeyChunked(FakeServerTestCase):
+
+    def setUp(self):
+        FakeServerTestCase.setUp(self)
+        self.repo = sorted(self.state.repos)[0]
+        self.keys = list(self.state.repo_packages[self.repo])[:25]
+
+    def _progress(self, fail_after=None):
+        """ _progress
+        Returns a progress callback recording its calls. The aptly database gets locked
+        by someone else after chunk fail_after is confirmed.
+        """
+        calls = []
+
+        def progress(chunk, chunks, done):
+            calls.append((chunk, chunks, done))
+            if chunk == fail_after:
+                self.server.faults.write_lock = LOCK_FAIL
+                self.server._write_lock.acquire()
+        return calls, progress
+
+    def test_delete_in_chunks(self):
+        calls, progress = self._progress()
+        result = self.api.repo_delete_packages_by_key_chunked(self.repo, self.keys, 10, progress=progress)
+        self.assertEqual((result['Chunks'], result['Completed'], result['Failed'], result['ResumeFrom']),
+                         (3, 3, None, None))
+        self.assertEqual(calls, [(0, 3, 10), (1, 3, 20), (2, 3, 25)])
+        self.assertEqual(len(self.routes('DELETE')), 3)
+        self.assertFalse(set(self.keys) & set(self.state.repo_packages[self.repo]))
+
+    def test_resume_after_failed_chunk(self):
+        calls, progress = self._progress(fail_after=0)
+        result = self.api.repo_delete_packages_by_key_chunked(self.repo, self.keys, 10, progress=progress)
+        self.assertEqual((result['Completed'], result['ResumeFrom']), (1, 1))
+        self.assertEqual((result['Failed']['Chunk'], result['Failed']['Status']), (1, 500))
+        self.assertIn('database is locked', result['Failed']['Error'])
+        # only the first chunk is deleted, the failed one stopped sending
+        left = set(self.state.repo_packages[self.repo])
+        self.assertFalse(set(self.keys[:10]) & left)
+        self.assertTrue(set(self.keys[10:]) <= left)
+
+        self.server._write_lock.release()
+        result = self.api.repo_delete_packages_by_key_chunked(self.repo, self.keys, 10,
+                                                              start_chunk=result['ResumeFrom'])
+        self.assertEqual((result['Completed'], result['Failed'], result['ResumeFrom']), (3, None, None))
+        self.assertEqual(len(self.routes('DELETE')), 4)
+        self.assertFalse(set(self.keys) & set(self.state.repo_packages[self.repo]))
+
+    def test_add_in_chunks(self):
+        self.api.repo_delete_packages_by_key(self.repo, self.keys)
+        result = self.api.repo_add_packages_by_key_chunked(self.repo, self.keys, 7)
+        self.assertEqual((result['Chunks'], result['Completed'], result['ResumeFrom']), (4, 4, None))
+        self.assertTrue(set(self.keys) <= set(self.state.repo_packages[self.repo]))
+        self.assertEqual(result['Response'][u'Name'], self.repo)
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_config
+Tests of the cached, typed configuration.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from aptly_cli.config import config
+from aptly_cli.config.config import Config, get_config, reload_config
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_defaults(self):
+        c = Config()
+        self.assertFalse(c.found)
+        self.assertEqual(c.url, 'http://localhost:9003')
+        self.assertEqual((c.workers, c.max_mutations, c.chunk_size), (4, 1, 500))
+        self.assertEqual(c.max_reads, c.pool_maxsize)
+        self.assertEqual((c.save_last_snap, c.save_last_pkg), (3, 10))
+        self.assertEqual(c.prefixes_mirrors, [])
+        self.assertTrue(c.keep_alive)
+        self.assertFalse(c.local_diff)
+
+    def test_typed_values(self):
+        c = Config({'basic_url': 'http://aptly', 'port': ':8080', 'workers': '8', 'pool_maxsize': '2',
+                    'keep_alive': '0', 'local_diff': '1', 'prefixes_mirrors': 'a-, b- ,,c-', 'save_last_pkg': '5'})
+        self.assertTrue(c.found)
+        self.assertEqual(c.url, 'http://aptly:8080')
+        self.assertEqual((c.workers, c.max_reads, c.save_last_pkg), (8, 2, 5))
+        self.assertFalse(c.keep_alive)
+        self.assertTrue(c.local_diff)
+        self.assertEqual(c.prefixes_mirrors, ['a-', 'b-', 'c-'])
+        self.assertEqual(c.as_dict()['workers'], '8')
+
+
+class TestConfigFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+        self.path = os.path.join(self.directory, 'aptly-cli.conf')
+        from_file = Config.from_file.__func__
+        self.from_file = Config.__dict__['from_file']
+        Config.from_file = classmethod(lambda cls, path=self.path: from_file(cls, path))
+        config._cached = None
+
+    def tearDown(self):
+        Config.from_file = self.from_file
+        config._cached = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_missing_file(self):
+        c = Config.from_file(self.path)
+        self.assertFalse(c.found)
+        self.assertEqual(c.path, self.path)
+
+    def test_template(self):
+        self._write(config.CONFIG_TEMPLATE.replace('repos=\n', 'repos=one,two\n'))
+        c = Config.from_file(self.path)
+        self.assertTrue(c.found)
+        self.assertEqual(c.save_last_snap, 3)
+        self.assertEqual(c.repos, ['one', 'two'])
+
+    def test_parsed_once(self):
+        self._write('[general]\nworkers=2\n')
+        first = get_config()
+        self._write('[general]\nworkers=6\n')
+        self.assertIs(get_config(), first)
+        self.assertEqual(get_config().workers, 2)
+        reloaded = reload_config()
+        self.assertEqual(reloaded.workers, 6)
+        self.assertIs(get_config(), reloaded)
+
+if __name__ == '__main__':
+    unittest.main()
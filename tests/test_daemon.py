@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_daemon
+Tests of the resident daemon: forwarding commands, their output and exit status.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from optparse import OptionParser
+from StringIO import StringIO
+
+from aptly_cli.api.workers import first_match, run_bounded
+from aptly_cli.cli import cli, daemon
+
+
+def _parser():
+    parser = OptionParser()
+    parser.add_option('--get_version', action='store_true')
+    parser.add_option('--exit', type='int')
+    parser.add_option('--fail', action='store_true')
+    parser.add_option('--workers', action='store_true')
+    return parser
+
+
+def _execute(opts, args, util):
+    if opts.get_version:
+        print 'version'
+        print >> sys.stderr, 'warning'
+    if opts.exit is not None:
+        sys.exit(opts.exit)
+    if opts.fail:
+        raise ValueError('failed')
+    if opts.workers:
+        def work(i):
+            # a single write, print writes its items one by one
+            sys.stdout.write('worker %d\n' % i)
+            return i
+        run_bounded(work, range(4), 4)
+        first_match(work, range(4, 8), lambda r: False, 4)
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+        self.path = os.path.join(self.directory, 'daemon.sock')
+        self.server = daemon.DaemonServer(self.path, None, _parser(), _execute)
+        self.redirect = daemon.redirect_output()
+        self.redirect.__enter__()
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.redirect.__exit__(None, None, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _forward(self, *argv):
+        out, err = StringIO(), StringIO()
+        status = daemon.forward(list(argv), self.path, out, err)
+        return status, out.getvalue(), err.getvalue()
+
+    def test_output(self):
+        self.assertEqual(self._forward('--get_version'), (0, 'version\n', 'warning\n'))
+
+    def test_unknown_option(self):
+        status, out, err = self._forward('--bogus')
+        self.assertEqual(status, 2)
+        self.assertIn('no such option: --bogus', err)
+
+    def test_exit(self):
+        self.assertEqual(self._forward('--exit', '3')[0], 3)
+        self.assertEqual(self._forward('--exit', '0')[0], 0)
+
+    def test_exception(self):
+        status, out, err = self._forward('--fail')
+        self.assertEqual(status, 1)
+        self.assertIn('ValueError: failed', err)
+
+    def test_output_of_worker_threads(self):
+        status, out, err = self._forward('--workers')
+        self.assertEqual(status, 0)
+        self.assertEqual(sorted(out.splitlines()), ['worker %d' % i for i in range(8)])
+
+    def test_local_options(self):
+        self.assertEqual(daemon.forward(['--create_config'], self.path), None)
+        self.assertEqual(daemon.forward(['--get_version'], os.path.join(self.directory, 'none.sock')), None)
+
+    def test_socket_from_environment(self):
+        environ = dict(os.environ)
+        os.environ[daemon.SOCKET_ENV] = self.path
+        try:
+            self.assertEqual(daemon.socket_path(), self.path)
+            self.assertEqual(daemon.socket_path('~/other.sock'), os.path.expanduser('~/other.sock'))
+            out, err = StringIO(), StringIO()
+            self.assertEqual(daemon.forward(['--get_version'], None, out, err), 0)
+            self.assertEqual(out.getvalue(), 'version\n')
+            del os.environ[daemon.SOCKET_ENV]
+            self.assertEqual(daemon.socket_path(), daemon.DEFAULT_SOCKET_PATH)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_joined_command(self):
+        flight = daemon._Flight()
+        self.server._flights[('--get_version',)] = flight
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self._forward('--get_version')))
+        thread.start()
+        flight.write('stdout', 'shared\n')
+        flight.write('stderr', 'warning\n')
+        flight.finish(4)
+        thread.join()
+        self.assertEqual(result, [(4, 'shared\n', 'warning\n')])
+        self.assertEqual(self.server.coalesced, 1)
+
+
+class TestCliForwarding(unittest.TestCase):
+
+    def _has_command(self, *argv):
+        parser = cli._get_parser_opts()
+        return cli._has_command(parser, parser.parse_args(list(argv))[0])
+
+    def test_commands_only(self):
+        self.assertTrue(self._has_command('--get_version'))
+        self.assertTrue(self._has_command('--repo_show_packages', 'repo', '--output', 'ndjson'))
+        self.assertFalse(self._has_command())
+        self.assertFalse(self._has_command('--output', 'ndjson', '--socket_path', '/tmp/x.sock'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_debversion
+Tests of the Debian version order against dpkg.
+"""
+
+import os
+import random
+import subprocess
+import unittest
+
+from aptly_cli.util.debversion import split_version, version_key
+
+# Pairs and their order as reported by dpkg --compare-versions
+DPKG_ORDER = [
+    ('1.0', '1.0', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0', '1.0a', -1),
+    ('1.0a', '1.0+', -1),
+    ('1.0+', '1.0.', -1),
+    ('1.0~~', '1.0~', -1),
+    ('1.0~', '1.0', -1),
+    ('1.0.~', '1.0.', -1),
+    ('1:0.1', '2.0', 1),
+    ('0:1.0', '1.0', 0),
+    ('1:1.0', '0:9.9', 1),
+    ('10:1', '9:1', 1),
+    ('1.0-1', '1.0-2', -1),
+    ('1.0-1', '1.0', 1),
+    ('1.0', '1.0-0', 0),
+    ('1.0-0.1', '1.0', 1),
+    ('1.00', '1.0', 0),
+    ('1.01', '1.1', 0),
+    ('1.9', '1.10', -1),
+    ('9', '10', -1),
+    ('1.0.0', '1.0', 1),
+    ('0~bpo8', '0', -1),
+    ('0~bpo8', '~', 1),
+    ('0a', '0', 1),
+    ('1.0+deb8u1', '1.0', 1),
+    ('1.0-1~bpo8+1', '1.0-1', -1),
+    ('2.30-1ubuntu1', '2.30-1', 1),
+    ('1.2.3-4-5', '1.2.3-4', 1),
+    ('1.0~rc1-1', '1.0-1', -1),
+    ('1.0-1.1', '1.0-1+b1', 1),
+    ('1.0a', '1.0A', 1),
+    ('A', 'a', -1),
+    ('r1', '1', 1),
+]
+
+# Random pairs checked against the reference comparison
+NR_OF_PAIRS = 30000
+
+# Random pairs checked against the dpkg binary, if installed
+NR_OF_DPKG_PAIRS = 200
+
+_DPKG = '/usr/bin/dpkg'
+
+
+def _order(char):
+    """ _order
+    Character order of dpkg, '' stands for the end of the string.
+    """
+    if char == '' or char.isdigit():
+        return 0
+    if char.isalpha():
+        return ord(char)
+    if char == '~':
+        return -1
+    return ord(char) + 256
+
+
+def _verrevcmp(a, b):
+    """ _verrevcmp
+    Reference: the pairwise comparison of dpkg (lib/dpkg/version.c), character by character.
+    """
+    char = lambda text, pos: text[pos] if pos < len(text) else ''
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (char(a, i) and not char(a, i).isdigit()) or (char(b, j) and not char(b, j).isdigit()):
+            diff = _order(char(a, i)) - _order(char(b, j))
+            if diff:
+                return diff
+            i += 1
+            j += 1
+        while char(a, i) == '0':
+            i += 1
+        while char(b, j) == '0':
+            j += 1
+        while char(a, i).isdigit() and char(b, j).isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if char(a, i).isdigit():
+            return 1
+        if char(b, j).isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _reference_cmp(a, b):
+    epoch_a, upstream_a, revision_a = split_version(a)
+    epoch_b, upstream_b, revision_b = split_version(b)
+    order = cmp(epoch_a, epoch_b) or _verrevcmp(upstream_a, upstream_b) or _verrevcmp(revision_a, revision_b)
+    return cmp(order, 0)
+
+
+def _key_cmp(a, b):
+    return cmp(version_key(a), version_key(b))
+
+
+def _random_part(rand, first_digit):
+    """ _random_part
+    Random upstream version or revision, with leading zeros, '~' and letters in any place.
+    """
+    runs = []
+    for i in range(rand.randint(1, 5)):
+        if i or first_digit or rand.random() < 0.2:
+            runs.append(rand.choice(['0', '00', '1', '01', '9', '10', '123']))
+        runs.append(rand.choice(['', '.', '~', '~~', '+', 'a', 'A', 'rc', '~rc', '.~', '+b', 'z', '.0']))
+    return ''.join(runs) or '0'
+
+
+def _random_version(rand):
+    version = _random_part(rand, True)
+    if rand.random() < 0.2:
+        version = '%d:%s' % (rand.randint(0, 2), version)
+    if rand.random() < 0.6:
+        version += '-' + _random_part(rand, False)
+    return version
+
+
+def _dpkg_cmp(a, b):
+    for op, order in (('lt', -1), ('eq', 0), ('gt', 1)):
+        with open(os.devnull, 'w') as devnull:
+            if subprocess.call([_DPKG, '--compare-versions', a, op, b], stderr=devnull) == 0:
+                return order
+    raise ValueError('dpkg can not compare %s and %s' % (a, b))
+
+
+class TestVersionKey(unittest.TestCase):
+
+    def test_dpkg_order(self):
+        for a, b, order in DPKG_ORDER:
+            self.assertEqual(_key_cmp(a, b), order, '%s %s' % (a, b))
+            self.assertEqual(_key_cmp(b, a), -order, '%s %s' % (b, a))
+            self.assertEqual(_reference_cmp(a, b), order, '%s %s' % (a, b))
+
+    def test_split_version(self):
+        self.assertEqual(split_version('1:2.0-1-2'), (1, '2.0-1', '2'))
+        self.assertEqual(split_version('2.0'), (0, '2.0', ''))
+        self.assertEqual(split_version('x:2.0'), (0, '2.0', ''))
+
+    def test_random_pairs(self):
+        rand = random.Random(19)
+        for _ in xrange(NR_OF_PAIRS):
+            a, b = _random_version(rand), _random_version(rand)
+            self.assertEqual(_key_cmp(a, b), _reference_cmp(a, b), '%s %s' % (a, b))
+
+    def test_sort(self):
+        rand = random.Random(20)
+        versions = sorted((_random_version(rand) for _ in xrange(5000)), key=version_key)
+        for a, b in zip(versions, versions[1:]):
+            self.assertTrue(_reference_cmp(a, b) <= 0, '%s %s' % (a, b))
+
+    @unittest.skipUnless(os.path.exists(_DPKG), 'dpkg is not installed')
+    def test_random_pairs_with_dpkg(self):
+        rand = random.Random(21)
+        for _ in xrange(NR_OF_DPKG_PAIRS):
+            a, b = _random_version(rand), _random_version(rand)
+            self.assertEqual(_key_cmp(a, b), _dpkg_cmp(a, b), '%s %s' % (a, b))
+
+if __name__ == '__main__':
+    unittest.main()
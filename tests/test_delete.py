@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_delete
+Tests of deleting many snapshots, retrying while the aptly database is locked.
+"""
+
+import threading
+
+from aptly_cli.api import api as api_module
+from aptly_cli.fake_server.server import LOCK_FAIL
+from tests.fake import FakeServerTestCase
+
+
+class TestSnapshotDeleteMany(FakeServerTestCase):
+
+    def setUp(self):
+        FakeServerTestCase.setUp(self)
+        self.backoff = api_module.DELETE_BACKOFF
+        api_module.DELETE_BACKOFF = 0.01
+        self.server.faults.write_lock = LOCK_FAIL
+        self.names = sorted(self.state.snapshots)[:6]
+
+    def tearDown(self):
+        api_module.DELETE_BACKOFF = self.backoff
+        FakeServerTestCase.tearDown(self)
+
+    def test_deletes_in_order(self):
+        results = self.api.snapshot_delete_many(self.names, workers=3)
+        self.assertEqual([r['Name'] for r in results], self.names)
+        self.assertEqual([(r['Deleted'], r['Status'], r['Error'], r['Attempts']) for r in results],
+                         [(True, 200, None, 1)] * len(self.names))
+        self.assertFalse(set(self.names) & set(self.state.snapshots))
+
+    def test_retries_while_locked(self):
+        # the lock is held by someone else and freed after the first attempts
+        self.server._write_lock.acquire()
+        threading.Timer(0.1, self.server._write_lock.release).start()
+        results = self.api.snapshot_delete_many(self.names[:2], retries=8)
+        self.assertTrue(all(r['Deleted'] for r in results))
+        self.assertTrue(all(r['Attempts'] > 1 for r in results))
+        self.assertEqual(len(self.routes('DELETE')), sum(r['Attempts'] for r in results))
+
+    def test_gives_up_after_retries(self):
+        self.server._write_lock.acquire()
+        try:
+            result = self.api.snapshot_delete_many(self.names[:1], retries=2)[0]
+        finally:
+            self.server._write_lock.release()
+        self.assertFalse(result['Deleted'])
+        self.assertEqual((result['Status'], result['Attempts']), (500, 3))
+        self.assertIn('database is locked', result['Error'])
+        self.assertIn(self.names[0], self.state.snapshots)
+
+    def test_no_retry_of_client_errors(self):
+        result = self.api.snapshot_delete_many(['no-such-snapshot'])[0]
+        self.assertFalse(result['Deleted'])
+        self.assertEqual((result['Status'], result['Attempts']), (404, 1))
+        self.assertTrue(result['Error'])
+
+    def test_retries_server_errors(self):
+        self.server.faults.error_rate = 1.0
+        result = self.api.snapshot_delete_many(self.names[:1], retries=1)[0]
+        self.assertEqual((result['Deleted'], result['Status'], result['Attempts']), (False, 500, 2))
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_diff
+Tests of the client-side snapshot diff.
+"""
+
+import random
+import unittest
+
+from aptly_cli.util.diff import diff_package_lists
+
+
+def _key(arch, name, version):
+    return u'P%s %s %s %s' % (arch, name, version, abs(hash((arch, name, version))) % 10 ** 8)
+
+
+def _details(keys):
+    return [{u'Key': key, u'Package': key.split(' ')[1]} for key in keys]
+
+
+class TestDiffPackageLists(unittest.TestCase):
+
+    def test_identical(self):
+        keys = [_key('amd64', 'a', '1.0'), _key('i386', 'a', '1.0')]
+        self.assertEqual(diff_package_lists(keys, list(reversed(keys))), [])
+        self.assertEqual(diff_package_lists([], []), [])
+
+    def test_added_removed_and_changed(self):
+        same = _key('amd64', 'same', '1.0')
+        old = _key('amd64', 'changed', '1.0')
+        new = _key('amd64', 'changed', '1.1')
+        removed = _key('amd64', 'removed', '2.0')
+        added = _key('amd64', 'added', '3.0')
+        other_arch = _key('i386', 'changed', '1.1')
+        self.assertEqual(diff_package_lists([same, old, removed], [new, added, same, other_arch]), [
+            {'Left': None, 'Right': added},
+            {'Left': old, 'Right': new},
+            {'Left': removed, 'Right': None},
+            {'Left': None, 'Right': other_arch},
+        ])
+
+    def test_several_versions(self):
+        # paired like aptly: 1 -> 2 and 2 -> 3, though 2 is on both sides
+        v1, v2, v3 = [_key('amd64', 'a', v) for v in ('1', '2', '3')]
+        self.assertEqual(diff_package_lists([v1, v2], [v2, v3]), [
+            {'Left': v1, 'Right': v2},
+            {'Left': v2, 'Right': v3},
+        ])
+        self.assertEqual(diff_package_lists([v1, v2], [v2]), [
+            {'Left': v1, 'Right': v2},
+            {'Left': v2, 'Right': None},
+        ])
+        self.assertEqual(diff_package_lists([v1, v3], [v1, v2, v3]), [
+            {'Left': v3, 'Right': v2},
+            {'Left': None, 'Right': v3},
+        ])
+
+    def test_one_side_empty(self):
+        keys = sorted([_key('amd64', 'a', '1.0'), _key('amd64', 'b', '1.0')])
+        self.assertEqual(diff_package_lists(keys, []), [{'Left': k, 'Right': None} for k in keys])
+        self.assertEqual(diff_package_lists(iter([]), iter(keys)), [{'Left': None, 'Right': k} for k in keys])
+
+    def test_details(self):
+        old = _key('amd64', 'a', '1.0')
+        new = _key('amd64', 'a', '2.0')
+        left = _details([old, _key('amd64', 'b', '1.0')])
+        right = _details([new, _key('amd64', 'b', '1.0')])
+        self.assertEqual(diff_package_lists(left, right), [{'Left': left[0], 'Right': right[0]}])
+
+    def test_random_lists(self):
+        rand = random.Random(10)
+        for _ in range(50):
+            universe = [_key(rand.choice(['amd64', 'i386']), 'pkg%d' % rand.randint(0, 30), '1.%d' % rand.randint(0, 3))
+                        for _ in range(60)]
+            left = set(rand.sample(universe, 30))
+            right = set(rand.sample(universe, 30))
+            result = diff_package_lists(list(left), list(right))
+
+            lefts = [r['Left'] for r in result if r['Left'] is not None]
+            rights = [r['Right'] for r in result if r['Right'] is not None]
+            # every package differing is reported once, in order of the package keys
+            self.assertTrue(left - right <= set(lefts) <= left)
+            self.assertTrue(right - left <= set(rights) <= right)
+            self.assertEqual(lefts, sorted(set(lefts)))
+            self.assertEqual(rights, sorted(set(rights)))
+            for r in result:
+                if r['Left'] is not None and r['Right'] is not None:
+                    self.assertEqual(r['Left'].split(' ')[:2], r['Right'].split(' ')[:2])
+                    self.assertNotEqual(r['Left'], r['Right'])
+            # without several versions of a package, only differing packages are reported
+            if len(set(k.split(' ')[1] + k.split(' ')[0] for k in left | right)) == len(left | right):
+                self.assertEqual(set(lefts), left - right)
+
+if __name__ == '__main__':
+    unittest.main()
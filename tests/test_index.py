@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_index
+Tests of the snapshot name index.
+"""
+
+import random
+import unittest
+
+from aptly_cli.util.index import SnapshotIndex, natural_keys
+
+
+class TestNaturalKeys(unittest.TestCase):
+
+    def test_numbers_compare_as_ints(self):
+        names = ['snap_10', 'snap_9', 'snap_100', 'snap_1a', 'snap_']
+        self.assertEqual(sorted(names, key=natural_keys), ['snap_', 'snap_1a', 'snap_9', 'snap_10', 'snap_100'])
+        self.assertEqual(natural_keys('a1b22'), ['a', 1, 'b', 22, ''])
+
+
+class TestSnapshotIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['mirror-a_%d' % i for i in range(1, 25)] + ['mirror-b_%d-pre' % i for i in range(1, 5)]
+        self.names += ['mirror-b_%d-post' % i for i in range(1, 5)] + ['other']
+        random.Random(7).shuffle(self.names)
+        self.index = SnapshotIndex([{u'Name': n} for n in self.names])
+
+    def _scan(self, prefix, postfix=None):
+        return sorted((n for n in self.names if n.startswith(prefix) and (postfix is None or postfix in n)),
+                      key=natural_keys)
+
+    def test_len(self):
+        self.assertEqual(len(self.index), len(self.names))
+        self.assertEqual(len(SnapshotIndex(self.names)), len(self.names))
+
+    def test_find(self):
+        self.assertEqual(self.index.find('mirror-a_'), ['mirror-a_%d' % i for i in range(1, 25)])
+        self.assertEqual(self.index.find('mirror-b_', '-post'), self._scan('mirror-b_', '-post'))
+        self.assertEqual(self.index.find('missing'), [])
+        self.assertEqual(self.index.find(''), self._scan(''))
+
+    def test_last(self):
+        self.assertEqual(self.index.last('mirror-a_', 3), ['mirror-a_22', 'mirror-a_23', 'mirror-a_24'])
+        self.assertEqual(self.index.last('mirror-b_', '2', '-pre'), ['mirror-b_3-pre', 'mirror-b_4-pre'])
+        self.assertEqual(self.index.last('mirror-a_', 100), self._scan('mirror-a_'))
+
+    def test_memoized(self):
+        self.assertIs(self.index.find('mirror-a_'), self.index.find('mirror-a_'))
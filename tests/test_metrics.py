@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_metrics
+Tests of the request metrics and their dumps.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from aptly_cli.api.metrics import Metrics, route_template
+from tests.fake import FakeServerTestCase
+
+
+def _record(seconds, status=200, attempt=1, route='/api/snapshots/:name', method='GET'):
+    return {'Method': method, 'Route': route, 'Url': 'http://aptly' + route, 'Status': status,
+            'RequestBytes': 10, 'ResponseBytes': 100, 'Seconds': seconds, 'Attempt': attempt}
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_route_template(self):
+        self.assertEqual(route_template('http://aptly:8080/api/snapshots/snap-1/diff/snap-2'),
+                         '/api/snapshots/:name/diff/:withSnapshot')
+        self.assertEqual(route_template('http://aptly/api/repos/main/packages?q=x'), '/api/repos/:name/packages')
+        self.assertEqual(route_template('http://aptly/api/publish/s3:eu/precise'),
+                         '/api/publish/:prefix/:distribution')
+        self.assertEqual(route_template('http://aptly/api/snapshots'), '/api/snapshots')
+        self.assertEqual(route_template('http://aptly/version'), '/version')
+
+    def test_counters_and_quantiles(self):
+        metrics = Metrics()
+        for seconds in [0.001] * 98 + [0.3, 3.0]:
+            metrics(_record(seconds))
+        metrics(_record(0.02, status=None, attempt=2))
+        series = metrics.as_dict()['Requests'][0]
+        self.assertEqual((series['Method'], series['Route'], series['Count']), ('GET', '/api/snapshots/:name', 101))
+        self.assertEqual(series['Statuses'], {'200': 100, 'error': 1})
+        self.assertEqual((series['Retries'], series['RequestBytes'], series['ResponseBytes']), (1, 1010, 10100))
+        self.assertEqual(series['MaxSeconds'], 3.0)
+        self.assertTrue(series['P50Seconds'] <= 0.005)
+        self.assertTrue(0.25 <= series['P99Seconds'] <= 0.5)
+        self.assertEqual(series['Buckets'][0], ['0.005', 98])
+        self.assertEqual(series['Buckets'][-1], ['+Inf', 0])
+
+    def test_prometheus_dump(self):
+        metrics = Metrics()
+        metrics(_record(0.02))
+        metrics(_record(0.2, status=404, method='DELETE'))
+        path = os.path.join(self.directory, 'aptly.prom')
+        metrics.dump(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE aptly_cli_request_seconds histogram', lines)
+        self.assertIn('aptly_cli_request_seconds_bucket{le="0.025",method="GET",route="/api/snapshots/:name"} 1',
+                      lines)
+        self.assertIn('aptly_cli_request_seconds_bucket{le="+Inf",method="DELETE",route="/api/snapshots/:name"} 1',
+                      lines)
+        self.assertIn('aptly_cli_request_seconds_count{method="GET",route="/api/snapshots/:name"} 1', lines)
+        self.assertIn('aptly_cli_requests_total{method="DELETE",route="/api/snapshots/:name",status="404"} 1', lines)
+        self.assertIn('aptly_cli_response_bytes_total{method="GET",route="/api/snapshots/:name"} 100', lines)
+
+    def test_json_dump(self):
+        metrics = Metrics()
+        metrics(_record(0.02))
+        path = os.path.join(self.directory, 'aptly.json')
+        metrics.dump(path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), json.loads(json.dumps(metrics.as_dict())))
+
+
+class TestRequestHook(FakeServerTestCase):
+
+    def test_records_requests(self):
+        metrics = Metrics(self.api.scheduler)
+        self.api.add_request_hook(metrics)
+        name = sorted(self.state.snapshots)[0]
+        self.api.snapshot_show(name)
+        packages = list(self.api.snapshot_iter_packages(name))
+        self.api.snapshot_show('no-such-snapshot')
+        series = dict(((s['Method'], s['Route']), s) for s in metrics.as_dict()['Requests'])
+        show = series[('GET', '/api/snapshots/:name')]
+        self.assertEqual(show['Statuses'], {'200': 1, '404': 1})
+        listed = series[('GET', '/api/snapshots/:name/packages')]
+        # streamed responses are recorded once read
+        self.assertEqual(listed['Count'], 1)
+        self.assertTrue(listed['ResponseBytes'] > sum(len(p) for p in packages))
+        self.assertEqual(metrics.as_dict()['Scheduler']['read']['Calls'], 3)
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_output
+Tests of the output formats of the cli.
+"""
+
+import json
+import unittest
+from StringIO import StringIO
+
+from aptly_cli.cli import output
+
+ITEMS = [{u'Name': u'repo-1', u'Comment': u'a\tb'}, {u'Name': u'repo-2', u'Comment': None}]
+
+
+def _write(resp, fmt):
+    out = StringIO()
+    output.write(resp, fmt, out)
+    return out.getvalue()
+
+
+def _failing_stream():
+    yield u'Pamd64 a 1 h1'
+    raise ValueError('Unexpected end of JSON array')
+
+
+class TestOutput(unittest.TestCase):
+
+    def test_json(self):
+        text = _write(iter(ITEMS), 'json')
+        self.assertEqual(json.loads(text), ITEMS)
+        self.assertTrue(text.startswith('[\n  {\n    "Comment": '))
+        self.assertEqual(_write([], 'json'), '[]\n')
+        self.assertEqual(_write({u'Version': u'1.0'}, 'json'), '{\n  "Version": "1.0"\n}\n')
+
+    def test_compact(self):
+        self.assertEqual(_write(ITEMS, 'compact'), json.dumps(ITEMS, separators=(',', ':')) + '\n')
+        self.assertEqual(_write(iter([]), 'compact'), '[]\n')
+        self.assertEqual(_write({u'a': 1}, 'compact'), '{"a":1}\n')
+
+    def test_ndjson(self):
+        lines = _write(iter(ITEMS), 'ndjson').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], ITEMS)
+        self.assertEqual(_write([], 'ndjson'), '')
+        self.assertEqual(_write({u'a': 1}, 'ndjson'), '{"a":1}\n')
+
+    def test_tsv(self):
+        self.assertEqual(_write(ITEMS, 'tsv'), 'Comment\tName\na\\tb\trepo-1\n\trepo-2\n')
+        self.assertEqual(_write([u'k1', u'kä2'], 'tsv'), 'k1\nk\xc3\xa42\n')
+        self.assertEqual(_write({u'b': [1, 2], u'a': u'x'}, 'tsv'), 'a\tx\nb\t[1,2]\n')
+        self.assertEqual(_write(u'EMPTY', 'tsv'), 'EMPTY\n')
+
+    def test_failing_stream(self):
+        self.assertEqual(_write(_failing_stream(), 'ndjson'), '"Pamd64 a 1 h1"\n\nUnexpected end of JSON array\n')
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, _write, ITEMS, 'xml')
@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_package_ref
+Tests of the parsed package keys.
+"""
+
+import unittest
+
+from aptly_cli.util import package_ref
+from aptly_cli.util.package_ref import PackageRef, keys_of, parse_refs
+
+KEY = u'Pamd64 aptly 0.9.7~rc1-2 4d3c2b1a00ff00ff'
+
+
+class TestPackageRef(unittest.TestCase):
+
+    def test_parse(self):
+        ref = PackageRef.parse(KEY)
+        self.assertEqual((ref.arch, ref.name, ref.version, ref.files_hash),
+                         (u'amd64', u'aptly', u'0.9.7~rc1-2', u'4d3c2b1a00ff00ff'))
+        self.assertEqual(ref.key, KEY)
+        self.assertIs(PackageRef.parse(ref), ref)
+        self.assertEqual(ref, PackageRef(u'amd64', u'aptly', u'0.9.7~rc1-2', u'4d3c2b1a00ff00ff'))
+        self.assertEqual(keys_of(parse_refs([KEY, KEY])), [KEY, KEY])
+
+    def test_not_a_key(self):
+        self.assertRaises(ValueError, PackageRef.parse, u'amd64 aptly 0.9.7 4d3c')
+        self.assertRaises(ValueError, PackageRef.parse, u'Pamd64 aptly 0.9.7')
+
+    def test_sort_key(self):
+        keys = [u'Pamd64 a 1.0 00', u'Pamd64 a 1.0~rc1 00', u'Pamd64 a 1:0.1 00', u'Pamd64 a 1.0a 00']
+        self.assertEqual([r.version for r in sorted(parse_refs(keys), key=lambda r: r.sort_key)],
+                         [u'1.0~rc1', u'1.0', u'1.0a', u'1:0.1'])
+
+    def test_fields_are_shared(self):
+        left = PackageRef.parse(u''.join(KEY))
+        right = PackageRef.parse(u' '.join(KEY.split(' ')))
+        self.assertIs(left.name, right.name)
+        self.assertIs(left.version, right.version)
+
+    def test_intern_table_is_bounded(self):
+        interned = dict(package_ref._interned)
+        limit = package_ref._MAX_INTERNED
+        try:
+            package_ref._MAX_INTERNED = len(interned) + 10
+            refs = [PackageRef.parse(u'Pamd64 bounded%d 1.%d 00' % (i, i)) for i in range(100)]
+            self.assertEqual(len(package_ref._interned), package_ref._MAX_INTERNED)
+            self.assertEqual(refs[99].name, u'bounded99')
+        finally:
+            package_ref._MAX_INTERNED = limit
+            package_ref._interned.clear()
+            package_ref._interned.update(interned)
+
+if __name__ == '__main__':
+    unittest.main()
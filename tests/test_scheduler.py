@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_scheduler
+Tests of the read/mutation scheduling of api calls.
+"""
+
+import threading
+import time
+import unittest
+
+from aptly_cli.api.metrics import Metrics
+from aptly_cli.api.scheduler import RequestScheduler, scheduled, READ, MUTATE
+
+# Seconds a test waits for a call, which should not block
+TIMEOUT = 5
+
+# Seconds a test waits for a call, which should block
+BLOCKED = 0.2
+
+
+class _Api(object):
+
+    """ _Api
+    Minimal api with scheduled methods, recording the slots in use during its calls.
+    """
+
+    def __init__(self, max_reads=1, max_mutations=1):
+        self.scheduler = RequestScheduler(max_reads, max_mutations)
+        self.running = []
+
+    def _running(self):
+        metrics = self.scheduler.metrics()
+        return metrics[READ]['Running'], metrics[MUTATE]['Running']
+
+    @scheduled(READ)
+    def read(self):
+        return self._running()
+
+    @scheduled(READ)
+    def read_stream(self, n):
+        for i in range(n):
+            yield i
+
+    @scheduled(MUTATE)
+    def mutate(self):
+        return self._running()
+
+    @scheduled(MUTATE)
+    def mutate_reading(self):
+        return self.read()
+
+    @scheduled(READ)
+    def read_mutating(self):
+        return self.mutate()
+
+
+def _run(func, timeout=TIMEOUT):
+    """ _run
+    Calls func in a thread and returns its result, None if it did not finish within timeout.
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def test_slot_per_call(self):
+        api = _Api()
+        self.assertEqual(api.read(), (1, 0))
+        self.assertEqual(api.mutate(), (0, 1))
+        self.assertEqual(api._running(), (0, 0))
+        self.assertEqual(api.scheduler.metrics()[READ]['Calls'], 1)
+
+    def test_read_nested_in_mutation_reuses_its_slot(self):
+        api = _Api()
+        self.assertEqual(_run(api.mutate_reading), (0, 1))
+
+    def test_mutation_nested_in_read_takes_a_mutation_slot(self):
+        api = _Api()
+        self.assertEqual(_run(api.read_mutating), (1, 1))
+        self.assertEqual(api.scheduler.metrics()[MUTATE]['Calls'], 1)
+
+    def test_mutation_nested_in_read_waits_for_the_mutation_limit(self):
+        api = _Api(max_reads=4)
+        api.scheduler.acquire(MUTATE)
+        # the mutation slot is held by this thread, another thread's nested mutation waits
+        self.assertEqual(_run(api.read_mutating, BLOCKED), None)
+        self.assertEqual(api.scheduler.metrics()[MUTATE]['Waiting'], 1)
+        api.scheduler.release(MUTATE)
+
+    def test_calls_while_iterating_a_stream(self):
+        api = _Api()
+        # with a single read slot, taken by the stream, nested calls reuse it
+        self.assertEqual(_run(lambda: [(i, api.read()) for i in api.read_stream(2)]), [(0, (1, 0)), (1, (1, 0))])
+        self.assertEqual(_run(lambda: [api.mutate() for _ in api.read_stream(2)]), [(1, 1), (1, 1)])
+        self.assertEqual(api._running(), (0, 0))
+
+    def test_streams_of_other_threads_are_limited(self):
+        api = _Api()
+        stream = api.read_stream(2)
+        next(stream)
+        self.assertEqual(_run(api.read, BLOCKED), None)
+        stream.close()
+        self.assertEqual(_run(api.read), (1, 0))
+
+    def test_stream_closed_by_another_thread(self):
+        api = _Api()
+        stream = api.read_stream(3)
+        next(stream)
+        _run(stream.close)
+        self.assertEqual(api.scheduler.held(), {READ: 0, MUTATE: 0})
+        self.assertEqual(_run(api.read), (1, 0))
+
+    def test_limits(self):
+        api = _Api(max_reads=3)
+        peak = []
+        lock = threading.Lock()
+
+        @scheduled(READ)
+        def slow(self):
+            with lock:
+                peak.append(self._running()[0])
+            time.sleep(0.02)
+
+        threads = [threading.Thread(target=slow, args=(api,)) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(api.scheduler.metrics()[READ]['Calls'], 12)
+
+    def test_metrics_dump(self):
+        api = _Api()
+        metrics = Metrics(api.scheduler)
+        api.scheduler.acquire(MUTATE)
+        _run(api.mutate, BLOCKED)
+        stats = metrics.as_dict()['Scheduler'][MUTATE]
+        self.assertEqual((stats['Limit'], stats['Calls'], stats['Running'], stats['Waiting']), (1, 1, 1, 1))
+        text = metrics.prometheus_text()
+        self.assertIn('aptly_cli_scheduler_waiting{kind="mutate"} 1\n', text)
+        self.assertIn('aptly_cli_scheduler_slots{kind="read"} 1\n', text)
+        api.scheduler.release(MUTATE)
+        # the waiting call gets the slot
+        deadline = time.time() + TIMEOUT
+        while api.scheduler.metrics()[MUTATE]['Calls'] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn('aptly_cli_scheduler_calls_total{kind="mutate"} 2\n', metrics.prometheus_text())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_stream
+Tests of the incremental JSON array decoder of AptlyApiRequests.
+"""
+
+import json
+import unittest
+
+from aptly_cli.api.api import _iter_json_array
+
+# Mixed array, containing every kind of JSON value and numbers ending in every way
+MIXED = (u'[1, 2, 30, -4500.0, 1e5, 2.5E-3, 7e+2, "Pamd64 näme 1.0 0a1b", true, false, null, '
+         u'{"Key": [1, {"a": "]"}]}, [], {}, "", 0]')
+
+
+class _Response(object):
+
+    """ _Response
+    Streamed response returning its body in the given chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+
+def _decode(body, splits):
+    bounds = [0] + list(splits) + [len(body)]
+    chunks = [body[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+    return list(_iter_json_array(_Response(chunks)))
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_every_split(self):
+        body = MIXED.encode('utf-8')
+        expected = json.loads(MIXED)
+        for i in range(len(body) + 1):
+            self.assertEqual(_decode(body, [i]), expected, 'split at %d' % i)
+            for j in range(i, len(body) + 1):
+                self.assertEqual(_decode(body, [i, j]), expected, 'split at %d, %d' % (i, j))
+
+    def test_every_chunk_size(self):
+        body = MIXED.encode('utf-8')
+        expected = json.loads(MIXED)
+        for size in range(1, len(body) + 1):
+            self.assertEqual(_decode(body, range(size, len(body), size)), expected, 'chunk size %d' % size)
+
+    def test_number_at_end(self):
+        self.assertEqual(_decode('[-4500.0]', [6]), [-4500.0])
+        self.assertEqual(_decode('[ 12 ]', [4]), [12])
+
+    def test_empty(self):
+        self.assertEqual(_decode(' [ ] ', [2]), [])
+
+    def test_no_array(self):
+        self.assertRaises(ValueError, _decode, '{"error": "not found"}', [3])
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, _decode, '[1, 2', [3])
+        self.assertRaises(ValueError, _decode, '[1, "ab', [3])
+
+if __name__ == '__main__':
+    unittest.main()
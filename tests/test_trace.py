@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_trace
+Tests of the span tracing of workflows.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from aptly_cli.util import trace
+from aptly_cli.util.util import Util
+from tests.fake import FakeServerTestCase
+
+
+def _spans(tracer, cat=None):
+    return [e for e in tracer.as_dict()['traceEvents'] if e['ph'] == 'X' and (cat is None or e['cat'] == cat)]
+
+
+def _within(inner, outer):
+    return outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'] + 1
+
+
+class TestTracer(unittest.TestCase):
+
+    def tearDown(self):
+        trace.stop()
+
+    def test_no_tracer(self):
+        self.assertIs(trace.span('phase'), trace._NO_SPAN)
+        with trace.span('phase'):
+            pass
+        self.assertEqual(trace.stop(), None)
+
+    def test_nested_spans(self):
+        tracer = trace.start()
+
+        @trace.traced()
+        def workflow():
+            with trace.span('phase', Items=2):
+                time.sleep(0.01)
+
+        workflow()
+        self.assertIs(trace.stop(), tracer)
+        outer, inner = _spans(tracer)
+        self.assertEqual((outer['name'], outer['cat']), ('workflow', trace.WORKFLOW))
+        self.assertEqual((inner['name'], inner['cat'], inner['args']), ('phase', trace.PHASE, {'Items': 2}))
+        self.assertTrue(_within(inner, outer))
+        self.assertTrue(inner['dur'] >= 10000)
+
+    def test_dump(self):
+        tracer = trace.start()
+        with trace.span('phase'):
+            pass
+        directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+        try:
+            path = os.path.join(directory, 'run.trace.json')
+            tracer.dump(path)
+            with open(path) as f:
+                dumped = json.load(f)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.assertEqual(dumped['displayTimeUnit'], 'ms')
+        meta = [e for e in dumped['traceEvents'] if e['ph'] == 'M']
+        self.assertEqual([e['args']['name'] for e in meta], ['MainThread'])
+
+
+class TestTracedWorkflow(FakeServerTestCase):
+
+    def tearDown(self):
+        trace.stop()
+        FakeServerTestCase.tearDown(self)
+
+    def test_clean_mirrored_snapshots(self):
+        tracer = trace.start()
+        self.api.add_request_hook(tracer)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            report = Util(self.api).clean_mirrored_snapshots()
+        finally:
+            sys.stdout = stdout
+
+        workflow, = _spans(tracer, trace.WORKFLOW)
+        self.assertEqual(workflow['name'], 'clean_mirrored_snapshots')
+        phases = _spans(tracer, trace.PHASE)
+        self.assertEqual([p['name'] for p in phases], ['fetch inventory', 'compute retention', 'delete'])
+        self.assertEqual(phases[-1]['args'], {'Snapshots': len(report['Results'])})
+        requests = _spans(tracer, trace.HTTP)
+        self.assertEqual(len([r for r in requests if r['name'] == 'DELETE /api/snapshots/:name']),
+                         len(report['Results']))
+        for span in phases + requests:
+            self.assertTrue(_within(span, workflow), span)
@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_upload
+Tests of uploading many files in grouped multipart requests.
+"""
+
+import os
+import shutil
+import tempfile
+
+from aptly_cli.api import api as api_module
+from tests.fake import FakeServerTestCase
+
+
+class TestFileUploadMany(FakeServerTestCase):
+
+    def config_values(self):
+        return {'cache_max_mb': '0', 'workers': '3'}
+
+    def setUp(self):
+        FakeServerTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp(prefix='aptly-cli-test-')
+
+    def tearDown(self):
+        FakeServerTestCase.tearDown(self)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _file(self, name, size=10, directory=None):
+        directory = os.path.join(self.directory, directory or '')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write('x' * size)
+        return path
+
+    def test_groups_by_count(self):
+        paths = [self._file('p%d.deb' % i) for i in range(5)]
+        results = self.api.file_upload_many('up', paths, max_files=2)
+        self.assertEqual([r['Uploaded'] for r in results], ['up/p%d.deb' % i for i in range(5)])
+        self.assertEqual(len(self.routes('POST')), 3)
+        self.assertEqual(sorted(self.api.file_list('up')), ['p%d.deb' % i for i in range(5)])
+
+    def test_groups_by_size(self):
+        paths = [self._file('small%d.deb' % i, 40) for i in range(4)] + [self._file('big.deb', 500)]
+        results = self.api.file_upload_many('up', paths, max_bytes=100)
+        self.assertTrue(all(r['Error'] is None for r in results))
+        # two groups of two small files, the big file on its own
+        self.assertEqual(len(self.routes('POST')), 3)
+
+    def test_missing_and_duplicate_files(self):
+        first = self._file('same.deb', directory='a')
+        second = self._file('same.deb', directory='b')
+        missing = os.path.join(self.directory, 'missing.deb')
+        results = self.api.file_upload_many('up', [first, missing, second, first])
+        self.assertEqual([r['File'] for r in results], [first, missing, second, first])
+        self.assertEqual(results[0]['Uploaded'], 'up/same.deb')
+        self.assertEqual(results[1]['Error'], 'No such file: ' + missing)
+        self.assertIn('Duplicate file name same.deb', results[2]['Error'])
+        self.assertIn('Duplicate file name same.deb', results[3]['Error'])
+        self.assertEqual(len(self.routes('POST')), 1)
+
+    def test_workers_from_config(self):
+        calls = []
+        run_bounded = api_module.run_bounded
+
+        def recording(func, items, workers):
+            calls.append(workers)
+            return run_bounded(func, items, workers)
+        api_module.run_bounded = recording
+        try:
+            self.api.file_upload_many('up', [self._file('a.deb')])
+            self.api.file_upload_many('up', [self._file('b.deb')], workers=2)
+        finally:
+            api_module.run_bounded = run_bounded
+        self.assertEqual(calls, [3, 2])
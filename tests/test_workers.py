@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_workers
+Tests of the worker pool helpers.
+"""
+
+import threading
+import time
+import unittest
+
+from aptly_cli.api.workers import first_match, imap_bounded, run_bounded
+
+
+class _Calls(object):
+
+    """ _Calls
+    Function recording, which calls started and finished.
+    """
+
+    def __init__(self, seconds=0.0, fail=None):
+        self.seconds = seconds
+        self.fail = fail
+        self.started = []
+        self.finished = []
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.started.append(item)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.finished.append(item)
+        if item == self.fail:
+            raise ValueError('failed %s' % item)
+        return item * 10
+
+
+class TestRunBounded(unittest.TestCase):
+
+    def test_order(self):
+        self.assertEqual(run_bounded(lambda x: x * 2, range(20), 4), [x * 2 for x in range(20)])
+        self.assertEqual(run_bounded(lambda x: x * 2, [], 4), [])
+
+    def test_imap_order(self):
+        self.assertEqual(list(imap_bounded(lambda x: x * 2, iter(range(20)), 3)), [x * 2 for x in range(20)])
+
+
+class TestFirstMatch(unittest.TestCase):
+
+    def test_no_match(self):
+        calls = _Calls()
+        completed, match = first_match(calls, range(10), lambda r: False, 3)
+        self.assertEqual(match, None)
+        self.assertEqual(sorted(completed), [(i, i * 10) for i in range(10)])
+
+    def test_match_cancels_the_rest(self):
+        calls = _Calls(0.01)
+        completed, match = first_match(calls, range(100), lambda r: r == 20, 4)
+        self.assertEqual(match, (2, 20))
+        self.assertIn((2, 20), completed)
+        self.assertTrue(len(calls.started) < 100)
+
+    def test_returns_before_calls_in_flight(self):
+        calls = _Calls(0.5)
+        start = time.time()
+        completed, match = first_match(lambda x: x if x == 3 else calls(x), range(8), lambda r: r == 3, 4)
+        # the slow calls started before the match are still running
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual((completed, match), ([(3, 3)], (3, 3)))
+        self.assertTrue(set([0, 1, 2]) <= set(calls.started))
+        self.assertEqual(calls.finished, [])
+
+    def test_error(self):
+        calls = _Calls(0.01, fail=3)
+        self.assertRaises(ValueError, first_match, calls, range(50), lambda r: False, 2)
+        self.assertTrue(len(calls.started) < 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_workflows
+Integration tests of the cli and the Util workflows against the fake aptly server.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from aptly_cli.cli import cli
+from aptly_cli.util.debversion import version_key
+from aptly_cli.util.util import Util
+from tests.fake import FakeServerTestCase, SEED
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _config_file(values):
+    lines = ['[general]']
+    lines.extend('%s=%s' % (k, v) for k, v in sorted(values.items()) if k not in ('repos', 'staging_snap_pre_post'))
+    lines.append('[3rd_party]')
+    lines.extend('%s=%s' % (k, values[k]) for k in ('repos', 'staging_snap_pre_post'))
+    return '\n'.join(lines) + '\n'
+
+
+class TestWorkflows(FakeServerTestCase):
+
+    def setUp(self):
+        FakeServerTestCase.setUp(self)
+        self.util = Util(self.api)
+
+    @staticmethod
+    def _quiet(func, *args):
+        """ _quiet
+        Returns the result of func and its output.
+        """
+        stdout = sys.stdout
+        sys.stdout = out = StringIO()
+        try:
+            return func(*args), out.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def _run(self, *argv):
+        """ _run
+        Runs the command line argv in this process and returns its output.
+        """
+        opts, args = cli._get_parser_opts().parse_args(list(argv))
+        return self._quiet(cli._execute_opts, opts, args, self.util)[1]
+
+    def _mirror_snapshots(self, prefix):
+        return [name for name in self.state.snapshots if name.startswith(prefix)]
+
+    def test_api_commands(self):
+        self.assertEqual(json.loads(self._run('--get_version')), {'Version': '0.9.7'})
+        repos = json.loads(self._run('--repo_list'))
+        self.assertEqual([r['Name'] for r in repos], ['repo-00', 'repo-01', 'repo-02'])
+        lines = self._run('--repo_show_packages', 'repo-01', '--output', 'ndjson').splitlines()
+        self.assertEqual([json.loads(l) for l in lines], self.state.repo_packages['repo-01'])
+        lines = self._run('--repo_list', '--output', 'tsv').splitlines()
+        self.assertEqual([l.split('\t')[lines[0].split('\t').index('Name')] for l in lines[1:]],
+                         [r['Name'] for r in repos])
+
+    def test_get_last_snapshots(self):
+        output = self._run('--get_last_snapshots', 'mirror-01_', '3')
+        self.assertEqual(json.loads(output), sorted(self._mirror_snapshots('mirror-01_'))[-3:])
+
+    def test_diff_both_last_snapshots_mirrors(self):
+        output = self._run('--diff_both_last_snapshots_mirrors')
+        self.assertIn('New content in mirror: mirror-0', output)
+
+        # every mirror changed, the first diff done wins
+        check = self.util.check_mirrors_for_updates()
+        self.assertEqual(len(check['Changed']), 1)
+        self.assertEqual(sorted(check['Checked'] + check['Cancelled']), self.config.prefixes_mirrors)
+        last = sorted(self._mirror_snapshots(check['Changed'][0]))[-2:]
+        expected = self.state.snapshot_diff(last[0], last[1])
+        self.assertEqual(sorted(check['Diff']), sorted(expected))
+
+    def test_clean_repo_packages(self):
+        before = dict((name, list(keys)) for name, keys in self.state.repo_packages.items())
+        self._run('--clean_repo_packages')
+        keep = self.config.save_last_pkg
+        for repo, keys in before.items():
+            left = self.state.repo_packages[repo]
+            for prefix in self.config.package_prefixes:
+                versions = sorted((k.split(' ')[2] for k in keys if k.split(' ')[1] == prefix), key=version_key)
+                kept = [k.split(' ')[2] for k in left if k.split(' ')[1] == prefix]
+                self.assertEqual(sorted(kept, key=version_key), versions[-keep:], '%s %s' % (repo, prefix))
+            # other packages are kept
+            others = [k for k in keys if k.split(' ')[1] not in self.config.package_prefixes]
+            self.assertEqual([k for k in left if k.split(' ')[1] not in self.config.package_prefixes], others)
+
+    def test_list_repos_and_packages(self):
+        # streamed, never buffered as a whole
+        self.api.repo_show_packages = lambda *args: self.fail('package list buffered')
+        lines = self._run('--list_repos_and_packages').splitlines()
+        expected = []
+        for name in sorted(self.state.repos):
+            expected.append(name)
+            expected.extend(self.state.repo_packages[name])
+        self.assertEqual(lines, expected)
+        self.assertEqual(self.routes('GET').count('/api/repos/:name/packages'), len(self.state.repos))
+
+    def test_publish_switch_3rdparty_production(self):
+        self._run('--publish_switch_3rdparty_production')
+        staging = sorted(self._mirror_snapshots('3rdparty-'))[-1]
+        for pub in self.state.publish_list():
+            self.assertEqual([s['Name'] for s in pub['Sources']], [staging])
+
+    def test_clean_mirrored_snapshots(self):
+        before = dict((p, sorted(self._mirror_snapshots(p))) for p in self.config.prefixes_mirrors)
+        report = self._quiet(self.util.clean_mirrored_snapshots)[0]
+        for prefix, names in before.items():
+            self.assertEqual(sorted(self._mirror_snapshots(prefix)), names[-self.config.save_last_snap:])
+        self.assertEqual(len(report['Results']), sum(len(n) - self.config.save_last_snap for n in before.values()))
+        self.assertTrue(all(r['Deleted'] for r in report['Results']))
+        # staging snapshots are kept
+        self.assertEqual(len(self._mirror_snapshots('3rdparty-')), SEED['staging'])
+        # a single inventory of snapshots
+        self.assertEqual(self.routes('GET').count('/api/snapshots'), 1)
+
+
+class TestCli(FakeServerTestCase):
+
+    """ TestCli
+    Runs the installed entry point, as CI scripts do.
+    """
+
+    def setUp(self):
+        FakeServerTestCase.setUp(self)
+        self.home = tempfile.mkdtemp(prefix='aptly-cli-test-')
+        with open(os.path.join(self.home, 'aptly-cli.conf'), 'w') as f:
+            f.write(_config_file(self.values))
+
+    def tearDown(self):
+        FakeServerTestCase.tearDown(self)
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def _cli(self, *argv):
+        env = dict(os.environ, HOME=self.home, PYTHONPATH=ROOT)
+        proc = subprocess.Popen([sys.executable, '-m', 'aptly_cli.cli.cli'] + list(argv), env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    def test_exit_status(self):
+        status, out, err = self._cli('--get_version')
+        self.assertEqual((status, json.loads(out)), (0, {'Version': '0.9.7'}))
+        status, out, err = self._cli('--bogus')
+        self.assertEqual(status, 2)
+        self.assertIn('no such option', err)
+
+    def test_batch_exit_status(self):
+        batch = os.path.join(self.home, 'ops.jsonl')
+        with open(batch, 'w') as f:
+            f.write('{"method": "get_version"}\n{"method": "snapshot_list"}\n')
+        self.assertEqual(self._cli('--batch', batch)[0], 0)
+        with open(batch, 'a') as f:
+            f.write('{"method": "no_such_method"}\n')
+        status, out, err = self._cli('--batch', batch)
+        self.assertEqual(status, 1)
+        self.assertEqual(len(out.splitlines()), 3)
+
+if __name__ == '__main__':
+    unittest.main()